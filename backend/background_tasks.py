@@ -1,42 +1,202 @@
 import asyncio
+import hashlib
+import json
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-import random
+from sqlalchemy import delete, select, update
+from typing import List, Dict, Any, Optional, Set, Tuple
+import time
 
-from models import Group, AffiliateLink, ProcessedMessage, PostedMessage, ActivityLog
+from config import settings
+from models import Group, ProcessedMessage, PostedMessage, ActivityLog, SourceCursor, SourceGroup, InboundMessage, ParticipantEvent
 from whapi_client import WhapiClient, LinkProcessor
-from database import SessionLocal
+from bot_registry import BotRegistry
+from fanout import FanoutScheduler
+from pipeline import MessagePipeline
+from capacity import CapacityScheduler, resolve_group_status
+from redirect_cache import group_snapshot
+from rule_cache import affiliate_rule_cache
+from link_resolver import ShortLinkResolver
+from write_behind import delivery_writer
+from send_queue import SendQueue
+from seen_index import SeenMessageIndex, insert_processed_message
+from fingerprint import FingerprintIndex, serialize_urls, to_signed
+from media_store import MediaStore, extract_media, serialize_media, deserialize_media
+from database import AsyncSessionLocal, insert_ignore
 
 logger = logging.getLogger(__name__)
 
+# Ações dos eventos groups_participants da Whapi
+PARTICIPANT_JOIN_ACTIONS = {"add", "join"}
+PARTICIPANT_LEAVE_ACTIONS = {"remove", "leave"}
+# Tempo em que um evento aplicado fica registrado contra reentregas, e intervalo da limpeza
+PARTICIPANT_EVENT_RETENTION = timedelta(days=7)
+PARTICIPANT_EVENT_PRUNE_INTERVAL = 3600.0
+
 class BackgroundTaskManager:
     """Gerenciador de tarefas em background"""
     
-    def __init__(self, whapi_client: WhapiClient = None):
+    def __init__(self, whapi_client: WhapiClient = None, fanout_scheduler: FanoutScheduler = None):
         self.whapi_client = whapi_client or WhapiClient()
+        self.fanout_scheduler = fanout_scheduler or FanoutScheduler()
+        # Bots postadores com token próprio (POSTER_BOTS), escolhidos pelo bot_number do grupo;
+        # respostas 429 pausam só a partição (token) que as recebeu
+        self.bot_registry = BotRegistry(self.whapi_client, self.fanout_scheduler)
+        self.pipeline = MessagePipeline(
+            dedupe=self._dedupe_message,
+            rewrite=self._rewrite_message,
+            fanout=self._fanout_message
+        )
+        if settings.members_events_enabled:
+            # Lotação atualizada por eventos: o polling apenas corrige desvios
+            refresh_min = refresh_max = settings.members_drift_correction_interval
+        else:
+            refresh_min = settings.members_refresh_min_interval
+            refresh_max = settings.members_refresh_max_interval
+        self.capacity_scheduler = CapacityScheduler(
+            min_interval=refresh_min,
+            max_interval=refresh_max,
+            calls_per_hour=settings.members_refresh_budget_per_hour
+        )
+        self.link_resolver = ShortLinkResolver()
+        self.seen_index = SeenMessageIndex()
+        self.fingerprint_index = FingerprintIndex()
+        self.send_queue = SendQueue()
+        self.media_store = MediaStore()
+        # Cursores do polling: (timestamp, id) da última mensagem buscada e da última confirmada
+        self._fetch_cursors: Dict[str, Tuple[int, Optional[str]]] = {}
+        self._confirmed_cursors: Dict[str, Tuple[int, Optional[str]]] = {}
+        # Primeira mensagem do polling cujo dedupe falhou: segura os dois cursores até ser registrada
+        self._held_cursors: Dict[str, Tuple[int, str]] = {}
+        # Grupos de origem ativos (recarregados periodicamente) e limite de polls simultâneos
+        self._source_groups: Optional[Dict[str, Dict[str, Any]]] = None
+        self._source_groups_loaded_at = 0.0
+        self._source_group_seeded = False
+        self._poll_semaphore = asyncio.Semaphore(settings.source_poll_concurrency)
+        # Mensagens de webhook gravadas pela API já entregues ao pipeline deste processo
+        self._inbound_inflight: set = set()
+        self._participant_events_pruned_at = 0.0
         self.is_running = False
     
-    async def start_monitoring(self, source_group_id: str, check_interval: int = 60):
+    async def get_source_groups(self, max_age: float = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Grupos de origem ativos (cache de SOURCE_GROUPS_REFRESH_INTERVAL segundos)
+        
+        O SOURCE_GROUP_ID das configurações é cadastrado automaticamente.
+        
+        Returns:
+            Grupos por ID (id, name, ingest_mode, poll_interval, priority)
+        """
+        max_age = settings.source_groups_refresh_interval if max_age is None else max_age
+        if self._source_groups is not None and time.monotonic() - self._source_groups_loaded_at < max_age:
+            return self._source_groups
+        
+        async with AsyncSessionLocal() as db:
+            if settings.source_group_id and not self._source_group_seeded:
+                await db.execute(insert_ignore(db, SourceGroup).values(
+                    id=settings.source_group_id,
+                    name=settings.source_group_id
+                ))
+                await db.commit()
+                self._source_group_seeded = True
+            
+            sources = (await db.scalars(
+                select(SourceGroup).where(SourceGroup.is_active == True).order_by(SourceGroup.priority.desc())
+            )).all()
+        
+        self._source_groups = {
+            source.id: {
+                "id": source.id,
+                "name": source.name,
+                "ingest_mode": source.ingest_mode or settings.ingest_mode,
+                "poll_interval": source.poll_interval,
+                "priority": source.priority or 0
+            }
+            for source in sources
+        }
+        self._source_groups_loaded_at = time.monotonic()
+        return self._source_groups
+    
+    def invalidate_source_groups(self):
+        """Forçar a recarga dos grupos de origem na próxima consulta"""
+        self._source_groups = None
+    
+    @staticmethod
+    def _poll_interval_for(source: Dict[str, Any]) -> int:
+        """Intervalo do polling de um grupo de origem de acordo com o modo de ingestão"""
+        if source["poll_interval"]:
+            return source["poll_interval"]
+        if source["ingest_mode"] == "webhook":
+            return settings.webhook_fallback_poll_interval
+        return settings.poll_interval
+    
+    async def start_monitoring(self):
+        """
+        Monitorar em paralelo todos os grupos de origem ativos
+        
+        Cada grupo tem o próprio loop de polling (com cursor e intervalo
+        próprios) e todos alimentam o mesmo pipeline. A lista é recarregada a
+        cada SOURCE_GROUPS_REFRESH_INTERVAL segundos: grupos novos passam a ser
+        monitorados e grupos removidos ou desativados deixam de ser.
+        
+        Também entrega ao pipeline as mensagens de webhook gravadas pela API
+        em modo somente API (RUN_BACKGROUND_TASKS=false).
+        """
+        self.is_running = True
+        self.pipeline.start()
+        logger.info("Iniciando monitoramento dos grupos de origem")
+        
+        drain_task = asyncio.create_task(self._drain_inbound())
+        pollers: Dict[str, asyncio.Task] = {}
+        try:
+            while self.is_running:
+                try:
+                    sources = await self.get_source_groups(max_age=0)
+                    
+                    for source_id in list(pollers):
+                        if source_id not in sources or pollers[source_id].done():
+                            pollers.pop(source_id).cancel()
+                    for source_id in sources:
+                        if source_id not in pollers:
+                            pollers[source_id] = asyncio.create_task(self._poll_source(source_id))
+                    
+                    await asyncio.sleep(settings.source_groups_refresh_interval)
+                
+                except asyncio.CancelledError:
+                    logger.info("Monitoramento cancelado")
+                    break
+                
+                except Exception as e:
+                    logger.error(f"Erro ao carregar grupos de origem: {str(e)}")
+                    await asyncio.sleep(settings.source_groups_refresh_interval)
+        finally:
+            tasks = [drain_task, *pollers.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _poll_source(self, source_group_id: str):
         """
-        Iniciar monitoramento contínuo do grupo de origem
+        Loop de polling de um grupo de origem
         
         Args:
             source_group_id: ID do grupo a monitorar
-            check_interval: Intervalo em segundos entre verificações
         """
-        self.is_running = True
         logger.info(f"Iniciando monitoramento do grupo {source_group_id}")
         
         consecutive_errors = 0
         max_consecutive_errors = 5
         
         while self.is_running:
-            db = None
+            source = (self._source_groups or {}).get(source_group_id)
+            if source is None:
+                return
+            check_interval = self._poll_interval_for(source)
+            
             try:
-                db = SessionLocal()
-                await self._check_and_process_messages(source_group_id, db)
+                # Limitar quantos grupos consultam a Whapi ao mesmo tempo
+                async with self._poll_semaphore:
+                    await self._check_and_process_messages(source_group_id, source["priority"])
                 
                 # Reset contador de erros em caso de sucesso
                 consecutive_errors = 0
@@ -44,12 +204,12 @@ class BackgroundTaskManager:
                 await asyncio.sleep(check_interval)
             
             except asyncio.CancelledError:
-                logger.info("Monitoramento cancelado")
-                break
+                logger.info(f"Monitoramento do grupo {source_group_id} cancelado")
+                raise
             
             except Exception as e:
                 consecutive_errors += 1
-                logger.error(f"Erro no monitoramento (tentativa {consecutive_errors}/{max_consecutive_errors}): {str(e)}")
+                logger.error(f"Erro no monitoramento do grupo {source_group_id} (tentativa {consecutive_errors}/{max_consecutive_errors}): {str(e)}")
                 
                 # Se muitos erros consecutivos, aumentar intervalo
                 if consecutive_errors >= max_consecutive_errors:
@@ -58,266 +218,750 @@ class BackgroundTaskManager:
                     consecutive_errors = 0  # Reset após espera longa
                 else:
                     await asyncio.sleep(check_interval)
-            
-            finally:
-                if db:
-                    db.close()
     
-    async def _check_and_process_messages(self, source_group_id: str, db: Session):
+    async def _check_and_process_messages(self, source_group_id: str, priority: int = 0):
         """
-        Verificar novas mensagens e processá-las
+        Buscar todas as mensagens novas desde o cursor e entregá-las ao pipeline
+        
+        Pagina a partir da marca d'água do grupo, em ordem cronológica, para que
+        rajadas maiores que uma página e o backlog após uma parada não se percam.
         
         Args:
             source_group_id: ID do grupo de origem
-            db: Sessão do banco de dados
+            priority: Prioridade do grupo no pipeline
         """
         try:
-            # Obter mensagens recentes do grupo
-            messages = await self.whapi_client.get_messages(source_group_id, limit=10)
+            cursor = self._fetch_cursors.get(source_group_id)
+            if cursor is None:
+                cursor = await self._load_cursor(source_group_id)
             
-            if not messages:
-                logger.debug(f"Nenhuma mensagem encontrada no grupo {source_group_id}")
-                return
+            started_at = time.monotonic()
+            fetched = 0
+            batch: List[Dict[str, Any]] = []
             
-            # Processar cada mensagem
-            for message in messages:
-                try:
-                    await self._process_message(message, source_group_id, db)
-                except Exception as e:
-                    logger.error(f"Erro ao processar mensagem individual: {str(e)}")
-                    # Continuar processando outras mensagens
+            async for message in self.whapi_client.iter_messages(
+                source_group_id,
+                time_from=cursor[0],
+                page_size=settings.poll_page_size
+            ):
+                message_id = message.get("id")
+                if not message_id or message_id == cursor[1]:
                     continue
+                
+                batch.append(message)
+                cursor = (max(cursor[0], message.get("timestamp") or 0), message_id)
+                
+                if len(batch) >= settings.poll_page_size:
+                    fetched += await self._submit_polled_batch(batch, source_group_id, priority)
+                    batch = []
+            
+            if batch:
+                fetched += await self._submit_polled_batch(batch, source_group_id, priority)
+            
+            self._fetch_cursors[source_group_id] = self._rewind_to_held(source_group_id, cursor)
+            self.pipeline.metrics["fetch"].record(time.monotonic() - started_at)
+            
+            if fetched:
+                logger.info(f"{fetched} mensagem(ns) nova(s) no grupo {source_group_id}")
+            else:
+                logger.debug(f"Nenhuma mensagem nova no grupo {source_group_id}")
+            
+            await self._save_cursor(source_group_id)
         
         except Exception as e:
-            logger.error(f"Erro ao verificar mensagens: {str(e)}")
+            logger.error(f"Erro ao verificar mensagens do grupo {source_group_id}: {str(e)}")
             raise
     
-    async def _process_message(self, message: Dict[str, Any], source_group_id: str, db: Session):
+    async def _submit_polled_batch(self, messages: List[Dict[str, Any]], source_group_id: str, priority: int = 0) -> int:
         """
-        Processar uma mensagem individual
+        Entregar ao pipeline as mensagens do polling que ainda não foram vistas
         
-        Args:
-            message: Dados da mensagem
-            source_group_id: ID do grupo de origem
-            db: Sessão do banco de dados
+        As já vistas são filtradas pelo índice em memória e, para as restantes,
+        por uma única consulta ao banco, em vez de uma consulta por mensagem.
+        
+        Returns:
+            Quantidade de mensagens novas entregues
         """
-        try:
-            message_id = message.get("id")
-            message_text = message.get("body", "")
-            
-            if not message_id or not message_text:
-                logger.debug("Mensagem sem ID ou texto, ignorando")
-                return
-            
-            # Verificar se já foi processada
-            existing = db.query(ProcessedMessage).filter(
-                ProcessedMessage.id == message_id
-            ).first()
+        unseen = set(await self.seen_index.filter_unseen(message["id"] for message in messages))
+        submitted = 0
+        
+        for message in messages:
+            item = {"message": message, "source_group_id": source_group_id, "from_poll": True}
+            if message["id"] not in unseen:
+                # Já processada: apenas avançar o cursor confirmado
+                self._confirm_cursor(item)
+                continue
             
-            if existing:
-                logger.debug(f"Mensagem {message_id} já foi processada")
+            # Entregar ao pipeline (aguarda se a fila estiver cheia)
+            await self.pipeline.submit(item, priority)
+            submitted += 1
+        
+        return submitted
+    
+    async def _load_cursor(self, source_group_id: str) -> Tuple[int, Optional[str]]:
+        """
+        Carregar a marca d'água persistida de um grupo de origem
+        
+        Sem cursor salvo, começa POLL_INITIAL_LOOKBACK segundos no passado.
+        """
+        async with AsyncSessionLocal() as db:
+            cursor = await db.get(SourceCursor, source_group_id)
+        
+        if cursor:
+            logger.info(f"Retomando grupo {source_group_id} a partir do timestamp {cursor.last_message_timestamp}")
+            return (cursor.last_message_timestamp, cursor.last_message_id)
+        
+        return (int(time.time()) - settings.poll_initial_lookback, None)
+    
+    async def _save_cursor(self, source_group_id: str):
+        """
+        Persistir a marca d'água das mensagens já confirmadas pelo estágio de dedupe
+        
+        Só avança: mensagens ainda nas filas serão buscadas de novo após um
+        restart e descartadas pelo dedupe, sem lacunas.
+        """
+        confirmed = self._confirmed_cursors.get(source_group_id)
+        if confirmed is None:
+            return
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                cursor = await db.get(SourceCursor, source_group_id)
+                
+                if cursor is None:
+                    db.add(SourceCursor(
+                        source_group_id=source_group_id,
+                        last_message_timestamp=confirmed[0],
+                        last_message_id=confirmed[1]
+                    ))
+                elif confirmed[0] >= cursor.last_message_timestamp:
+                    cursor.last_message_timestamp = confirmed[0]
+                    cursor.last_message_id = confirmed[1]
+                
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao salvar cursor do grupo {source_group_id}: {str(e)}")
+                await db.rollback()
+    
+    def _rewind_to_held(self, source_group_id: str, cursor: Tuple[int, Optional[str]]) -> Tuple[int, Optional[str]]:
+        """Recuar o cursor de busca até a mensagem cujo dedupe falhou, para buscá-la de novo"""
+        held = self._held_cursors.get(source_group_id)
+        if held is None or held[0] > cursor[0]:
+            return cursor
+        return (held[0], None)
+    
+    def _hold_cursor(self, item: Dict[str, Any]):
+        """
+        Segurar os cursores do grupo em uma mensagem do polling cujo dedupe falhou
+        
+        O cursor confirmado não passa dela e o de busca recua até ela, então a
+        mensagem é buscada de novo no próximo ciclo em vez de ficar para trás.
+        """
+        if not item.get("from_poll"):
+            return
+        
+        message = item["message"]
+        source_group_id = item["source_group_id"]
+        timestamp = message.get("timestamp") or 0
+        held = self._held_cursors.get(source_group_id)
+        if held is None or timestamp < held[0]:
+            self._held_cursors[source_group_id] = (timestamp, message.get("id"))
+        
+        cursor = self._fetch_cursors.get(source_group_id)
+        if cursor is not None:
+            self._fetch_cursors[source_group_id] = self._rewind_to_held(source_group_id, cursor)
+        logger.warning(f"Cursor do grupo {source_group_id} retido na mensagem {message.get('id')} para nova tentativa")
+    
+    def _confirm_cursor(self, item: Dict[str, Any]):
+        """Avançar o cursor confirmado com uma mensagem do polling já tratada pelo dedupe"""
+        if not item.get("from_poll"):
+            return
+        
+        message = item["message"]
+        timestamp = message.get("timestamp") or 0
+        held = self._held_cursors.get(item["source_group_id"])
+        if held is not None:
+            if message.get("id") == held[1]:
+                # A mensagem retida foi registrada: os cursores voltam a avançar
+                del self._held_cursors[item["source_group_id"]]
+            elif timestamp >= held[0]:
                 return
+        
+        confirmed = self._confirmed_cursors.get(item["source_group_id"])
+        if confirmed is None or timestamp >= confirmed[0]:
+            self._confirmed_cursors[item["source_group_id"]] = (timestamp, message.get("id"))
+    
+    async def ingest_webhook_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Entregar ao pipeline as mensagens recebidas via webhook
+        
+        Em modo somente API (RUN_BACKGROUND_TASKS=false) este processo não
+        roda o pipeline: as mensagens são apenas gravadas em inbound_messages
+        e processadas pelo worker.
+        
+        Args:
+            messages: Mensagens do evento da Whapi
+        
+        Returns:
+            Quantidade de mensagens aceitas
+        """
+        sources = await self.get_source_groups()
+        items = []
+        
+        for message in messages:
+            # Ignorar mensagens de chats que não são grupos de origem, enviadas pelo próprio bot ou sem ID
+            if not message.get("id") or message.get("from_me"):
+                continue
+            source = sources.get(message.get("chat_id"))
+            if source is None:
+                continue
+            items.append((message, source))
+        
+        if not items:
+            return 0
+        
+        if settings.run_background_tasks:
+            self.pipeline.start()
+            for message, source in items:
+                await self.pipeline.submit({
+                    "message": message,
+                    "source_group_id": source["id"]
+                }, source["priority"])
+        else:
+            await self._stage_inbound(items)
+        
+        logger.info(f"{len(items)} mensagem(ns) recebida(s) via webhook")
+        return len(items)
+    
+    async def _stage_inbound(self, items: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+        """Gravar as mensagens do webhook para o worker (sem processá-las neste processo)"""
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert_ignore(db, InboundMessage), [
+                    {"id": message["id"], "source_group_id": source["id"], "payload": json.dumps(message)}
+                    for message, source in items
+                ])
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+    
+    async def _drain_inbound(self):
+        """
+        Entregar ao pipeline as mensagens de webhook gravadas pela API
+        
+        Cada linha é apagada só depois que o dedupe registra (ou descarta) a
+        mensagem; se o processo parar antes, ela é lida de novo.
+        """
+        while self.is_running:
+            try:
+                async with AsyncSessionLocal() as db:
+                    rows = (await db.scalars(
+                        select(InboundMessage).order_by(InboundMessage.received_at).limit(self.pipeline.queue_size)
+                    )).all()
+                
+                if rows:
+                    sources = await self.get_source_groups()
+                for row in rows:
+                    if row.id in self._inbound_inflight:
+                        continue
+                    self._inbound_inflight.add(row.id)
+                    priority = (sources.get(row.source_group_id) or {}).get("priority", 0)
+                    await self.pipeline.submit({
+                        "message": json.loads(row.payload),
+                        "source_group_id": row.source_group_id,
+                        "inbound": True
+                    }, priority)
             
-            # Extrair links
-            links = LinkProcessor.extract_links(message_text)
-            
-            if not links:
-                logger.debug(f"Mensagem {message_id} não contém links")
-                return
+            except asyncio.CancelledError:
+                raise
             
-            logger.info(f"Processando mensagem {message_id} com {len(links)} link(s)")
+            except Exception as e:
+                logger.error(f"Erro ao ler mensagens de webhook gravadas: {str(e)}")
             
-            # Registrar mensagem processada
-            processed_msg = ProcessedMessage(
-                id=message_id,
-                source_group_id=source_group_id,
-                message_text=message_text,
-                original_links=str(links)
-            )
-            db.add(processed_msg)
-            db.commit()
+            await asyncio.sleep(settings.inbound_drain_interval)
+    
+    async def _ack_inbound(self, item: Dict[str, Any]):
+        """Apagar a mensagem de webhook gravada depois que o dedupe a tratou"""
+        if not item.get("inbound"):
+            return
+        
+        message_id = item["message"]["id"]
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(delete(InboundMessage).where(InboundMessage.id == message_id))
+                await db.commit()
+            except Exception as e:
+                # A linha é lida de novo e descartada pelo dedupe
+                logger.error(f"Erro ao apagar mensagem de webhook {message_id}: {str(e)}")
+                await db.rollback()
+        self._inbound_inflight.discard(message_id)
+    
+    async def _dedupe_message(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Estágio de dedupe: descartar mensagens já processadas ou sem links
+        
+        Args:
+            item: Mensagem recebida e ID do grupo de origem
+        
+        Returns:
+            Item com ID, texto e links da mensagem, ou None se deve ser descartada
+        """
+        try:
+            result = await self._register_new_message(item)
+        except Exception:
+            # Não avançar além de uma mensagem que não foi registrada
+            self._hold_cursor(item)
+            if item.get("inbound"):
+                # Continua gravada: a próxima leitura a entrega de novo
+                self._inbound_inflight.discard(item["message"]["id"])
+            raise
+        self._confirm_cursor(item)
+        await self._ack_inbound(item)
+        return result
+    
+    async def _register_new_message(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Registrar a mensagem como processada se for nova e contiver links"""
+        message = item["message"]
+        message_id = message.get("id")
+        # Ofertas com imagem, vídeo ou documento: o texto é a legenda
+        media, caption = extract_media(message)
+        # A Whapi envia o texto em "body" ou em "text.body", conforme o tipo de evento
+        message_text = message.get("body") or (message.get("text") or {}).get("body", "") or caption
+        
+        if not message_id or not message_text:
+            logger.debug("Mensagem sem ID ou texto, ignorando")
+            return None
+        
+        if message_id in self.seen_index:
+            logger.debug(f"Mensagem {message_id} já foi processada")
+            return None
+        
+        # Extrair links
+        links = LinkProcessor.extract_links(message_text)
+        
+        if not links:
+            logger.debug(f"Mensagem {message_id} não contém links")
+            self.seen_index.add(message_id)
+            return None
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                # Registrar mensagem processada (atômico: a mesma mensagem pode chegar por polling e webhook)
+                inserted = await insert_processed_message(db, {
+                    "id": message_id,
+                    "source_group_id": item["source_group_id"],
+                    "message_text": message_text,
+                    "original_links": str(links),
+                    "media": serialize_media(media)
+                })
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao processar mensagem: {str(e)}")
+                await db.rollback()
+                raise
+        
+        self.seen_index.add(message_id)
+        
+        if not inserted:
+            logger.debug(f"Mensagem {message_id} já foi processada")
+            return None
+        
+        logger.info(f"Processando mensagem {message_id} com {len(links)} link(s){' e mídia' if media else ''}")
+        
+        return {**item, "message_id": message_id, "message_text": message_text, "links": links, "media": media}
+    
+    async def _rewrite_message(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Estágio de rewrite: substituir links originais por links de afiliado
+        
+        Repostagens de ofertas transmitidas recentemente são suprimidas aqui,
+        antes do fan-out.
+        
+        Args:
+            item: Item produzido pelo estágio de dedupe
+        
+        Returns:
+            Item com o texto processado, ou None se a mensagem foi suprimida
+        """
+        # Regras de afiliado compiladas (em memória; recarregadas só quando mudam)
+        matcher = await affiliate_rule_cache.matcher()
+        
+        if not len(matcher):
+            logger.warning("Nenhum link de afiliado configurado")
+        
+        # Expandir links encurtados para aplicar a regra do domínio final
+        resolved_links = await self.link_resolver.resolve_all(item["links"])
+        
+        # Repostagem de uma oferta já transmitida na janela: não retransmitir
+        fingerprint = FingerprintIndex.fingerprint(item["message_text"], item["links"], resolved_links)
+        duplicate_of = self.fingerprint_index.find_duplicate(fingerprint, message_id=item["message_id"])
+        await self._save_fingerprint(item["message_id"], fingerprint, duplicate_of)
+        
+        if duplicate_of is None:
+            # O índice em memória não vê o que outros processos transmitiram: o banco decide
+            duplicate_of = await self.fingerprint_index.find_duplicate_in_db(item["message_id"], fingerprint)
+            if duplicate_of:
+                await self._save_fingerprint(item["message_id"], fingerprint, duplicate_of)
+        
+        if duplicate_of:
+            self.fingerprint_index.record_suppressed()
+            logger.info(f"Mensagem {item['message_id']} suprimida: repostagem da oferta {duplicate_of}")
+            return None
+        
+        self.fingerprint_index.add(item["message_id"], fingerprint)
+        
+        # Baixar a mídia uma única vez (os envios reutilizam o arquivo e o upload)
+        media = item.get("media")
+        if media and not media.get("sha256"):
+            media = await self._store_media(item["message_id"], media)
+        
+        # Substituir links
+        processed_text = LinkProcessor.replace_links(item["message_text"], matcher, resolved_links)
+        
+        return {**item, "processed_text": processed_text, "resolved_links": resolved_links, "media": media}
+    
+    async def _store_media(self, message_id: str, media: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Baixar a mídia da oferta para o armazenamento local e registrá-la na mensagem
+        
+        Returns:
+            Mídia com sha256, ou None se o download falhar (a oferta segue só com o texto)
+        """
+        try:
+            media = await self.media_store.fetch(self.whapi_client, media)
+        except Exception as e:
+            logger.error(f"Erro ao baixar a mídia da mensagem {message_id}, enviando só o texto: {str(e)}")
+            return None
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    update(ProcessedMessage).where(ProcessedMessage.id == message_id).values(
+                        media=serialize_media(media)
+                    )
+                )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao salvar a mídia da mensagem {message_id}: {str(e)}")
+                await db.rollback()
+        
+        return media
+    
+    async def _save_fingerprint(self, message_id: str, fingerprint: Dict[str, Any], duplicate_of: Optional[str]):
+        """Gravar a impressão digital da mensagem e, se suprimida, registrar a atividade"""
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    update(ProcessedMessage).where(ProcessedMessage.id == message_id).values(
+                        canonical_urls=serialize_urls(fingerprint["urls"]),
+                        content_simhash=to_signed(fingerprint["simhash"]),
+                        duplicate_of=duplicate_of
+                    )
+                )
+                
+                if duplicate_of:
+                    db.add(ActivityLog(
+                        action="MESSAGE_SUPPRESSED",
+                        description=f"Mensagem suprimida como repostagem da oferta {duplicate_of}",
+                        related_message_id=message_id,
+                        status="SUCCESS"
+                    ))
+                
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao salvar impressão digital da mensagem {message_id}: {str(e)}")
+                await db.rollback()
+    
+    async def _fanout_message(self, item: Dict[str, Any]) -> None:
+        """
+        Estágio de fan-out: gravar na fila durável um envio por grupo de destino
+        
+        Os envios são feitos pelos workers da fila (run_send_worker), em
+        qualquer processo; um restart retoma exatamente os envios pendentes.
+        
+        Args:
+            item: Item produzido pelo estágio de rewrite
+        """
+        async with AsyncSessionLocal() as db:
+            group_ids = (await db.scalars(select(Group.id).where(Group.is_active == True))).all()
+        
+        if not group_ids:
+            logger.warning("Nenhum grupo de destino ativo encontrado")
+        
+        queued = await self.send_queue.enqueue(item["message_id"], item["processed_text"], group_ids, item.get("media"))
+        logger.info(f"Mensagem {item['message_id']} enfileirada para {queued} grupo(s)")
+    
+    async def recover_unqueued_messages(self, lookback: int = None) -> int:
+        """
+        Reprocessar mensagens registradas cujos envios não chegaram à fila
+        
+        Cobre uma parada entre o dedupe e o fan-out: as mensagens voltam ao
+        estágio de rewrite e são enfileiradas normalmente.
+        
+        Args:
+            lookback: Janela em segundos de mensagens consideradas
+        
+        Returns:
+            Quantidade de mensagens reprocessadas
+        """
+        since = datetime.utcnow() - timedelta(seconds=lookback or settings.send_queue_recovery_lookback)
+        async with AsyncSessionLocal() as db:
+            messages = (await db.scalars(
+                select(ProcessedMessage).where(
+                    ProcessedMessage.enqueued_at.is_(None),
+                    ProcessedMessage.duplicate_of.is_(None),
+                    ProcessedMessage.processed_at >= since
+                ).order_by(ProcessedMessage.processed_at)
+            )).all()
+        
+        if not messages:
+            return 0
+        
+        self.pipeline.start()
+        for message in messages:
+            await self.pipeline.rewrite_queue.put({
+                "message_id": message.id,
+                "message_text": message.message_text,
+                "links": LinkProcessor.extract_links(message.message_text),
+                "source_group_id": message.source_group_id,
+                "media": deserialize_media(message.media)
+            })
+        
+        logger.info(f"{len(messages)} mensagem(ns) sem envios enfileirados reprocessada(s)")
+        return len(messages)
+    
+    async def run_send_worker(self, worker_id: str = None, bot_number: Optional[str] = None):
+        """
+        Worker da fila de envios: reservar lotes, enviar e confirmar até ser cancelado
+        
+        Qualquer número de workers (neste ou em outros processos) pode drenar a
+        mesma fila; cada lote é reservado com FOR UPDATE SKIP LOCKED. Com bots
+        postadores registrados, cada worker atende um só bot, então um bot lento
+        ou pausado por 429 não atrasa os lotes dos demais.
+        
+        Args:
+            worker_id: Identificador do worker (gerado se omitido)
+            bot_number: Bot atendido (None: grupos dos bots sem token próprio)
+        """
+        worker_id = worker_id or SendQueue.new_worker_id()
+        exclude_bots = self.bot_registry.bot_numbers if bot_number is None else None
+        logger.info(f"Worker de envios {worker_id} iniciado (bot {bot_number or 'padrão'})")
+        
+        while True:
+            try:
+                jobs = await self.send_queue.claim(worker_id, bot_number=bot_number, exclude_bots=exclude_bots)
+                if not jobs:
+                    await asyncio.sleep(settings.send_queue_poll_interval)
+                    continue
+                
+                await self._send_jobs(worker_id, jobs)
             
-            # Obter mapa de links de afiliado
-            affiliate_links = db.query(AffiliateLink).filter(
-                AffiliateLink.is_active == True
-            ).all()
+            except asyncio.CancelledError:
+                logger.info(f"Worker de envios {worker_id} parado")
+                raise
             
-            if not affiliate_links:
-                logger.warning("Nenhum link de afiliado configurado")
-                affiliate_map = {}
+            except Exception as e:
+                logger.error(f"Erro no worker de envios {worker_id}: {str(e)}")
+                await asyncio.sleep(settings.send_queue_poll_interval)
+    
+    async def _send_jobs(self, worker_id: str, jobs: List[Dict[str, Any]]):
+        """
+        Enviar um lote reservado, confirmando cada envio assim que ele termina
+        
+        Os envios são feitos de forma concorrente pelo FanoutScheduler, que aplica
+        o limite de taxa de cada bot e um jitter aleatório por grupo. A reserva
+        dos envios pendentes é renovada enquanto o lote roda; se o worker for
+        parado no meio do lote, os envios feitos ficam confirmados e os que não
+        começaram voltam para a fila.
+        """
+        async with AsyncSessionLocal() as db:
+            groups = (await db.scalars(
+                select(Group).where(Group.id.in_({job["group_id"] for job in jobs}))
+            )).all()
+        groups_by_id = {group.id: group for group in groups}
+        
+        started_at = time.monotonic()
+        # Envios sem resultado ainda (reserva renovada; devolvidos à fila se o worker parar)
+        unsent = {job["id"] for job in jobs}
+        confirmations: List[asyncio.Future] = []
+        
+        async def confirm(target: Optional[Dict[str, Any]], outcome: Dict[str, Any]):
+            await self.send_queue.complete(worker_id, [outcome])
+            # Histórico de entregas só com o resultado final (não uma linha por tentativa)
+            status = self.send_queue.final_status(outcome)
+            if target is not None and status is not None:
+                self._record_delivery(target, outcome, status)
+        
+        async def send(job: Dict[str, Any]) -> Dict[str, Any]:
+            group = groups_by_id.get(job["group_id"])
+            if group is None or not group.is_active:
+                # Grupo removido ou desativado depois do enfileiramento
+                target = None
+                outcome = {**job, "success": False, "attempts": self.send_queue.max_attempts, "error": "Grupo inativo"}
             else:
-                affiliate_map = {link.domain_base: link.affiliate_link for link in affiliate_links}
-            
-            # Substituir links
-            processed_text = LinkProcessor.replace_links(message_text, affiliate_map)
-            
-            # Postar em todos os grupos de destino
-            await self._post_to_groups(processed_text, message_id, db)
+                target = {"id": group.id, "name": group.name, "bot_number": group.bot_number}
+                outcome = {**job, **await self._post_to_group(target, job["processed_text"], job["message_id"], job.get("media"))}
+            unsent.discard(job["id"])
             
-            logger.info(f"Mensagem {message_id} processada e postada com sucesso")
+            # shield: o cancelamento do worker não impede a confirmação de um envio já feito
+            confirmation = asyncio.ensure_future(confirm(target, outcome))
+            confirmations.append(confirmation)
+            await asyncio.shield(confirmation)
+            return outcome
         
-        except Exception as e:
-            logger.error(f"Erro ao processar mensagem: {str(e)}")
-            db.rollback()
-            raise
+        renew_task = asyncio.create_task(self._renew_claims(worker_id, unsent))
+        try:
+            results = await asyncio.gather(*[send(job) for job in jobs], return_exceptions=True)
+        finally:
+            renew_task.cancel()
+            await asyncio.gather(*confirmations, return_exceptions=True)
+            if unsent:
+                await self.send_queue.release(worker_id, list(unsent))
+        
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"Erro ao confirmar envio: {str(result)}")
+        sent = sum(1 for result in results if isinstance(result, dict) and result["success"])
+        logger.info(f"Lote de {len(jobs)} envio(s) concluído em {time.monotonic() - started_at:.1f}s ({sent} com sucesso)")
     
-    async def _post_to_groups(self, text: str, original_message_id: str, db: Session):
+    async def _renew_claims(self, worker_id: str, job_ids: Set[int]):
+        """Renovar a reserva dos envios ainda sem resultado até ser cancelado"""
+        interval = self.send_queue.visibility_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.send_queue.renew(worker_id, list(job_ids))
+            except Exception as e:
+                logger.error(f"Erro ao renovar reserva dos envios de {worker_id}: {str(e)}")
+    
+    async def _post_to_group(
+        self,
+        target: Dict[str, Any],
+        text: str,
+        original_message_id: str,
+        media: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
-        Postar mensagem em todos os grupos de destino
+        Postar mensagem em um grupo de destino
+        
+        O registro da entrega é feito por _record_delivery quando o envio
+        chega ao resultado final, não a cada tentativa.
         
         Args:
+            target: Dados do grupo (id, name, bot_number)
             text: Texto processado
             original_message_id: ID da mensagem original
-            db: Sessão do banco de dados
+            media: Mídia armazenada (enviada com o texto como legenda)
+        
+        Returns:
+            Resultado do envio (success, whatsapp_message_id, error e, se
+            adiado, retry_after)
         """
         try:
-            # Obter todos os grupos ativos
-            groups = db.query(Group).filter(Group.is_active == True).all()
+            # Bot do grupo, ou um reserva saudável que participa do grupo se ele estiver desconectado
+            route = await self.bot_registry.route(target["bot_number"], target["id"])
+            if route is None:
+                # Sem bot que possa enviar: tentar de novo depois do próximo heartbeat
+                return {
+                    "success": False,
+                    "whatsapp_message_id": None,
+                    "error": f"Bot {target['bot_number']} indisponível e sem reserva no grupo",
+                    "retry_after": self.bot_registry.retry_after()
+                }
+            bot_key, client = route
             
-            if not groups:
-                logger.warning("Nenhum grupo de destino ativo encontrado")
-                return
+            # Enviar mensagem (jitter, concorrência e taxa controlados pelo scheduler)
+            if media:
+                send = lambda: self._send_media(client, target["id"], text, media)
+            else:
+                send = lambda: client.send_message(target["id"], text)
+            result = await self.fanout_scheduler.run(bot_key, send)
             
-            logger.info(f"Postando mensagem em {len(groups)} grupo(s)")
+            # Verificar se houve erro
+            has_error = "error" in result
             
-            for group in groups:
-                try:
-                    # Delay aleatório entre 5 e 15 segundos para simular comportamento humano
-                    delay = random.uniform(5, 15)
-                    
-                    logger.debug(f"Enviando para grupo {group.name} após {delay:.1f}s")
-                    
-                    # Enviar mensagem
-                    result = await self.whapi_client.send_message(
-                        group.id,
-                        text,
-                        delay=delay
-                    )
-                    
-                    # Verificar se houve erro
-                    has_error = "error" in result
-                    
-                    # Registrar postagem
-                    posted_msg = PostedMessage(
-                        group_id=group.id,
-                        original_message_id=original_message_id,
-                        processed_text=text,
-                        whatsapp_message_id=result.get("id"),
-                        status="ENVIADO" if not has_error else "FALHA",
-                        error_message=result.get("error") if has_error else None
-                    )
-                    db.add(posted_msg)
-                    
-                    # Registrar atividade
-                    log = ActivityLog(
-                        action="MESSAGE_POSTED" if not has_error else "MESSAGE_POST_FAILED",
-                        description=f"Mensagem {'postada' if not has_error else 'falhou'} no grupo {group.name}",
-                        related_group_id=group.id,
-                        related_message_id=original_message_id,
-                        status="SUCCESS" if not has_error else "FAILURE"
-                    )
-                    db.add(log)
-                    db.commit()
-                    
-                    if not has_error:
-                        logger.info(f"✓ Mensagem postada no grupo {group.name}")
-                    else:
-                        logger.error(f"✗ Falha ao postar no grupo {group.name}: {result.get('error')}")
-                
-                except Exception as e:
-                    logger.error(f"Exceção ao postar no grupo {group.id}: {str(e)}")
-                    
-                    # Registrar falha
-                    try:
-                        posted_msg = PostedMessage(
-                            group_id=group.id,
-                            original_message_id=original_message_id,
-                            processed_text=text,
-                            status="FALHA",
-                            error_message=str(e)
-                        )
-                        db.add(posted_msg)
-                        
-                        log = ActivityLog(
-                            action="MESSAGE_POST_FAILED",
-                            description=f"Erro ao postar no grupo {group.id}: {str(e)}",
-                            related_group_id=group.id,
-                            related_message_id=original_message_id,
-                            status="FAILURE"
-                        )
-                        db.add(log)
-                        db.commit()
-                    except Exception as log_error:
-                        logger.error(f"Erro ao registrar falha: {str(log_error)}")
-                        db.rollback()
+            if not has_error:
+                logger.info(f"✓ Mensagem postada no grupo {target['name']}")
+            else:
+                logger.error(f"✗ Falha ao postar no grupo {target['name']}: {result.get('error')}")
+            
+            return {"success": not has_error, "whatsapp_message_id": result.get("id"), "error": result.get("error")}
         
         except Exception as e:
-            logger.error(f"Erro ao postar em grupos: {str(e)}")
-            raise
+            logger.error(f"Exceção ao postar no grupo {target['id']}: {str(e)}")
+            return {"success": False, "whatsapp_message_id": None, "error": str(e)}
+    
+    def _record_delivery(self, target: Dict[str, Any], outcome: Dict[str, Any], status: str):
+        """
+        Registrar o resultado final de um envio (postagem e atividade)
+        
+        Os registros vão para o delivery_writer, que os grava em lote
+        (WRITE_BEHIND_FLUSH_INTERVAL) em vez de um commit por grupo.
+        """
+        sent = status == SendQueue.SENT
+        delivery_writer.add(
+            PostedMessage,
+            group_id=target["id"],
+            original_message_id=outcome["message_id"],
+            processed_text=outcome["processed_text"],
+            whatsapp_message_id=outcome.get("whatsapp_message_id"),
+            status="ENVIADO" if sent else "FALHA",
+            error_message=None if sent else outcome.get("error")
+        )
+        delivery_writer.add(
+            ActivityLog,
+            action="MESSAGE_POSTED" if sent else "MESSAGE_POST_FAILED",
+            description=f"Mensagem {'postada' if sent else 'falhou'} no grupo {target['name']}",
+            related_group_id=target["id"],
+            related_message_id=outcome["message_id"],
+            status="SUCCESS" if sent else "FAILURE"
+        )
+    
+    async def _send_media(self, client: WhapiClient, chat_id: str, caption: str, media: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Enviar uma oferta com mídia reutilizando o upload do canal do bot
+        
+        O arquivo é carregado na Whapi só no primeiro envio de cada bot; os
+        demais grupos recebem o mesmo ID de mídia.
+        """
+        media_id = await self.media_store.media_id_for(client, media, source_client=self.whapi_client)
+        if not media_id:
+            return {"error": f"Falha no upload da mídia {media['sha256'][:12]}"}
+        return await client.send_media(chat_id, media["type"], media_id, caption)
     
-    async def update_group_members_count(self, check_interval: int = 3600):
+    async def update_group_members_count(self, check_interval: int = None):
         """
-        Atualizar contagem de membros de todos os grupos periodicamente
+        Atualizar contagem de membros dos grupos com agenda adaptativa
+        
+        Cada grupo é consultado no intervalo calculado pelo CapacityScheduler a
+        partir da ocupação e do crescimento recente, respeitando o orçamento
+        global de chamadas.
         
         Args:
-            check_interval: Intervalo em segundos entre atualizações (padrão: 1 hora)
+            check_interval: Intervalo máximo em segundos entre consultas de um grupo
         """
         self.is_running = True
-        logger.info("Iniciando atualização periódica de membros")
+        if check_interval:
+            self.capacity_scheduler.max_interval = check_interval
+        logger.info("Iniciando atualização adaptativa de membros")
         
         consecutive_errors = 0
         max_consecutive_errors = 3
+        retry_interval = self.capacity_scheduler.min_interval
         
         while self.is_running:
-            db = None
             try:
-                db = SessionLocal()
-                
-                groups = db.query(Group).filter(Group.is_active == True).all()
-                
-                if not groups:
-                    logger.debug("Nenhum grupo ativo para atualizar")
-                else:
-                    logger.info(f"Atualizando contagem de membros de {len(groups)} grupo(s)")
-                
-                for group in groups:
-                    try:
-                        member_count = await self.whapi_client.get_group_members_count(group.id)
-                        
-                        if member_count is not None:
-                            old_count = group.current_members
-                            old_status = group.status
-                            
-                            group.current_members = member_count
-                            group.last_member_count_update = datetime.utcnow()
-                            
-                            # Atualizar status baseado na capacidade
-                            if member_count >= group.max_capacity:
-                                if group.status != "CHEIO":
-                                    group.status = "CHEIO"
-                                    logger.info(f"Grupo {group.name} está cheio ({member_count}/{group.max_capacity})")
-                            else:
-                                # Se estava cheio e agora tem vagas, voltar a disponível
-                                if group.status == "CHEIO" and (group.max_capacity - member_count) > 5:
-                                    group.status = "DISPONIVEL"
-                                    logger.info(f"Grupo {group.name} voltou a estar disponível ({member_count}/{group.max_capacity})")
-                            
-                            db.commit()
-                            
-                            if old_count != member_count or old_status != group.status:
-                                logger.info(f"Grupo {group.name}: {old_count} → {member_count} membros, status: {old_status} → {group.status}")
-                        else:
-                            logger.warning(f"Não foi possível obter contagem de membros do grupo {group.name}")
-                    
-                    except Exception as e:
-                        logger.error(f"Erro ao atualizar membros do grupo {group.id}: {str(e)}")
-                        # Continuar com próximo grupo
-                        continue
+                await self._refresh_members_count()
                 
                 # Reset contador de erros em caso de sucesso
                 consecutive_errors = 0
                 
-                await asyncio.sleep(check_interval)
+                # Dormir até o próximo grupo vencer (mínimo de alguns segundos entre ciclos)
+                await asyncio.sleep(max(
+                    settings.members_refresh_min_sleep,
+                    self.capacity_scheduler.seconds_until_next()
+                ))
             
             except asyncio.CancelledError:
                 logger.info("Atualização de membros cancelada")
@@ -328,17 +972,208 @@ class BackgroundTaskManager:
                 logger.error(f"Erro na atualização de membros (tentativa {consecutive_errors}/{max_consecutive_errors}): {str(e)}")
                 
                 if consecutive_errors >= max_consecutive_errors:
-                    logger.warning(f"Muitos erros consecutivos. Aumentando intervalo para {check_interval * 2}s")
-                    await asyncio.sleep(check_interval * 2)
+                    logger.warning(f"Muitos erros consecutivos. Aumentando intervalo para {retry_interval * 2}s")
+                    await asyncio.sleep(retry_interval * 2)
                     consecutive_errors = 0
                 else:
-                    await asyncio.sleep(check_interval)
+                    await asyncio.sleep(retry_interval)
+    
+    async def _refresh_members_count(self):
+        """
+        Consultar em paralelo a contagem de membros dos grupos com consulta vencida
+        
+        As consultas são limitadas por MEMBERS_REFRESH_CONCURRENCY e o resultado
+        é gravado com um único UPDATE em lote por ciclo.
+        """
+        # Sessão curta: a conexão não fica presa durante as consultas à Whapi
+        async with AsyncSessionLocal() as db:
+            groups = (await db.scalars(select(Group).where(Group.is_active == True))).all()
+        self.capacity_scheduler.sync(groups)
+        
+        if not groups:
+            logger.debug("Nenhum grupo ativo para atualizar")
+            return
+        
+        groups_by_id = {group.id: group for group in groups}
+        due_groups = [groups_by_id[group_id] for group_id in self.capacity_scheduler.pop_due()]
+        
+        if not due_groups:
+            return
+        
+        logger.info(f"Atualizando contagem de membros de {len(due_groups)} grupo(s)")
+        
+        semaphore = asyncio.Semaphore(settings.members_refresh_concurrency)
+        
+        async def fetch_count(group_id: str) -> Optional[int]:
+            async with semaphore:
+                return await self.whapi_client.get_group_members_count(group_id)
+        
+        counts = await asyncio.gather(*[fetch_count(group.id) for group in due_groups])
+        
+        now = datetime.utcnow()
+        updates = []
+        
+        for group, member_count in zip(due_groups, counts):
+            if member_count is None:
+                logger.warning(f"Não foi possível obter contagem de membros do grupo {group.name}")
+                self.capacity_scheduler.schedule(group.id, self.capacity_scheduler.min_interval)
+                continue
+            
+            self.capacity_scheduler.observe(group.id, member_count)
+            next_interval = self.capacity_scheduler.next_interval(group.id, member_count, group.max_capacity)
+            self.capacity_scheduler.schedule(group.id, next_interval)
+            
+            new_status = resolve_group_status(group.status, member_count, group.max_capacity)
             
-            finally:
-                if db:
-                    db.close()
+            if new_status != group.status:
+                if new_status == "CHEIO":
+                    logger.info(f"Grupo {group.name} está cheio ({member_count}/{group.max_capacity})")
+                else:
+                    logger.info(f"Grupo {group.name} voltou a estar disponível ({member_count}/{group.max_capacity})")
+            
+            if group.current_members != member_count or group.status != new_status:
+                logger.info(f"Grupo {group.name}: {group.current_members} → {member_count} membros, status: {group.status} → {new_status}, próxima consulta em {next_interval:.0f}s")
+            
+            updates.append({
+                "id": group.id,
+                "current_members": member_count,
+                "status": new_status,
+                "last_member_count_update": now,
+                "updated_at": now
+            })
+        
+        if updates:
+            async with AsyncSessionLocal() as db:
+                try:
+                    # UPDATE em lote pela chave primária
+                    await db.execute(update(Group), updates)
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+            group_snapshot.invalidate()
+    
+    @staticmethod
+    def participant_event_key(event: Dict[str, Any]) -> Optional[str]:
+        """
+        Chave de idempotência de um evento de participantes
+        
+        O ID do evento, se a Whapi enviar; senão um hash de grupo, ação,
+        participantes e horário. Sem ID nem horário não há como distinguir uma
+        reentrega de uma nova entrada/saída, e o evento não é deduplicado.
+        """
+        if event.get("id"):
+            return str(event["id"])
+        timestamp = event.get("timestamp")
+        if not timestamp:
+            return None
+        
+        group_id = event.get("group_id") or event.get("chat_id")
+        participants = event.get("participants") or []
+        participants = sorted(str(p.get("id") if isinstance(p, dict) else p) for p in participants) if isinstance(participants, list) else []
+        content = json.dumps([group_id, (event.get("action") or "").lower(), participants, timestamp])
+        return hashlib.sha256(content.encode()).hexdigest()
+    
+    async def apply_participant_events(self, events: List[Dict[str, Any]]) -> int:
+        """
+        Atualizar a lotação dos grupos a partir de eventos de participantes
+        
+        Cada evento de entrada soma e cada saída/remoção subtrai o número de
+        participantes do evento. O status CHEIO/DISPONIVEL é recalculado na hora.
+        Eventos já aplicados (reentregas do webhook) são ignorados: a chave de
+        cada evento é gravada em participant_events na mesma transação.
+        
+        Args:
+            events: Eventos groups_participants recebidos da Whapi
+        
+        Returns:
+            Quantidade de grupos atualizados
+        """
+        keyed_events = [
+            (self.participant_event_key(event), event, event.get("group_id") or event.get("chat_id"))
+            for event in events
+        ]
+        keyed_events = [(key, event, group_id) for key, event, group_id in keyed_events if group_id]
+        if not keyed_events:
+            return 0
+        
+        groups = []
+        async with AsyncSessionLocal() as db:
+            try:
+                # Registrar as chaves primeiro: numa reentrega simultânea, só uma transação insere
+                keys = {key: group_id for key, _, group_id in keyed_events if key}
+                new_keys = set()
+                if keys:
+                    result = await db.execute(
+                        insert_ignore(db, ParticipantEvent).returning(ParticipantEvent.id),
+                        [{"id": key, "group_id": group_id} for key, group_id in keys.items()]
+                    )
+                    new_keys = set(result.scalars().all())
+                
+                deltas: Dict[str, int] = {}
+                for key, event, group_id in keyed_events:
+                    if key is not None:
+                        if key not in new_keys:
+                            logger.info(f"Evento de participantes {key[:16]} do grupo {group_id} já aplicado, ignorando")
+                            continue
+                        # Chave repetida no mesmo lote conta uma vez
+                        new_keys.discard(key)
+                    
+                    action = (event.get("action") or "").lower()
+                    participants = event.get("participants") or []
+                    count = len(participants) if isinstance(participants, list) and participants else 1
+                    
+                    if action in PARTICIPANT_JOIN_ACTIONS:
+                        deltas[group_id] = deltas.get(group_id, 0) + count
+                    elif action in PARTICIPANT_LEAVE_ACTIONS:
+                        deltas[group_id] = deltas.get(group_id, 0) - count
+                
+                deltas = {group_id: delta for group_id, delta in deltas.items() if delta}
+                if deltas:
+                    # Travar as linhas para que eventos simultâneos não percam incrementos
+                    groups = (await db.scalars(
+                        select(Group).where(
+                            Group.id.in_(list(deltas.keys())),
+                            Group.is_active == True
+                        ).with_for_update()
+                    )).all()
+                
+                for group in groups:
+                    old_count = group.current_members or 0
+                    old_status = group.status
+                    
+                    group.current_members = max(old_count + deltas[group.id], 0)
+                    group.status = resolve_group_status(group.status, group.current_members, group.max_capacity)
+                    
+                    if group.status != old_status:
+                        logger.info(f"Grupo {group.name}: status {old_status} → {group.status} ({group.current_members}/{group.max_capacity})")
+                    
+                    self.capacity_scheduler.observe(group.id, group.current_members)
+                    self.whapi_client.invalidate_group_cache(group.id)
+                
+                if time.monotonic() - self._participant_events_pruned_at > PARTICIPANT_EVENT_PRUNE_INTERVAL:
+                    self._participant_events_pruned_at = time.monotonic()
+                    await db.execute(
+                        delete(ParticipantEvent).where(
+                            ParticipantEvent.received_at < datetime.utcnow() - PARTICIPANT_EVENT_RETENTION
+                        )
+                    )
+                
+                await db.commit()
+            
+            except Exception as e:
+                logger.error(f"Erro ao aplicar eventos de participantes: {str(e)}")
+                await db.rollback()
+                raise
+        
+        if groups:
+            group_snapshot.invalidate()
+            logger.info(f"Lotação atualizada por eventos em {len(groups)} grupo(s)")
+        
+        return len(groups)
     
     def stop(self):
         """Parar tarefas em background"""
         self.is_running = False
+        self.pipeline.stop()
         logger.info("Tarefas em background paradas")
\ No newline at end of file
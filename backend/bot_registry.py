@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from fanout import FanoutScheduler
+from models import BotSession
+from whapi_client import WhapiClient
+
+logger = logging.getLogger(__name__)
+
+# Folga após o próximo heartbeat antes de tentar de novo um envio adiado
+HEARTBEAT_RETRY_MARGIN = 5.0
+
+
+class BotRegistry:
+    """
+    Registro dos bots postadores (um WhapiClient por número)
+
+    Cada número configurado em POSTER_BOTS tem o próprio token, pool de
+    conexões, circuit breakers e token bucket no FanoutScheduler. Os grupos
+    são distribuídos entre os bots por `Group.bot_number`; números sem token
+    próprio usam o cliente padrão (WHAPI_API_KEY), como antes.
+
+    Um heartbeat consulta o canal de cada bot na Whapi e grava o resultado em
+    BotSession. Envios de um bot desconectado (ou com o circuito de envio
+    aberto) são redirecionados para um bot saudável que participa do grupo;
+    sem reserva participante, o envio é adiado até o próximo heartbeat.
+    """
+
+    def __init__(self, default_client: WhapiClient, fanout_scheduler: FanoutScheduler, bots: Dict[str, str] = None):
+        """
+        Args:
+            default_client: Cliente da WHAPI_API_KEY (leitura e bots sem token próprio)
+            fanout_scheduler: Agendador que aplica a taxa de cada bot
+            bots: Número do bot → token da Whapi (padrão: POSTER_BOTS)
+        """
+        self.default_client = default_client
+        self.fanout_scheduler = fanout_scheduler
+        self.failover_enabled = settings.bot_failover_enabled
+        self.failure_threshold = settings.bot_heartbeat_failure_threshold
+        self.heartbeat_interval = settings.bot_heartbeat_interval
+        # Número do bot → reservas que participam dos mesmos grupos
+        self.backups: Dict[str, List[str]] = settings.poster_bot_backups
+        self._clients: Dict[str, WhapiClient] = {}
+        self._health: Dict[str, Dict[str, Any]] = {}
+        self._next_heartbeat_at: Optional[float] = None
+        self.rerouted = 0
+        self.deferred = 0
+
+        for bot_number, api_key in (settings.poster_bots if bots is None else bots).items():
+            client = WhapiClient(api_key=api_key)
+            # Um 429 pausa apenas o bot que o recebeu
+            client.on_throttle = lambda seconds, bot_number=bot_number: fanout_scheduler.throttle(seconds, bot_number)
+            self._clients[bot_number] = client
+
+        # Chave do cliente padrão no heartbeat, no BotSession, no failover e no limite de taxa
+        self.default_key = settings.bot_poster_number or "default"
+        if self.default_key in self._clients:
+            self.default_key = "default"
+        # Um 429 no cliente padrão (leitura, mídia, bots sem token próprio) pausa só a partição padrão
+        default_client.on_throttle = lambda seconds: fanout_scheduler.throttle(seconds, self.default_key)
+
+        if self._clients:
+            logger.info(f"{len(self._clients)} bot(s) postador(es) registrado(s): {', '.join(self._clients)}")
+
+    @property
+    def bot_numbers(self) -> List[str]:
+        """Números dos bots com token próprio"""
+        return list(self._clients)
+
+    def client_for(self, bot_number: Optional[str]) -> WhapiClient:
+        """Cliente responsável pelos envios de um bot"""
+        return self._clients.get(bot_number, self.default_client)
+
+    def shards(self) -> List[Optional[str]]:
+        """
+        Partições da fila de envios: uma por bot com token próprio, mais a
+        partição padrão (None) com os grupos dos demais números
+        """
+        return [*self._clients, None]
+
+    def key_for(self, bot_number: Optional[str]) -> str:
+        """
+        Chave do token que atende um bot (limite de taxa, saúde e BotSession)
+
+        Números sem token próprio compartilham a chave do cliente padrão: todos
+        enviam pelo mesmo número de WhatsApp, então dividem o mesmo limite.
+        """
+        return bot_number if bot_number in self._clients else self.default_key
+
+    def is_healthy(self, bot_number: Optional[str]) -> bool:
+        """
+        Verificar se um bot pode enviar
+
+        Não saudável: circuito de envio aberto ou heartbeat falhando há
+        BOT_HEARTBEAT_FAILURE_THRESHOLD verificações. Bots ainda não
+        verificados são considerados saudáveis.
+        """
+        breakers = self.client_for(bot_number).breaker_states()
+        if breakers.get("messages.send", {}).get("state") == "OPEN":
+            return False
+
+        health = self._health.get(self.key_for(bot_number))
+        return health is None or health["consecutive_failures"] < self.failure_threshold
+
+    async def is_member(self, key: str, group_id: str, bot_number: Optional[str] = None) -> bool:
+        """
+        Verificar se um bot participa de um grupo de destino
+
+        Vale o mapeamento POSTER_BOT_BACKUPS (reservas configurados para o bot
+        do grupo) ou a lista de participantes do grupo na Whapi (com o cache
+        de /groups/{id} do cliente padrão). Sem número conhecido (chave
+        "default") ou sem a lista, o bot não é considerado participante.
+        """
+        if key in self.backups.get(bot_number, []):
+            return True
+        if key == "default":
+            return False
+
+        group = await self.default_client.get_group_info(group_id)
+        for participant in (group or {}).get("participants") or []:
+            participant_id = participant.get("id") if isinstance(participant, dict) else participant
+            if isinstance(participant_id, str) and participant_id.split("@")[0] == key:
+                return True
+        return False
+
+    async def route(self, bot_number: str, group_id: str) -> Optional[Tuple[str, WhapiClient]]:
+        """
+        Escolher o bot que fará um envio
+
+        Se o bot do grupo não estiver saudável, o envio vai para um bot
+        saudável que participa do grupo, escolhido pelo ID do grupo (sempre o
+        mesmo reserva para o mesmo grupo).
+
+        Returns:
+            Chave do token (para o limite de taxa) e cliente usado no envio, ou
+            None se nenhum reserva saudável participa do grupo (adiar o envio
+            até o próximo heartbeat)
+        """
+        own_key = self.key_for(bot_number)
+        if not self.failover_enabled or self.is_healthy(bot_number):
+            return own_key, self.client_for(bot_number)
+
+        candidates = sorted(
+            key for key in [*self._clients, self.default_key]
+            if key != own_key and self.is_healthy(key)
+        )
+        members = [key for key in candidates if await self.is_member(key, group_id, bot_number)]
+        if not members:
+            self.deferred += 1
+            logger.warning(f"Bot {bot_number} indisponível e nenhum reserva participa de {group_id}, envio adiado")
+            return None
+
+        backup = members[zlib.crc32(group_id.encode()) % len(members)]
+        self.rerouted += 1
+        logger.warning(f"Bot {bot_number} indisponível, envio para {group_id} redirecionado para {backup}")
+        return backup, self.client_for(backup)
+
+    def retry_after(self) -> float:
+        """Segundos até depois do próximo heartbeat (espera de um envio adiado)"""
+        if self._next_heartbeat_at is None:
+            return self.heartbeat_interval
+        return max(0.0, self._next_heartbeat_at - time.monotonic()) + HEARTBEAT_RETRY_MARGIN
+
+    async def start(self):
+        for client in self._clients.values():
+            await client.start()
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+
+    async def heartbeat(self):
+        """Consultar o canal de todos os bots e gravar o resultado em BotSession"""
+        keys = [*self._clients, self.default_key]
+        results = await asyncio.gather(*[self.client_for(key).check_health() for key in keys])
+        now = datetime.utcnow()
+
+        for key, result in zip(keys, results):
+            previous = self._health.get(key)
+            failures = 0 if result["connected"] else (previous["consecutive_failures"] if previous else 0) + 1
+            self._health[key] = {**result, "consecutive_failures": failures, "checked_at": now}
+
+            if failures == self.failure_threshold:
+                logger.error(f"Bot {key} sem conexão após {failures} heartbeat(s): {result['error']}")
+            elif not failures and previous and previous["consecutive_failures"] >= self.failure_threshold:
+                logger.info(f"Bot {key} reconectado")
+
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    insert_ignore(db, BotSession),
+                    [{"bot_number": key, "bot_type": "POSTER"} for key in keys]
+                )
+                for key in keys:
+                    health = self._health[key]
+                    await db.execute(
+                        update(BotSession).where(BotSession.bot_number == key).values(
+                            is_connected=health["connected"],
+                            last_heartbeat=now,
+                            latency_ms=round(health["latency_ms"], 1),
+                            last_error=health["error"],
+                            consecutive_failures=health["consecutive_failures"],
+                            updated_at=now
+                        )
+                    )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao gravar heartbeat dos bots: {str(e)}")
+                await db.rollback()
+
+    async def run_heartbeats(self, interval: float = None):
+        """Executar o heartbeat periodicamente até ser cancelado"""
+        interval = interval or self.heartbeat_interval
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Erro no heartbeat dos bots: {str(e)}")
+            self._next_heartbeat_at = time.monotonic() + interval
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        bots = {}
+        for key in [*self._clients, self.default_key]:
+            health = self._health.get(key) or {}
+            bots[key] = {
+                "healthy": self.is_healthy(key),
+                "connected": health.get("connected"),
+                "latency_ms": round(health["latency_ms"], 1) if health else None,
+                "consecutive_failures": health.get("consecutive_failures", 0),
+                "rate_per_minute": self.fanout_scheduler.rate_for(key),
+                "circuit_breakers": self.client_for(key).breaker_states()
+            }
+        return {"bots": bots, "failover_enabled": self.failover_enabled, "rerouted": self.rerouted, "deferred": self.deferred}
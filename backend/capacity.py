@@ -0,0 +1,173 @@
+import heapq
+import logging
+import time
+from datetime import timezone
+from typing import Any, Dict, List, Tuple
+
+from fanout import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Vagas mínimas para um grupo CHEIO voltar a DISPONIVEL (evita alternância)
+RELEASE_MARGIN = 5
+
+
+def resolve_group_status(current_status: str, member_count: int, max_capacity: int) -> str:
+    """
+    Calcular o status de um grupo a partir da contagem de membros
+
+    Args:
+        current_status: Status atual (DISPONIVEL ou CHEIO)
+        member_count: Contagem de membros atual
+        max_capacity: Capacidade máxima do grupo
+
+    Returns:
+        Novo status do grupo
+    """
+    if member_count >= max_capacity:
+        return "CHEIO"
+
+    # Se estava cheio e agora tem vagas suficientes, voltar a disponível
+    if current_status == "CHEIO" and (max_capacity - member_count) > RELEASE_MARGIN:
+        return "DISPONIVEL"
+
+    return current_status
+
+
+class CapacityScheduler:
+    """
+    Agenda adaptativa de consultas de membros por grupo
+
+    Uma fila de prioridade guarda o próximo horário de consulta de cada grupo.
+    O intervalo é calculado pela taxa de ocupação e pela velocidade de
+    crescimento recente: grupos quase cheios e crescendo rápido são consultados
+    a cada poucos minutos, grupos estáveis raramente. Um orçamento global de
+    chamadas por hora limita o total de consultas.
+    """
+
+    # Peso da observação mais recente na média móvel da taxa de crescimento
+    GROWTH_SMOOTHING = 0.5
+    # Fração do tempo estimado até lotar usada como intervalo
+    SAFETY_FACTOR = 0.5
+
+    def __init__(self, min_interval: float, max_interval: float, calls_per_hour: int):
+        """
+        Args:
+            min_interval: Menor intervalo entre consultas de um grupo (segundos)
+            max_interval: Maior intervalo entre consultas de um grupo (segundos)
+            calls_per_hour: Orçamento global de chamadas à API por hora
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = TokenBucket(calls_per_hour / 3600.0, max(calls_per_hour / 4, 1))
+        self._heap: List[Tuple[float, str]] = []
+        self._due_at: Dict[str, float] = {}
+        self._state: Dict[str, Dict[str, float]] = {}
+
+    def sync(self, groups: List[Any]):
+        """
+        Sincronizar a agenda com os grupos ativos
+
+        Grupos novos são agendados a partir da última contagem salva; grupos
+        removidos ou inativos saem da agenda.
+        """
+        active_ids = {group.id for group in groups}
+        for group_id in list(self._due_at):
+            if group_id not in active_ids:
+                self._due_at.pop(group_id)
+                self._state.pop(group_id, None)
+
+        for group in groups:
+            if group.id in self._due_at:
+                continue
+            if group.last_member_count_update is None:
+                self.schedule(group.id, 0)
+                continue
+
+            observed_at = group.last_member_count_update.replace(tzinfo=timezone.utc).timestamp()
+            self._state[group.id] = {
+                "count": group.current_members or 0,
+                "observed_at": observed_at,
+                "growth_rate": 0.0
+            }
+            interval = self.next_interval(group.id, group.current_members or 0, group.max_capacity)
+            self.schedule(group.id, max(0.0, observed_at + interval - time.time()))
+
+    def schedule(self, group_id: str, delay: float):
+        """Agendar a próxima consulta de um grupo"""
+        due_at = time.time() + delay
+        self._due_at[group_id] = due_at
+        heapq.heappush(self._heap, (due_at, group_id))
+
+    def pop_due(self) -> List[str]:
+        """
+        Retirar da fila os grupos com consulta vencida, dentro do orçamento
+
+        Grupos vencidos sem orçamento disponível permanecem na fila.
+        """
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, group_id = self._heap[0]
+            # Entradas obsoletas (grupo reagendado ou removido) são descartadas
+            if self._due_at.get(group_id) != due_at:
+                heapq.heappop(self._heap)
+                continue
+            if not self.budget.try_acquire():
+                break
+            heapq.heappop(self._heap)
+            self._due_at.pop(group_id)
+            due.append(group_id)
+        return due
+
+    def seconds_until_next(self) -> float:
+        """Segundos até a próxima consulta agendada"""
+        while self._heap and self._due_at.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return self.max_interval
+        return max(0.0, self._heap[0][0] - time.time())
+
+    def observe(self, group_id: str, member_count: int):
+        """Registrar uma contagem de membros e atualizar a taxa de crescimento"""
+        now = time.time()
+        state = self._state.get(group_id)
+        if state is None:
+            self._state[group_id] = {"count": member_count, "observed_at": now, "growth_rate": 0.0}
+            return
+
+        elapsed = now - state["observed_at"]
+        if elapsed > 0:
+            rate = (member_count - state["count"]) / elapsed
+            state["growth_rate"] = (
+                self.GROWTH_SMOOTHING * rate + (1 - self.GROWTH_SMOOTHING) * state["growth_rate"]
+            )
+        state["count"] = member_count
+        state["observed_at"] = now
+
+    def next_interval(self, group_id: str, member_count: int, max_capacity: int) -> float:
+        """
+        Calcular o intervalo até a próxima consulta de um grupo
+
+        Usa o menor entre: fração do tempo estimado até lotar (pela taxa de
+        crescimento) e um limite que encolhe quadraticamente com a ocupação.
+        """
+        headroom = max(max_capacity - member_count, 0)
+        if headroom == 0:
+            # Grupos cheios só precisam detectar saída de membros
+            return self.max_interval
+
+        fill_ratio = member_count / max_capacity if max_capacity > 0 else 1.0
+        interval = self.min_interval + (self.max_interval - self.min_interval) * (1 - fill_ratio) ** 2
+
+        growth_rate = self._state.get(group_id, {}).get("growth_rate", 0.0)
+        if growth_rate > 0:
+            interval = min(interval, headroom / growth_rate * self.SAFETY_FACTOR)
+
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scheduled_groups": len(self._due_at),
+            "next_refresh_in_seconds": round(self.seconds_until_next(), 1)
+        }
@@ -1,6 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
-import os
+from typing import Dict, List
 
 class Settings(BaseSettings):
     """Configurações da aplicação"""
@@ -11,13 +10,124 @@ class Settings(BaseSettings):
     # Whapi Configuration
     whapi_api_key: str = ""
     whapi_api_url: str = "https://api.whapi.cloud"
+    whapi_timeout: float = 30.0
+    whapi_max_connections: int = 100
+    whapi_max_keepalive_connections: int = 20
+    whapi_keepalive_expiry: float = 30.0
+    whapi_http2: bool = False
+    whapi_max_retries: int = 3
+    whapi_retry_base_delay: float = 0.5
+    whapi_retry_max_delay: float = 10.0
+    whapi_breaker_failure_threshold: int = 5
+    whapi_breaker_reset_timeout: float = 30.0
+    whapi_group_cache_ttl: float = 60.0
     
     # Bot Numbers
     bot_reader_number: str = ""
     bot_poster_number: str = ""
+    # Bots postadores com token próprio (JSON): {"5511999990001": "token", ...}
+    # Grupos cujo bot_number não está aqui usam WHAPI_API_KEY
+    poster_bots: Dict[str, str] = {}
+    poster_bot_rates: Dict[str, float] = {}  # Envios por minuto por bot (padrão: BOT_RATE_PER_MINUTE)
+    # Heartbeat dos bots (BotSession) e redirecionamento dos envios de bots desconectados
+    bot_heartbeat_interval: float = 30.0
+    bot_heartbeat_failure_threshold: int = 2  # Heartbeats seguidos sem conexão até o failover
+    bot_failover_enabled: bool = True
+    # Reservas que participam dos mesmos grupos (JSON): {"5511999990001": ["5511999990002"], ...}
+    # Sem mapeamento, vale a lista de participantes do grupo na Whapi
+    poster_bot_backups: Dict[str, List[str]] = {}
     
-    # Source Group
+    # Source Group (cadastrado em source_groups no startup; outros via /api/source-groups)
     source_group_id: str = ""
+    source_groups_refresh_interval: float = 60.0  # Recarga da lista de grupos de origem
+    source_poll_concurrency: int = 5  # Grupos de origem consultados ao mesmo tempo
+    
+    # Ingestão de mensagens: "polling" ou "webhook"
+    # No modo webhook o polling continua como reconciliação em intervalo maior
+    ingest_mode: str = "polling"
+    poll_interval: int = 60
+    webhook_fallback_poll_interval: int = 600
+    whapi_webhook_secret: str = ""
+    poll_page_size: int = 100
+    poll_initial_lookback: int = 3600  # Segundos buscados quando ainda não há cursor
+    
+    # Fan-out (envio para os grupos de destino)
+    fanout_global_concurrency: int = 20
+    fanout_per_bot_concurrency: int = 5
+    bot_rate_per_minute: float = 20.0
+    bot_rate_burst: int = 3
+    bot_rate_shared: bool = True  # Taxa de cada bot dividida entre API, worker e réplicas (banco)
+    fanout_jitter_min: float = 1.0
+    fanout_jitter_max: float = 4.0
+    
+    # Atualização da contagem de membros
+    members_refresh_concurrency: int = 10
+    members_refresh_min_interval: int = 120
+    members_refresh_max_interval: int = 3600
+    members_refresh_budget_per_hour: int = 600
+    members_refresh_min_sleep: int = 5
+    # Com eventos de participantes via webhook, o polling só corrige desvios
+    members_events_enabled: bool = False
+    members_drift_correction_interval: int = 21600
+    
+    # Redirecionamento (/api/redirect)
+    redirect_snapshot_ttl: float = 10.0
+    redirect_click_flush_interval: float = 10.0
+    redirect_http_302: bool = False
+    redirect_strategy: str = "weighted"  # ordered, least_loaded ou weighted
+    redirect_click_join_rate: float = 1.0  # Fração dos cliques que entra no grupo
+    redirect_headroom_reserve: int = 5  # Vagas reservadas: troca de grupo antes de lotar
+    
+    # Cache das regras de afiliado (verificação de versão entre processos)
+    affiliate_cache_check_interval: float = 5.0
+    
+    # Expansão de links encurtados
+    shortener_domains: List[str] = [
+        "amzn.to", "s.shopee.com.br", "shope.ee", "bit.ly", "tinyurl.com",
+        "meli.la", "magalu.lu", "cutt.ly", "is.gd"
+    ]
+    link_resolver_concurrency: int = 10
+    link_resolver_timeout: float = 5.0
+    link_resolver_max_redirects: int = 5
+    link_resolver_cache_size: int = 10000
+    link_resolver_cache_ttl: float = 86400.0
+    link_resolver_persist: bool = True
+    
+    # Pipeline de processamento (fetch → dedupe → rewrite → fanout)
+    pipeline_queue_size: int = 100
+    pipeline_fanout_workers: int = 4
+    write_behind_batch_size: int = 200  # Registros de entrega/atividade por INSERT em lote
+    write_behind_flush_interval: float = 2.0  # Atraso máximo (segundos) até o registro aparecer no banco
+    write_behind_max_pending: int = 20000  # Registros em memória; além disso os mais antigos são descartados
+    seen_index_size: int = 50000  # IDs de mensagens vistas mantidos em memória para o dedupe
+
+    # Fila durável de envios (tabela send_jobs)
+    send_queue_workers: int = 2  # Workers de envio por bot (partição da fila) em cada processo
+    send_queue_batch_size: int = 20  # Envios reservados por worker de cada vez
+    send_queue_visibility_timeout: int = 300  # Segundos até um envio reservado voltar à fila
+    send_queue_max_attempts: int = 3
+    send_queue_retry_base_delay: float = 30.0  # Segundos (dobra a cada tentativa)
+    send_queue_poll_interval: float = 2.0  # Espera quando a fila está vazia
+    send_queue_recovery_lookback: int = 86400  # Janela para reprocessar mensagens não enfileiradas
+    
+    # false: a API não inicia tarefas em background (rodam em `python -m worker`)
+    # e só grava as mensagens de webhook para o worker processar
+    run_background_tasks: bool = True
+    inbound_drain_interval: float = 1.0  # Segundos entre leituras das mensagens de webhook gravadas pela API
+    
+    # Eleição de líder das tarefas singleton (polling, atualização de membros)
+    leader_lease_ttl: int = 30  # Segundos até outro processo assumir se o líder parar
+    leader_renew_interval: int = 10
+
+    # Mídia das ofertas: armazenamento local por hash (sha256) e reuso do upload
+    media_cache_dir: str = "media_cache"
+    media_cache_max_bytes: int = 1073741824  # 1 GB; os arquivos menos usados saem primeiro
+    media_cache_max_age: int = 604800  # Segundos sem uso até o arquivo ser removido
+    media_upload_ttl: int = 604800  # Segundos até um ID de upload ser renovado
+    
+    # Repostagens da mesma oferta (0 desativa a supressão)
+    duplicate_window: int = 21600  # Segundos
+    duplicate_simhash_distance: int = 6  # Bits de diferença tolerados entre textos
     
     # Server
     server_host: str = "0.0.0.0"
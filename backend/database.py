@@ -1,9 +1,42 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from config import settings
 from models import Base
 
-# Criar engine de banco de dados
+# Drivers assíncronos usados para cada banco
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+
+def async_database_url(database_url: str) -> URL:
+    """
+    Converter a DATABASE_URL síncrona para o driver assíncrono equivalente
+
+    Ex: postgresql://... → postgresql+asyncpg://... O parâmetro sslmode (libpq)
+    é traduzido para ssl, que é o nome aceito pelo asyncpg.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    elif backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+
+    if "sslmode" in url.query:
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+
+    return url
+
+# Criar engine de banco de dados (ferramentas síncronas: init_db, scripts)
 engine = create_engine(
     settings.database_url,
     echo=settings.environment == "development",
@@ -15,6 +48,19 @@ engine = create_engine(
 # Criar session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine assíncrona usada pela API e pelas tarefas em background
+_async_url = async_database_url(settings.database_url)
+async_engine = create_async_engine(
+    _async_url,
+    echo=settings.environment == "development",
+    pool_pre_ping=True,
+    # aiosqlite (desenvolvimento) não usa pool com tamanho fixo
+    **({} if _async_url.get_backend_name() == "sqlite" else {"pool_size": 10, "max_overflow": 20})
+)
+
+# expire_on_commit=False: objetos continuam legíveis após o commit sem novo SELECT
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db() -> Session:
     """Dependency para obter sessão de banco de dados"""
     db = SessionLocal()
@@ -23,9 +69,55 @@ def get_db() -> Session:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Dependency para obter sessão assíncrona de banco de dados"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def insert_ignore(db: AsyncSession, model):
+    """
+    INSERT ... ON CONFLICT DO NOTHING no dialeto da sessão
+
+    Postgres em produção; SQLite apenas em desenvolvimento.
+    """
+    insert = sqlite.insert if db.bind.dialect.name == "sqlite" else postgresql.insert
+    return insert(model).on_conflict_do_nothing()
+
+# Colunas adicionadas a tabelas já existentes. O create_all só cria tabelas
+# novas, então init_db acrescenta estas colunas em bancos criados antes delas.
+ADDED_COLUMNS = {
+    "processed_messages": ["canonical_urls", "content_simhash", "duplicate_of", "enqueued_at", "media"],
+    "bot_sessions": ["latency_ms", "last_error", "consecutive_failures"],
+    "send_jobs": ["media"],
+}
+
+def migrate_db():
+    """
+    Acrescentar as colunas de ADDED_COLUMNS e os índices dos modelos que
+    ainda não existem (idempotente)
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, column_names in ADDED_COLUMNS.items():
+            if not inspector.has_table(table_name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            for column_name in column_names:
+                if column_name in existing:
+                    continue
+                column = Base.metadata.tables[table_name].c[column_name]
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+
+        # Índices novos em tabelas existentes (ex.: processed_messages.processed_at)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
 def init_db():
-    """Inicializar banco de dados (criar tabelas)"""
+    """Inicializar banco de dados (criar tabelas e colunas novas)"""
     Base.metadata.create_all(bind=engine)
+    migrate_db()
 
 def drop_db():
     """Deletar todas as tabelas (apenas para desenvolvimento)"""
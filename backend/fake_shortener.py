@@ -0,0 +1,61 @@
+"""
+Encurtador local falso (para testar a expansão de links offline)
+
+Responde 301 para /<código> conforme o mapa REDIRECTS e 405 para HEAD em
+/nohead/<código>, simulando encurtadores que só aceitam GET.
+
+Uso:
+    python fake_shortener.py --port 8088
+    SHORTENER_DOMAINS='["localhost"]' ...  # e use http://localhost:8088/abc nas mensagens
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REDIRECTS = {
+    "abc": "https://www.amazon.com.br/dp/B0TESTE123",
+    "shp": "https://shopee.com.br/produto-teste-i.123.456",
+    "chain": "/abc",
+}
+
+
+class ShortenerHandler(BaseHTTPRequestHandler):
+    def _redirect(self, send_body: bool):
+        path = self.path.strip("/")
+        no_head = path.startswith("nohead/")
+        code = path.split("/")[-1]
+
+        if no_head and not send_body:
+            self.send_response(405)
+            self.end_headers()
+            return
+
+        target = REDIRECTS.get(code)
+        if target is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(301)
+        self.send_header("Location", target)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._redirect(send_body=False)
+
+    def do_GET(self):
+        self._redirect(send_body=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encurtador local falso")
+    parser.add_argument("--port", type=int, default=8088)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), ShortenerHandler)
+    print(f"Encurtador falso em http://127.0.0.1:{args.port} ({', '.join(REDIRECTS)})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Enviador local de webhooks falsos da Whapi (para testes offline)
+
+Uso:
+    python fake_webhook.py --text "Oferta https://shopee.com.br/produto-123"
+    python fake_webhook.py --count 5 --url http://localhost:8000/webhooks/whapi
+    python fake_webhook.py --event participants --group-id 120363...@g.us --action add --participants 3
+"""
+import argparse
+import time
+import uuid
+
+import httpx
+
+from config import settings
+
+
+def build_message_event(chat_id: str, text: str) -> dict:
+    """Montar um evento de mensagem no formato enviado pela Whapi"""
+    return {
+        "messages": [
+            {
+                "id": f"fake-{uuid.uuid4().hex}",
+                "from_me": False,
+                "type": "text",
+                "chat_id": chat_id,
+                "timestamp": int(time.time()),
+                "from": settings.bot_reader_number or "5511000000000",
+                "text": {"body": text}
+            }
+        ],
+        "event": {"type": "messages", "event": "post"},
+        "channel_id": "FAKE-CHANNEL"
+    }
+
+
+def build_participants_event(group_id: str, action: str, participants: int) -> dict:
+    """Montar um evento de entrada/saída de participantes no formato da Whapi"""
+    return {
+        "groups_participants": [
+            {
+                "group_id": group_id,
+                "action": action,
+                "participants": [f"55119{i:08d}@s.whatsapp.net" for i in range(participants)],
+                "timestamp": int(time.time())
+            }
+        ],
+        "event": {"type": "groups_participants", "event": "post"},
+        "channel_id": "FAKE-CHANNEL"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enviar webhooks falsos da Whapi para a API local")
+    parser.add_argument("--event", choices=["messages", "participants"], default="messages")
+    parser.add_argument("--url", default=f"http://localhost:{settings.server_port}/webhooks/whapi")
+    parser.add_argument("--chat-id", default=settings.source_group_id)
+    parser.add_argument("--text", default="Oferta de teste https://shopee.com.br/produto-teste")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--group-id", help="Grupo de destino (eventos de participantes)")
+    parser.add_argument("--action", choices=["add", "remove", "leave"], default="add")
+    parser.add_argument("--participants", type=int, default=1)
+    parser.add_argument("--secret", default=settings.whapi_webhook_secret)
+    args = parser.parse_args()
+
+    headers = {"X-Webhook-Secret": args.secret} if args.secret else {}
+
+    with httpx.Client(timeout=10.0) as client:
+        for i in range(args.count):
+            if args.event == "participants":
+                payload = build_participants_event(args.group_id, args.action, args.participants)
+            else:
+                payload = build_message_event(args.chat_id, args.text)
+            response = client.post(args.url, json=payload, headers=headers)
+            print(f"[{i + 1}/{args.count}] {response.status_code} {response.text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Set, TypeVar
+
+from sqlalchemy import case, update
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from models import BotRateLimit
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Limitador de taxa no formato token bucket (assíncrono)"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        """
+        Args:
+            rate_per_second: Tokens repostos por segundo
+            capacity: Quantidade máxima de tokens acumulados (rajada)
+        """
+        self.rate = rate_per_second
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = max(0.0, now - self._updated_at)
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Suspender a emissão de tokens (ex: após um 429 com Retry-After)
+
+        Os tokens acumulados são descartados para não gerar rajada ao retomar.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated_at = self._paused_until
+
+    def try_acquire(self) -> bool:
+        """Consumir um token se houver um disponível agora (sem aguardar)"""
+        if time.monotonic() < self._paused_until:
+            return False
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Aguardar até que um token esteja disponível e consumi-lo"""
+        # O lock garante ordem de chegada (FIFO) entre os envios que aguardam
+        async with self._lock:
+            while True:
+                paused_for = self._paused_until - time.monotonic()
+                if paused_for > 0:
+                    await asyncio.sleep(paused_for)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket de um bot compartilhado por todos os processos (tabela bot_rate_limits)
+
+    Cada envio avança atomicamente `next_send_at` (momento em que o bucket
+    fica cheio de novo) em 1 / taxa segundos e espera até o seu horário; até
+    `capacity` envios seguidos passam sem espera. Assim a API, o worker e as
+    réplicas dividem a mesma taxa por número de WhatsApp, e um 429 recebido
+    por um processo pausa o bot em todos. Os relógios das máquinas precisam
+    estar sincronizados (NTP). Se o banco falhar, vale o bucket local.
+    """
+
+    def __init__(self, bot_key: str, rate_per_second: float, capacity: float):
+        super().__init__(rate_per_second, capacity)
+        self.bot_key = bot_key
+        self._pause_tasks: Set[asyncio.Task] = set()
+
+    async def _reserve(self, now: float) -> float:
+        """Reservar o próximo horário de envio do bot e retornar a espera até ele"""
+        interval = 1 / self.rate
+        slot = case((BotRateLimit.next_send_at > now, BotRateLimit.next_send_at), else_=now)
+
+        async with AsyncSessionLocal() as db:
+            try:
+                statement = update(BotRateLimit).where(
+                    BotRateLimit.bot_key == self.bot_key
+                ).values(next_send_at=slot + interval).returning(BotRateLimit.next_send_at)
+                full_at = (await db.execute(statement)).scalar_one_or_none()
+                if full_at is None:
+                    await db.execute(insert_ignore(db, BotRateLimit).values(bot_key=self.bot_key, next_send_at=0.0))
+                    full_at = (await db.execute(statement)).scalar_one()
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+        return max(0.0, full_at - self.capacity * interval - now)
+
+    async def acquire(self):
+        """Aguardar o horário reservado para este envio no limite compartilhado do bot"""
+        paused_for = self._paused_until - time.monotonic()
+        if paused_for > 0:
+            await asyncio.sleep(paused_for)
+
+        try:
+            wait = await self._reserve(time.time())
+        except Exception as e:
+            logger.error(f"Erro no limite de taxa compartilhado do bot {self.bot_key}, usando o local: {str(e)}")
+            await super().acquire()
+            return
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _store_pause(self, seconds: float):
+        # Sem rajada ao retomar: o bucket só volta a encher depois da pausa
+        full_at = time.time() + seconds + self.capacity / self.rate
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert_ignore(db, BotRateLimit).values(bot_key=self.bot_key, next_send_at=0.0))
+                await db.execute(
+                    update(BotRateLimit).where(
+                        BotRateLimit.bot_key == self.bot_key,
+                        BotRateLimit.next_send_at < full_at
+                    ).values(next_send_at=full_at)
+                )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao gravar pausa do bot {self.bot_key}: {str(e)}")
+                await db.rollback()
+
+    def pause(self, seconds: float):
+        """Suspender o bot neste processo e, pelo banco, nos demais"""
+        super().pause(seconds)
+        task = asyncio.ensure_future(self._store_pause(seconds))
+        self._pause_tasks.add(task)
+        task.add_done_callback(self._pause_tasks.discard)
+
+
+class FanoutScheduler:
+    """
+    Agendador de envios concorrentes para os grupos de destino
+
+    Cada envio passa por: jitter aleatório (comportamento humano), limite de
+    concorrência do bot, token bucket do bot e, só durante o envio, limite
+    global de concorrência. Assim o tempo total de um fan-out é limitado pela
+    taxa de envio e não pela soma dos delays, e um bot lento ou pausado por 429
+    não ocupa as vagas globais dos demais enquanto espera tokens.
+    """
+
+    def __init__(
+        self,
+        global_concurrency: int = None,
+        per_bot_concurrency: int = None,
+        rate_per_minute: float = None,
+        burst: int = None,
+        jitter_min: float = None,
+        jitter_max: float = None,
+        bot_rates: Dict[str, float] = None,
+        shared: bool = None
+    ):
+        self.global_concurrency = global_concurrency or settings.fanout_global_concurrency
+        self.per_bot_concurrency = per_bot_concurrency or settings.fanout_per_bot_concurrency
+        self.rate_per_minute = rate_per_minute or settings.bot_rate_per_minute
+        self.burst = burst or settings.bot_rate_burst
+        self.jitter_min = settings.fanout_jitter_min if jitter_min is None else jitter_min
+        self.jitter_max = settings.fanout_jitter_max if jitter_max is None else jitter_max
+        # Taxa própria (envios por minuto) de bots com orçamento diferente do padrão
+        self.bot_rates = settings.poster_bot_rates if bot_rates is None else bot_rates
+        # Taxa de cada bot dividida entre todos os processos (tabela bot_rate_limits)
+        self.shared = settings.bot_rate_shared if shared is None else shared
+
+        self._global_semaphore = asyncio.Semaphore(self.global_concurrency)
+        self._bot_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._bot_buckets: Dict[str, TokenBucket] = {}
+
+    def rate_for(self, bot_key: str) -> float:
+        """Envios por minuto permitidos para um bot"""
+        return self.bot_rates.get(bot_key, self.rate_per_minute)
+
+    def bucket_for(self, bot_key: str) -> TokenBucket:
+        """Obter (ou criar) o token bucket de um bot"""
+        bucket = self._bot_buckets.get(bot_key)
+        if bucket is None:
+            if self.shared:
+                bucket = SharedTokenBucket(bot_key, self.rate_for(bot_key) / 60.0, self.burst)
+            else:
+                bucket = TokenBucket(self.rate_for(bot_key) / 60.0, self.burst)
+            self._bot_buckets[bot_key] = bucket
+        return bucket
+
+    def _semaphore_for(self, bot_key: str) -> asyncio.Semaphore:
+        semaphore = self._bot_semaphores.get(bot_key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_bot_concurrency)
+            self._bot_semaphores[bot_key] = semaphore
+        return semaphore
+
+    async def run(self, bot_key: str, send: Callable[[], Awaitable[T]]) -> T:
+        """
+        Executar um envio respeitando jitter, concorrência e taxa do bot
+
+        Args:
+            bot_key: Identificador do bot que fará o envio
+            send: Função assíncrona que realiza o envio
+
+        Returns:
+            Resultado de `send`
+        """
+        if self.jitter_max > 0:
+            await asyncio.sleep(random.uniform(self.jitter_min, self.jitter_max))
+
+        async with self._semaphore_for(bot_key):
+            await self.bucket_for(bot_key).acquire()
+            async with self._global_semaphore:
+                return await send()
+
+    def throttle(self, seconds: float, bot_key: str = None):
+        """
+        Reduzir o ritmo de envio após um aviso de limite de taxa da API
+
+        Args:
+            seconds: Tempo de pausa (normalmente o Retry-After)
+            bot_key: Bot afetado; se omitido, pausa todos os bots
+        """
+        buckets = [self.bucket_for(bot_key)] if bot_key else list(self._bot_buckets.values())
+        for bucket in buckets:
+            bucket.pause(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado atual dos limites (para observabilidade)"""
+        return {
+            "global_concurrency": self.global_concurrency,
+            "per_bot_concurrency": self.per_bot_concurrency,
+            "rate_per_minute": self.rate_per_minute,
+            "shared": self.shared,
+            "bots": sorted(self._bot_buckets.keys())
+        }
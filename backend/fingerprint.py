@@ -0,0 +1,311 @@
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy import and_, or_, select
+
+from config import settings
+from database import AsyncSessionLocal
+from link_matcher import normalize_domain
+from models import ProcessedMessage
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+# Ofertas mais recentes da janela comparadas por find_duplicate_in_db
+DB_SCAN_LIMIT = 500
+
+# Identificadores de produto que independem do slug/rastreamento da URL
+_AMAZON_PRODUCT_RE = re.compile(r'/(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})', re.IGNORECASE)
+_SHOPEE_PRODUCT_RE = re.compile(r'(?:-i\.|/product/)(\d+)[./](\d+)')
+# URLs canônicas reduzidas ao identificador do produto (ver canonical_url)
+_CANONICAL_PRODUCT_RE = re.compile(r'^(?:amazon\.[^/]+/dp/|shopee\.com\.br/product/)')
+_URL_RE = re.compile(r'https?://\S+')
+_WORD_RE = re.compile(r'[^\W\d_]+')
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalizar a URL de um produto para comparação
+
+    Remove esquema, "www.", query string e fragmento. Links da Amazon e da
+    Shopee são reduzidos ao identificador do produto.
+
+    Args:
+        url: URL final do produto (já expandida, se encurtada)
+
+    Returns:
+        URL canônica (ex: amazon.com.br/dp/B0TESTE123)
+    """
+    host = normalize_domain(url)
+    path = urlsplit(url if "://" in url else f"http://{url}").path.rstrip("/")
+
+    if host.startswith("amazon."):
+        match = _AMAZON_PRODUCT_RE.search(path)
+        if match:
+            return f"{host}/dp/{match.group(1).upper()}"
+    if host.endswith("shopee.com.br"):
+        match = _SHOPEE_PRODUCT_RE.search(path)
+        if match:
+            return f"shopee.com.br/product/{match.group(1)}/{match.group(2)}"
+
+    return f"{host}{path}"
+
+
+def product_urls(urls: Iterable[str]) -> FrozenSet[str]:
+    """URLs canônicas que identificam um produto (Amazon /dp/, Shopee /product/)"""
+    return frozenset(url for url in urls if _CANONICAL_PRODUCT_RE.match(url))
+
+
+def simhash(text: str) -> int:
+    """
+    SimHash de 64 bits do texto de uma mensagem, sem os links
+
+    Textos quase iguais (preço ou emoji alterado) ficam a poucos bits de
+    distância. Usa palavras e pares de palavras normalizados (minúsculas, sem
+    acentos e sem números, já que o preço costuma mudar entre repostagens).
+    """
+    text = _URL_RE.sub(" ", text)
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    words = _WORD_RE.findall(text)
+    features = words + [" ".join(pair) for pair in zip(words, words[1:])]
+
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def to_signed(value: int) -> int:
+    """Converter um hash de 64 bits sem sinal para caber em BIGINT"""
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << SIMHASH_BITS) if value < 0 else value
+
+
+class FingerprintIndex:
+    """
+    Índice das ofertas transmitidas recentemente, para detectar repostagens
+
+    Uma mensagem é considerada duplicada de uma oferta transmitida dentro da
+    janela DUPLICATE_WINDOW quando:
+    - todos os seus produtos (URLs canônicas) já foram transmitidos; ou
+    - o texto está a até DUPLICATE_SIMHASH_DISTANCE bits de distância e aponta
+      para as mesmas lojas (ex.: link encurtado diferente que não foi expandido),
+      desde que a mensagem não tenha produtos identificados ou tenha algum em
+      comum com a oferta anterior (o mesmo texto de chamada em produtos
+      diferentes não é repostagem).
+
+    O índice em memória é só o caminho rápido: cada processo (API, worker,
+    réplicas) tem o seu. A decisão final é de find_duplicate_in_db, que consulta
+    as impressões digitais gravadas em processed_messages por todos os processos.
+    """
+
+    def __init__(self, window: float = None, max_distance: int = None):
+        self.window = window if window is not None else settings.duplicate_window
+        self.max_distance = max_distance if max_distance is not None else settings.duplicate_simhash_distance
+        self._entries: deque = deque()
+        self._urls: Dict[str, Dict[str, Any]] = {}
+        self.checked = 0
+        self.suppressed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @staticmethod
+    def fingerprint(text: str, links: Iterable[str], resolved_links: Dict[str, str] = None) -> Dict[str, Any]:
+        """
+        Calcular a impressão digital de uma mensagem
+
+        Args:
+            text: Texto original da mensagem
+            links: Links encontrados no texto
+            resolved_links: Mapa de links encurtados para a URL final
+
+        Returns:
+            Dict com "urls" (URLs canônicas) e "simhash"
+        """
+        resolved_links = resolved_links or {}
+        urls = frozenset(canonical_url(resolved_links.get(link, link)) for link in links)
+        return {"urls": urls, "simhash": simhash(text)}
+
+    def _expire(self, now: float):
+        while self._entries and now - self._entries[0]["seen_at"] > self.window:
+            entry = self._entries.popleft()
+            for url in entry["urls"]:
+                if self._urls.get(url) is entry:
+                    del self._urls[url]
+
+    def find_duplicate(self, fingerprint: Dict[str, Any], now: float = None, message_id: str = None) -> Optional[str]:
+        """
+        Procurar uma oferta transmitida na janela da qual a mensagem é cópia
+
+        Args:
+            fingerprint: Impressão digital da mensagem
+            now: Momento da verificação (epoch)
+            message_id: ID da própria mensagem, ignorado (reprocessamento após restart)
+
+        Returns:
+            ID da mensagem original, ou None se a oferta é nova
+        """
+        if not self.enabled:
+            return None
+
+        self._expire(now or time.time())
+        self.checked += 1
+
+        urls: FrozenSet[str] = fingerprint["urls"]
+        if urls and all(url in self._urls and self._urls[url]["message_id"] != message_id for url in urls):
+            return self._urls[next(iter(urls))]["message_id"]
+
+        hosts = {url.split("/", 1)[0] for url in urls}
+        for entry in reversed(self._entries):
+            if entry["message_id"] == message_id:
+                continue
+            if entry["hosts"] == hosts and self._is_similar(fingerprint, entry["urls"], entry["simhash"]):
+                return entry["message_id"]
+
+        return None
+
+    def _is_similar(self, fingerprint: Dict[str, Any], other_urls: FrozenSet[str], other_simhash: int) -> bool:
+        """Texto quase igual ao de outra oferta sem produtos distintos"""
+        products = product_urls(fingerprint["urls"])
+        if products and not products & product_urls(other_urls):
+            return False
+        return hamming_distance(other_simhash, fingerprint["simhash"]) <= self.max_distance
+
+    async def find_duplicate_in_db(self, message_id: str, fingerprint: Dict[str, Any]) -> Optional[str]:
+        """
+        Procurar no banco uma oferta anterior, transmitida na janela, da qual a mensagem é cópia
+
+        Considera as impressões digitais gravadas por qualquer processo. A
+        impressão da própria mensagem deve ser gravada antes: entre duas cópias
+        processadas ao mesmo tempo, só a mais recente (processed_at, id) é
+        suprimida. Compara no máximo as DB_SCAN_LIMIT ofertas mais recentes
+        das mesmas lojas.
+
+        Returns:
+            ID da mensagem original, ou None se a oferta é nova
+        """
+        urls: FrozenSet[str] = fingerprint["urls"]
+        if not self.enabled or not urls:
+            return None
+
+        hosts = {url.split("/", 1)[0] for url in urls}
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        own_processed_at = select(ProcessedMessage.processed_at).where(
+            ProcessedMessage.id == message_id
+        ).scalar_subquery()
+
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(
+                        ProcessedMessage.id,
+                        ProcessedMessage.canonical_urls,
+                        ProcessedMessage.content_simhash
+                    ).where(
+                        ProcessedMessage.processed_at >= since,
+                        ProcessedMessage.content_simhash.isnot(None),
+                        ProcessedMessage.duplicate_of.is_(None),
+                        or_(
+                            ProcessedMessage.processed_at < own_processed_at,
+                            and_(ProcessedMessage.processed_at == own_processed_at, ProcessedMessage.id < message_id)
+                        ),
+                        # Só ofertas que apontam para alguma das mesmas lojas
+                        or_(*[ProcessedMessage.canonical_urls.like(f'%"{host}%') for host in hosts])
+                    ).order_by(ProcessedMessage.processed_at.desc()).limit(DB_SCAN_LIMIT)
+                )).all()
+        except Exception as e:
+            logger.error(f"Erro ao consultar impressões digitais da mensagem {message_id}: {str(e)}")
+            return None
+
+        seen_urls: Dict[str, str] = {}
+        for row_id, row_urls, row_simhash in rows:
+            row_urls = frozenset(json.loads(row_urls or "[]"))
+            for url in row_urls:
+                seen_urls.setdefault(url, row_id)
+            row_hosts = {url.split("/", 1)[0] for url in row_urls}
+            if row_hosts == hosts and self._is_similar(fingerprint, row_urls, to_unsigned(row_simhash)):
+                return row_id
+
+        if all(url in seen_urls for url in urls):
+            return seen_urls[next(iter(urls))]
+        return None
+
+    def add(self, message_id: str, fingerprint: Dict[str, Any], seen_at: float = None):
+        """Registrar uma oferta transmitida"""
+        if not self.enabled:
+            return
+
+        entry = {
+            "message_id": message_id,
+            "seen_at": seen_at or time.time(),
+            "urls": fingerprint["urls"],
+            "hosts": {url.split("/", 1)[0] for url in fingerprint["urls"]},
+            "simhash": fingerprint["simhash"]
+        }
+        self._entries.append(entry)
+        for url in entry["urls"]:
+            self._urls[url] = entry
+
+    def record_suppressed(self):
+        self.suppressed += 1
+
+    async def warm(self):
+        """Carregar as ofertas transmitidas dentro da janela"""
+        if not self.enabled:
+            return
+
+        try:
+            since = datetime.utcnow() - timedelta(seconds=self.window)
+            async with AsyncSessionLocal() as db:
+                rows = (await db.scalars(
+                    select(ProcessedMessage).where(
+                        ProcessedMessage.processed_at >= since,
+                        ProcessedMessage.content_simhash.isnot(None),
+                        ProcessedMessage.duplicate_of.is_(None)
+                    ).order_by(ProcessedMessage.processed_at)
+                )).all()
+
+            for row in rows:
+                seen_at = (row.processed_at - datetime.utcnow()).total_seconds() + time.time()
+                self.add(row.id, {
+                    "urls": frozenset(json.loads(row.canonical_urls or "[]")),
+                    "simhash": to_unsigned(row.content_simhash)
+                }, seen_at=seen_at)
+
+            if rows:
+                logger.info(f"Índice de ofertas aquecido com {len(rows)} mensagem(ns)")
+        except Exception as e:
+            logger.error(f"Erro ao carregar impressões digitais de ofertas: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "window_seconds": self.window,
+            "tracked_offers": len(self._entries),
+            "checked": self.checked,
+            "suppressed": self.suppressed
+        }
+
+
+def serialize_urls(urls: Iterable[str]) -> str:
+    return json.dumps(sorted(urls))
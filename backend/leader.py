@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import or_, update
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+JobFactory = Callable[[], Awaitable[Any]]
+
+# Espera máxima antes de reiniciar uma tarefa que terminou (dobra a cada término seguido)
+JOB_RESTART_MAX_DELAY = 300.0
+
+
+class LeaderElector:
+    """
+    Eleição de líder por tarefa periódica, com lease no banco (tabela scheduler_leases)
+
+    Cada tarefa singleton (polling do grupo de origem, atualização de membros)
+    tem um lease com validade LEADER_LEASE_TTL. Apenas o processo que detém o
+    lease executa a tarefa e o renova a cada LEADER_RENEW_INTERVAL segundos; se
+    ele morrer, o lease expira e outro processo (worker do uvicorn ou réplica)
+    assume. Se um líder perder o lease (ex.: banco inacessível), cancela a tarefa.
+    """
+
+    def __init__(self, ttl: float = None, renew_interval: float = None, holder_id: str = None):
+        self.ttl = ttl or settings.leader_lease_ttl
+        self.renew_interval = renew_interval or settings.leader_renew_interval
+        self.holder_id = holder_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._leading: Dict[str, bool] = {}
+
+    def is_leader(self, name: str) -> bool:
+        return self._leading.get(name, False)
+
+    async def try_acquire(self, name: str) -> bool:
+        """
+        Adquirir ou renovar o lease de uma tarefa
+
+        Atômico: o UPDATE só tem efeito se o lease é deste processo ou expirou;
+        sem linha para a tarefa, o primeiro INSERT vence.
+
+        Returns:
+            True se este processo é o líder da tarefa
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    update(SchedulerLease).where(
+                        SchedulerLease.name == name,
+                        or_(SchedulerLease.holder == self.holder_id, SchedulerLease.expires_at < now)
+                    ).values(holder=self.holder_id, expires_at=expires_at, renewed_at=now)
+                )
+                acquired = result.rowcount > 0
+
+                if not acquired:
+                    result = await db.execute(
+                        insert_ignore(db, SchedulerLease).values(
+                            name=name, holder=self.holder_id, expires_at=expires_at, renewed_at=now
+                        )
+                    )
+                    acquired = result.rowcount > 0
+
+                await db.commit()
+                return acquired
+
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def release(self, name: str):
+        """Liberar o lease (outro processo assume sem esperar a expiração)"""
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    update(SchedulerLease).where(
+                        SchedulerLease.name == name,
+                        SchedulerLease.holder == self.holder_id
+                    ).values(expires_at=datetime.utcnow())
+                )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao liberar lease {name}: {str(e)}")
+                await db.rollback()
+
+    async def run(self, name: str, job_factory: JobFactory):
+        """
+        Executar uma tarefa apenas enquanto este processo for o líder
+
+        Se a tarefa terminar por conta própria (erro ou retorno), ela é
+        reiniciada com espera exponencial, sem largar a liderança. A disputa
+        só termina quando run() é cancelada.
+
+        Args:
+            name: Nome do lease (um por tarefa singleton)
+            job_factory: Função que cria a corrotina da tarefa
+        """
+        job: Optional[asyncio.Task] = None
+        job_started_at = 0.0
+        restarts = 0
+        restart_at = 0.0
+        logger.info(f"Disputando liderança de {name} como {self.holder_id}")
+
+        try:
+            while True:
+                try:
+                    leading = await self.try_acquire(name)
+                except Exception as e:
+                    logger.error(f"Erro ao renovar lease {name}: {str(e)}")
+                    leading = False
+
+                if leading and not self._leading.get(name):
+                    logger.info(f"Processo {self.holder_id} assumiu a liderança de {name}")
+                elif not leading and self._leading.get(name):
+                    logger.warning(f"Processo {self.holder_id} perdeu a liderança de {name}")
+                self._leading[name] = leading
+
+                if job is not None and job.done():
+                    if not job.cancelled():
+                        # Tarefa encerrada sem ser cancelada: reiniciar com espera crescente
+                        if time.monotonic() - job_started_at > JOB_RESTART_MAX_DELAY:
+                            restarts = 0
+                        delay = min(JOB_RESTART_MAX_DELAY, self.renew_interval * 2 ** restarts)
+                        restarts += 1
+                        restart_at = time.monotonic() + delay
+                        if job.exception() is not None:
+                            logger.error(f"Tarefa {name} falhou: {str(job.exception())}. Reiniciando em {delay:.1f}s")
+                        else:
+                            logger.warning(f"Tarefa {name} encerrada. Reiniciando em {delay:.1f}s")
+                    job = None
+
+                if leading and job is None and time.monotonic() >= restart_at:
+                    job = asyncio.create_task(job_factory())
+                    job_started_at = time.monotonic()
+                elif not leading and job is not None:
+                    job.cancel()
+
+                await asyncio.sleep(self.renew_interval)
+
+        finally:
+            if job is not None and not job.done():
+                job.cancel()
+                await asyncio.gather(job, return_exceptions=True)
+            if self._leading.pop(name, False):
+                await self.release(name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "holder_id": self.holder_id,
+            "leading": {name: leading for name, leading in self._leading.items()}
+        }
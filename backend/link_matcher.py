@@ -0,0 +1,83 @@
+import re
+from typing import Dict, Optional
+
+# Marca de fim de regra em um nó da trie (não colide com rótulos de domínio)
+_RULE = object()
+
+_SCHEME_RE = re.compile(r'^[a-z][a-z0-9+.-]*://')
+
+
+def normalize_domain(domain: str) -> str:
+    """
+    Normalizar um domínio ou URL para comparação
+
+    Remove esquema, caminho, porta, prefixo "www." e ponto final.
+
+    Args:
+        domain: Domínio ou URL (ex: https://www.Shopee.com.br/abc)
+
+    Returns:
+        Domínio normalizado (ex: shopee.com.br)
+    """
+    domain = _SCHEME_RE.sub("", domain.strip().lower())
+    domain = re.split(r'[/?#:]', domain, maxsplit=1)[0].rstrip(".")
+    if domain.startswith("www."):
+        domain = domain[4:]
+    return domain
+
+
+class AffiliateMatcher:
+    """
+    Índice de regras de afiliado por sufixo de domínio
+
+    As regras ficam em uma trie de rótulos invertidos (br → com → shopee), então
+    uma regra para "shopee.com.br" também vale para "s.shopee.com.br", mas não
+    para "notshopee.com.br". Quando mais de uma regra se aplica, vence o sufixo
+    mais longo. O custo de uma busca depende só do número de rótulos do host,
+    não da quantidade de regras.
+    """
+
+    def __init__(self, affiliate_map: Dict[str, str]):
+        """
+        Args:
+            affiliate_map: Mapa de domínios base para links de afiliado
+        """
+        self._root: dict = {}
+        self.size = 0
+        for domain, affiliate_link in affiliate_map.items():
+            self.add(domain, affiliate_link)
+
+    def add(self, domain: str, affiliate_link: str):
+        """Adicionar uma regra de afiliado"""
+        labels = [label for label in normalize_domain(domain).split(".") if label]
+        if not labels:
+            return
+
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        if _RULE not in node:
+            self.size += 1
+        node[_RULE] = affiliate_link
+
+    def match(self, host: str) -> Optional[str]:
+        """
+        Encontrar o link de afiliado para um host
+
+        Args:
+            host: Host da URL, já em minúsculas e sem "www."
+
+        Returns:
+            Link de afiliado da regra de sufixo mais longo, ou None
+        """
+        node = self._root
+        best = None
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            best = node.get(_RULE, best)
+        return best
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from sqlalchemy import select
+
+from config import settings
+from database import AsyncSessionLocal
+from link_matcher import normalize_domain
+from models import ResolvedLink
+
+logger = logging.getLogger(__name__)
+
+
+class LRUTTLCache:
+    """Cache LRU limitado por tamanho, com expiração por tempo"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, expires_at: float = None):
+        self._data[key] = (expires_at or time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ShortLinkResolver:
+    """
+    Expansão de links encurtados (amzn.to, s.shopee.com.br, bit.ly...)
+
+    Segue os redirecionamentos até sair dos domínios de encurtadores, para que
+    as regras de afiliado sejam aplicadas ao domínio real. Tenta HEAD primeiro (sem baixar conteúdo)
+    e usa GET quando o encurtador não aceita HEAD. Concorrência e timeouts são
+    limitados; resultados ficam em um cache LRU com TTL, opcionalmente
+    persistido no banco para que um restart já comece com o cache aquecido.
+    """
+
+    def __init__(
+        self,
+        shortener_domains: Iterable[str] = None,
+        concurrency: int = None,
+        timeout: float = None,
+        max_redirects: int = None,
+        cache_size: int = None,
+        cache_ttl: float = None,
+        persist: bool = None
+    ):
+        domains = shortener_domains if shortener_domains is not None else settings.shortener_domains
+        self.shortener_domains = {normalize_domain(domain) for domain in domains}
+        self.timeout = timeout or settings.link_resolver_timeout
+        self.max_redirects = max_redirects or settings.link_resolver_max_redirects
+        self.persist = settings.link_resolver_persist if persist is None else persist
+        self.cache = LRUTTLCache(
+            cache_size or settings.link_resolver_cache_size,
+            cache_ttl or settings.link_resolver_cache_ttl
+        )
+        self._semaphore = asyncio.Semaphore(concurrency or settings.link_resolver_concurrency)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Abrir o cliente HTTP e aquecer o cache com os links persistidos"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=False,
+                headers={"User-Agent": "Mozilla/5.0 (compatible; LinkResolver/1.0)"}
+            )
+        if self.persist and not len(self.cache):
+            await self._warm()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def is_short_link(self, url: str) -> bool:
+        """Verificar se a URL pertence a um encurtador conhecido"""
+        host = normalize_domain(url)
+        return any(host == domain or host.endswith("." + domain) for domain in self.shortener_domains)
+
+    async def resolve_all(self, urls: List[str]) -> Dict[str, str]:
+        """
+        Expandir em paralelo os links encurtados de uma lista
+
+        Returns:
+            Mapa de URL encurtada para URL final (apenas as expandidas com sucesso)
+        """
+        short_links = list(dict.fromkeys(url for url in urls if self.is_short_link(url)))
+        if not short_links:
+            return {}
+
+        finals = await asyncio.gather(*[self.resolve(url) for url in short_links])
+        return {url: final for url, final in zip(short_links, finals) if final and final != url}
+
+    async def resolve(self, url: str) -> Optional[str]:
+        """
+        Expandir um link (com cache e coalescência de chamadas simultâneas)
+
+        Returns:
+            URL final, ou None se não foi possível expandir
+        """
+        cached = self.cache.get(url)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve_uncached(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _resolve_uncached(self, url: str) -> Optional[str]:
+        if self._client is None or self._client.is_closed:
+            await self.start()
+
+        async with self._semaphore:
+            try:
+                # Timeout total da cadeia de redirecionamentos
+                final = await asyncio.wait_for(self._follow(url), timeout=self.timeout * 2)
+            except Exception as e:
+                logger.warning(f"Não foi possível expandir {url}: {str(e) or type(e).__name__}")
+                return None
+
+        self.cache.set(url, final)
+        if self.persist:
+            await self._save(url, final)
+        logger.debug(f"Link expandido: {url} → {final}")
+        return final
+
+    async def _follow(self, url: str) -> str:
+        current = url
+        for _ in range(self.max_redirects):
+            response = await self._client.head(current)
+            if response.status_code in (403, 404, 405, 501):
+                # Encurtador sem suporte a HEAD: GET sem ler o corpo
+                async with self._client.stream("GET", current) as streamed:
+                    response = streamed
+
+            location = response.headers.get("Location")
+            if not response.is_redirect or not location:
+                return current
+            current = str(response.url.join(location))
+
+            # Saiu dos encurtadores: o domínio final já é conhecido, sem requisitar a loja
+            if not self.is_short_link(current):
+                return current
+
+        logger.warning(f"Limite de redirecionamentos atingido ao expandir {url}")
+        return current
+
+    async def _warm(self):
+        try:
+            async with AsyncSessionLocal() as db:
+                since = datetime.utcnow() - timedelta(seconds=self.cache.ttl)
+                rows = (await db.scalars(
+                    select(ResolvedLink).where(
+                        ResolvedLink.resolved_at >= since
+                    ).order_by(ResolvedLink.resolved_at.desc()).limit(self.cache.max_size)
+                )).all()
+
+            # Inserir do mais antigo para o mais novo para manter a ordem LRU
+            for row in reversed(rows):
+                expires_at = (row.resolved_at - datetime.utcnow()).total_seconds() + time.time() + self.cache.ttl
+                self.cache.set(row.short_url, row.final_url, expires_at=expires_at)
+
+            if rows:
+                logger.info(f"Cache de links expandidos aquecido com {len(rows)} link(s)")
+        except Exception as e:
+            logger.error(f"Erro ao carregar links expandidos: {str(e)}")
+
+    async def _save(self, short_url: str, final_url: str):
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.merge(ResolvedLink(short_url=short_url, final_url=final_url, resolved_at=datetime.utcnow()))
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao salvar link expandido: {str(e)}")
+                await db.rollback()
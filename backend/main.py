@@ -1,21 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from datetime import datetime
+from fastapi.responses import RedirectResponse as HTTPRedirectResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Optional
 import logging
 import random
 import asyncio
 
 from config import settings
-from database import get_db, init_db
-from models import Group, AffiliateLink, ProcessedMessage, PostedMessage, ActivityLog
+from database import get_async_db, init_db
+from models import Group, AffiliateLink, ProcessedMessage, PostedMessage, ActivityLog, BotSession, SourceGroup
 from schemas import (
     GroupCreate, GroupUpdate, GroupResponse, GroupStats,
+    SourceGroupCreate, SourceGroupUpdate, SourceGroupResponse,
     AffiliateLinkCreate, AffiliateLinkUpdate, AffiliateLinkResponse,
-    DashboardStats, RedirectResponse
+    DashboardStats, RedirectResponse, WhapiWebhookPayload
 )
 from whapi_client import WhapiClient, LinkProcessor
 from background_tasks import BackgroundTaskManager
+from redirect_cache import group_snapshot, click_counter
+from rule_cache import affiliate_rule_cache
+from write_behind import delivery_writer
+from worker import BackgroundRunner
 
 # Configurar logging
 logging.basicConfig(
@@ -46,16 +54,19 @@ whapi_client = WhapiClient()
 # Inicializar gerenciador de tarefas em background
 background_manager = BackgroundTaskManager(whapi_client)
 
+# Tarefas em background (apenas com RUN_BACKGROUND_TASKS; senão rodam em `python -m worker`)
+background_runner = BackgroundRunner(background_manager)
+
 # Variável para armazenar as tasks
-monitoring_task = None
-members_update_task = None
+click_flush_task = None
+delivery_flush_task = None
 
 # ============ Startup & Shutdown ============
 
 @app.on_event("startup")
 async def startup_event():
     """Executar ao iniciar a aplicação"""
-    global monitoring_task, members_update_task
+    global click_flush_task, delivery_flush_task
     
     logger.info("Iniciando aplicação...")
     
@@ -66,7 +77,7 @@ async def startup_event():
         # Não impedir inicialização, mas avisar
     
     if not settings.source_group_id:
-        logger.warning("AVISO: SOURCE_GROUP_ID não configurado. Monitoramento não será iniciado.")
+        logger.warning("AVISO: SOURCE_GROUP_ID não configurado. Apenas os grupos de /api/source-groups serão monitorados.")
     
     # Inicializar banco de dados
     try:
@@ -76,54 +87,56 @@ async def startup_event():
         logger.error(f"Erro ao inicializar banco de dados: {str(e)}")
         raise
     
-    # Iniciar tarefas em background apenas se configurado
-    if settings.whapi_api_key and settings.source_group_id:
+    # Abrir pool de conexões com a Whapi (reaproveitado por todos os envios)
+    await whapi_client.start()
+    await background_manager.bot_registry.start()
+    await background_manager.link_resolver.start()
+    # Aquecer os índices de mensagens vistas e de ofertas já transmitidas
+    await background_manager.seen_index.warm()
+    await background_manager.fingerprint_index.warm()
+    
+    # Gravar em lote os cliques do link de redirecionamento
+    click_flush_task = asyncio.create_task(click_counter.run())
+    
+    # Gravar em lote os registros de entrega e de atividade do fan-out
+    delivery_flush_task = asyncio.create_task(delivery_writer.run())
+    
+    # Iniciar tarefas em background apenas se este processo as executa
+    if settings.run_background_tasks:
         try:
-            # Iniciar monitoramento do grupo de origem
-            monitoring_task = asyncio.create_task(
-                background_manager.start_monitoring(
-                    source_group_id=settings.source_group_id,
-                    check_interval=60  # Verificar a cada 60 segundos
-                )
-            )
-            logger.info(f"Monitoramento do grupo {settings.source_group_id} iniciado")
-            
-            # Iniciar atualização de contagem de membros
-            members_update_task = asyncio.create_task(
-                background_manager.update_group_members_count(
-                    check_interval=3600  # Atualizar a cada 1 hora
-                )
-            )
-            logger.info("Atualização periódica de membros iniciada")
+            background_runner.start()
         except Exception as e:
             logger.error(f"Erro ao iniciar tarefas em background: {str(e)}")
     else:
-        logger.warning("Tarefas em background não iniciadas. Verifique configurações.")
+        logger.info("Modo somente API: tarefas em background rodam no worker (python -m worker)")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Executar ao desligar a aplicação"""
-    global monitoring_task, members_update_task
+    global click_flush_task, delivery_flush_task
     
     logger.info("Desligando aplicação...")
     
     # Parar tarefas em background
-    background_manager.stop()
-    
-    # Cancelar tasks
-    if monitoring_task:
-        monitoring_task.cancel()
-        try:
-            await monitoring_task
-        except asyncio.CancelledError:
-            logger.info("Task de monitoramento cancelada")
-    
-    if members_update_task:
-        members_update_task.cancel()
-        try:
-            await members_update_task
-        except asyncio.CancelledError:
-            logger.info("Task de atualização de membros cancelada")
+    await background_runner.stop()
+    
+    # Gravar os cliques pendentes
+    # (esperando o flush periódico cancelado devolver o que não gravou)
+    if click_flush_task:
+        click_flush_task.cancel()
+        await asyncio.gather(click_flush_task, return_exceptions=True)
+    await click_counter.flush()
+    
+    # Gravar os registros de entrega pendentes
+    if delivery_flush_task:
+        delivery_flush_task.cancel()
+        await asyncio.gather(delivery_flush_task, return_exceptions=True)
+    await delivery_writer.flush()
+    
+    # Fechar pool de conexões com a Whapi
+    await whapi_client.close()
+    await background_manager.bot_registry.close()
+    await background_manager.link_resolver.close()
     
     logger.info("Aplicação desligada com sucesso")
 
@@ -132,12 +145,18 @@ async def shutdown_event():
 @app.get("/health")
 async def health_check():
     """Verificar saúde da API"""
+    breakers = whapi_client.breaker_states()
+    whapi_healthy = all(b["state"] == "CLOSED" for b in breakers.values())
+    
     return {
-        "status": "ok",
+        "status": "ok" if whapi_healthy else "degraded",
         "timestamp": datetime.utcnow().isoformat(),
         "monitoring_active": background_manager.is_running,
+        "background_tasks": settings.run_background_tasks,
         "whapi_configured": bool(settings.whapi_api_key),
-        "source_group_configured": bool(settings.source_group_id)
+        "source_group_configured": bool(settings.source_group_id),
+        "leader": background_runner.leader_elector.stats(),
+        "whapi_circuit_breakers": breakers
     }
 
 # ============ Groups Endpoints ============
@@ -145,12 +164,12 @@ async def health_check():
 @app.post("/api/groups", response_model=GroupResponse)
 async def create_group(
     group: GroupCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Criar um novo grupo"""
     try:
         # Verificar se o grupo já existe
-        existing = db.query(Group).filter(Group.id == group.name).first()
+        existing = await db.get(Group, group.name)
         if existing:
             raise HTTPException(status_code=400, detail="Grupo já existe")
         
@@ -165,8 +184,9 @@ async def create_group(
         )
         
         db.add(new_group)
-        db.commit()
-        db.refresh(new_group)
+        await db.commit()
+        await db.refresh(new_group)
+        group_snapshot.invalidate()
         
         # Registrar atividade
         log = ActivityLog(
@@ -176,36 +196,36 @@ async def create_group(
             status="SUCCESS"
         )
         db.add(log)
-        db.commit()
+        await db.commit()
         
         logger.info(f"Grupo criado: {group.name}")
         return new_group
     
     except Exception as e:
         logger.error(f"Erro ao criar grupo: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/groups", response_model=list[GroupResponse])
 async def list_groups(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     active_only: bool = True
 ):
     """Listar todos os grupos"""
-    query = db.query(Group)
+    query = select(Group)
     if active_only:
-        query = query.filter(Group.is_active == True)
+        query = query.where(Group.is_active == True)
     
-    groups = query.order_by(Group.order).all()
+    groups = (await db.scalars(query.order_by(Group.order))).all()
     return groups
 
 @app.get("/api/groups/{group_id}", response_model=GroupResponse)
 async def get_group(
     group_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obter detalhes de um grupo"""
-    group = db.query(Group).filter(Group.id == group_id).first()
+    group = await db.get(Group, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
     return group
@@ -214,10 +234,10 @@ async def get_group(
 async def update_group(
     group_id: str,
     group_update: GroupUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Atualizar um grupo"""
-    group = db.query(Group).filter(Group.id == group_id).first()
+    group = await db.get(Group, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
     
@@ -227,8 +247,9 @@ async def update_group(
         setattr(group, field, value)
     
     group.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(group)
+    await db.commit()
+    await db.refresh(group)
+    group_snapshot.invalidate()
     
     logger.info(f"Grupo atualizado: {group_id}")
     return group
@@ -236,32 +257,119 @@ async def update_group(
 @app.delete("/api/groups/{group_id}")
 async def delete_group(
     group_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Deletar um grupo"""
-    group = db.query(Group).filter(Group.id == group_id).first()
+    group = await db.get(Group, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
     
-    db.delete(group)
-    db.commit()
+    await db.delete(group)
+    await db.commit()
+    group_snapshot.invalidate()
     
     logger.info(f"Grupo deletado: {group_id}")
     return {"message": "Grupo deletado com sucesso"}
 
+# ============ Source Groups Endpoints ============
+
+@app.post("/api/source-groups", response_model=SourceGroupResponse)
+async def create_source_group(
+    source: SourceGroupCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Cadastrar um grupo de origem"""
+    if source.ingest_mode not in (None, "polling", "webhook"):
+        raise HTTPException(status_code=400, detail="Modo de ingestão inválido (polling ou webhook)")
+    
+    existing = await db.get(SourceGroup, source.id)
+    if existing:
+        raise HTTPException(status_code=400, detail="Grupo de origem já existe")
+    
+    try:
+        new_source = SourceGroup(**source.model_dump())
+        db.add(new_source)
+        await db.commit()
+        await db.refresh(new_source)
+        background_manager.invalidate_source_groups()
+        
+        logger.info(f"Grupo de origem cadastrado: {source.id}")
+        return new_source
+    
+    except Exception as e:
+        logger.error(f"Erro ao cadastrar grupo de origem: {str(e)}")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/source-groups", response_model=list[SourceGroupResponse])
+async def list_source_groups(
+    db: AsyncSession = Depends(get_async_db),
+    active_only: bool = True
+):
+    """Listar os grupos de origem"""
+    query = select(SourceGroup)
+    if active_only:
+        query = query.where(SourceGroup.is_active == True)
+    
+    sources = (await db.scalars(query.order_by(SourceGroup.priority.desc()))).all()
+    return sources
+
+@app.put("/api/source-groups/{source_id}", response_model=SourceGroupResponse)
+async def update_source_group(
+    source_id: str,
+    source_update: SourceGroupUpdate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Atualizar um grupo de origem"""
+    source = await db.get(SourceGroup, source_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Grupo de origem não encontrado")
+    
+    update_data = source_update.model_dump(exclude_unset=True)
+    if update_data.get("ingest_mode") not in (None, "polling", "webhook"):
+        raise HTTPException(status_code=400, detail="Modo de ingestão inválido (polling ou webhook)")
+    
+    for field, value in update_data.items():
+        setattr(source, field, value)
+    
+    source.updated_at = datetime.utcnow()
+    await db.commit()
+    await db.refresh(source)
+    background_manager.invalidate_source_groups()
+    
+    logger.info(f"Grupo de origem atualizado: {source_id}")
+    return source
+
+@app.delete("/api/source-groups/{source_id}")
+async def delete_source_group(
+    source_id: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Remover um grupo de origem (o cursor é mantido para uma nova inclusão)"""
+    source = await db.get(SourceGroup, source_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Grupo de origem não encontrado")
+    
+    await db.delete(source)
+    await db.commit()
+    background_manager.invalidate_source_groups()
+    
+    logger.info(f"Grupo de origem removido: {source_id}")
+    return {"message": "Grupo de origem removido com sucesso"}
+
 # ============ Affiliate Links Endpoints ============
 
 @app.post("/api/affiliate-links", response_model=AffiliateLinkResponse)
 async def create_affiliate_link(
     link: AffiliateLinkCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Criar um novo link de afiliado"""
     try:
         # Verificar se já existe
-        existing = db.query(AffiliateLink).filter(
-            AffiliateLink.domain_base == link.domain_base
-        ).first()
+        existing = await db.scalar(
+            select(AffiliateLink).where(AffiliateLink.domain_base == link.domain_base)
+        )
         if existing:
             raise HTTPException(status_code=400, detail="Link de afiliado para este domínio já existe")
         
@@ -272,38 +380,39 @@ async def create_affiliate_link(
         )
         
         db.add(new_link)
-        db.commit()
-        db.refresh(new_link)
+        await affiliate_rule_cache.mark_changed(db)
+        await db.commit()
+        await db.refresh(new_link)
         
         logger.info(f"Link de afiliado criado: {link.domain_base}")
         return new_link
     
     except Exception as e:
         logger.error(f"Erro ao criar link de afiliado: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/affiliate-links", response_model=list[AffiliateLinkResponse])
 async def list_affiliate_links(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     active_only: bool = True
 ):
     """Listar todos os links de afiliado"""
-    query = db.query(AffiliateLink)
+    query = select(AffiliateLink)
     if active_only:
-        query = query.filter(AffiliateLink.is_active == True)
+        query = query.where(AffiliateLink.is_active == True)
     
-    links = query.all()
+    links = (await db.scalars(query)).all()
     return links
 
 @app.put("/api/affiliate-links/{link_id}", response_model=AffiliateLinkResponse)
 async def update_affiliate_link(
     link_id: int,
     link_update: AffiliateLinkUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Atualizar um link de afiliado"""
-    link = db.query(AffiliateLink).filter(AffiliateLink.id == link_id).first()
+    link = await db.get(AffiliateLink, link_id)
     if not link:
         raise HTTPException(status_code=404, detail="Link de afiliado não encontrado")
     
@@ -313,8 +422,9 @@ async def update_affiliate_link(
         setattr(link, field, value)
     
     link.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(link)
+    await affiliate_rule_cache.mark_changed(db)
+    await db.commit()
+    await db.refresh(link)
     
     logger.info(f"Link de afiliado atualizado: {link_id}")
     return link
@@ -322,15 +432,16 @@ async def update_affiliate_link(
 @app.delete("/api/affiliate-links/{link_id}")
 async def delete_affiliate_link(
     link_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Deletar um link de afiliado"""
-    link = db.query(AffiliateLink).filter(AffiliateLink.id == link_id).first()
+    link = await db.get(AffiliateLink, link_id)
     if not link:
         raise HTTPException(status_code=404, detail="Link de afiliado não encontrado")
     
-    db.delete(link)
-    db.commit()
+    await db.delete(link)
+    await affiliate_rule_cache.mark_changed(db)
+    await db.commit()
     
     logger.info(f"Link de afiliado deletado: {link_id}")
     return {"message": "Link de afiliado deletado com sucesso"}
@@ -338,16 +449,23 @@ async def delete_affiliate_link(
 # ============ Dashboard Endpoints ============
 
 @app.get("/api/dashboard/stats", response_model=DashboardStats)
-async def get_dashboard_stats(db: Session = Depends(get_db)):
+async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
     """Obter estatísticas do dashboard"""
-    total_groups = db.query(Group).count()
-    active_groups = db.query(Group).filter(Group.is_active == True).count()
-    full_groups = db.query(Group).filter(Group.status == "CHEIO").count()
-    available_groups = db.query(Group).filter(Group.status == "DISPONIVEL").count()
-    total_affiliate_links = db.query(AffiliateLink).count()
-    total_messages_processed = db.query(ProcessedMessage).count()
-    total_messages_posted = db.query(PostedMessage).count()
-    bots_connected = 1 if background_manager.is_running else 0
+    total_groups = await db.scalar(select(func.count()).select_from(Group))
+    active_groups = await db.scalar(select(func.count()).select_from(Group).where(Group.is_active == True))
+    full_groups = await db.scalar(select(func.count()).select_from(Group).where(Group.status == "CHEIO"))
+    available_groups = await db.scalar(select(func.count()).select_from(Group).where(Group.status == "DISPONIVEL"))
+    total_affiliate_links = await db.scalar(select(func.count()).select_from(AffiliateLink))
+    total_messages_processed = await db.scalar(select(func.count()).select_from(ProcessedMessage))
+    total_messages_posted = await db.scalar(select(func.count()).select_from(PostedMessage))
+    # Bots com heartbeat recente e canal conectado
+    heartbeat_since = datetime.utcnow() - timedelta(seconds=settings.bot_heartbeat_interval * 3)
+    bots_connected = await db.scalar(
+        select(func.count()).select_from(BotSession).where(
+            BotSession.is_connected.is_(True),
+            BotSession.last_heartbeat >= heartbeat_since
+        )
+    )
     
     return DashboardStats(
         total_groups=total_groups,
@@ -363,20 +481,22 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
 @app.get("/api/dashboard/group-stats/{group_id}", response_model=GroupStats)
 async def get_group_stats(
     group_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obter estatísticas de um grupo específico"""
-    group = db.query(Group).filter(Group.id == group_id).first()
+    group = await db.get(Group, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
     
-    messages_posted = db.query(PostedMessage).filter(
-        PostedMessage.group_id == group_id
-    ).count()
+    messages_posted = await db.scalar(
+        select(func.count()).select_from(PostedMessage).where(PostedMessage.group_id == group_id)
+    )
     
-    last_message = db.query(PostedMessage).filter(
-        PostedMessage.group_id == group_id
-    ).order_by(PostedMessage.posted_at.desc()).first()
+    last_message = await db.scalar(
+        select(PostedMessage).where(
+            PostedMessage.group_id == group_id
+        ).order_by(PostedMessage.posted_at.desc()).limit(1)
+    )
     
     capacity_percentage = (group.current_members / group.max_capacity * 100) if group.max_capacity > 0 else 0
     
@@ -390,47 +510,40 @@ async def get_group_stats(
 # ============ Redirect Endpoint ============
 
 @app.get("/api/redirect", response_model=RedirectResponse)
-async def redirect_to_group(
-    db: Session = Depends(get_db),
-    background_tasks: BackgroundTasks = None
-):
+async def redirect_to_group(follow: Optional[bool] = None):
     """
     Redirecionar para o próximo grupo disponível
     Este é o link único que será publicado no site
+    
+    Usa o snapshot em memória dos grupos e contadores de cliques em memória,
+    sem acesso síncrono ao banco. O tráfego é distribuído entre os grupos
+    disponíveis pela lotação estimada (REDIRECT_STRATEGY). Com follow=true (ou REDIRECT_HTTP_302)
+    responde com um redirecionamento HTTP 302 para o convite do grupo.
     """
     try:
-        # Buscar o primeiro grupo disponível
-        available_group = db.query(Group).filter(
-            Group.status == "DISPONIVEL",
-            Group.is_active == True
-        ).order_by(Group.order).first()
+        available_group = await group_snapshot.current_target()
         
         if not available_group:
-            # Se não houver grupos disponíveis, pegar o primeiro ativo
-            available_group = db.query(Group).filter(
-                Group.is_active == True
-            ).order_by(Group.order).first()
-            
-            if not available_group:
-                raise HTTPException(status_code=404, detail="Nenhum grupo disponível")
+            raise HTTPException(status_code=404, detail="Nenhum grupo disponível")
         
-        # Registrar atividade
-        log = ActivityLog(
-            action="REDIRECT_CLICKED",
-            description=f"Usuário redirecionado para grupo: {available_group.name}",
-            related_group_id=available_group.id,
-            status="SUCCESS"
-        )
-        db.add(log)
-        db.commit()
+        # Registrar clique (estimativa de lotação + gravação em lote no ActivityLog)
+        group_snapshot.record_click(available_group["id"])
+        click_counter.record(available_group["id"], available_group["name"])
+        
+        use_http_redirect = settings.redirect_http_302 if follow is None else follow
+        if use_http_redirect:
+            return HTTPRedirectResponse(available_group["invite_link"], status_code=302)
         
         return RedirectResponse(
-            redirect_url=available_group.invite_link,
-            group_id=available_group.id,
-            group_name=available_group.name,
-            message=f"Bem-vindo ao grupo {available_group.name}!"
+            redirect_url=available_group["invite_link"],
+            group_id=available_group["id"],
+            group_name=available_group["name"],
+            message=f"Bem-vindo ao grupo {available_group['name']}!"
         )
     
+    except HTTPException:
+        raise
+    
     except Exception as e:
         logger.error(f"Erro ao redirecionar: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -439,37 +552,81 @@ async def redirect_to_group(
 
 @app.get("/api/activity-logs")
 async def get_activity_logs(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     limit: int = 50,
     offset: int = 0
 ):
     """Obter logs de atividade"""
-    logs = db.query(ActivityLog).order_by(
-        ActivityLog.created_at.desc()
-    ).offset(offset).limit(limit).all()
+    logs = (await db.scalars(
+        select(ActivityLog).order_by(
+            ActivityLog.created_at.desc()
+        ).offset(offset).limit(limit)
+    )).all()
     
     return logs
 
+# ============ Webhook Endpoints ============
+
+@app.post("/webhooks/whapi")
+async def whapi_webhook(
+    payload: WhapiWebhookPayload,
+    token: Optional[str] = None,
+    x_webhook_secret: Optional[str] = Header(None)
+):
+    """
+    Receber eventos da Whapi
+    - Mensagens dos grupos de origem seguem o mesmo pipeline do polling
+    - Entradas/saídas de participantes atualizam a lotação dos grupos em tempo real
+    """
+    if settings.whapi_webhook_secret and settings.whapi_webhook_secret not in (x_webhook_secret, token):
+        raise HTTPException(status_code=401, detail="Segredo do webhook inválido")
+    
+    accepted = 0
+    if payload.messages:
+        accepted = await background_manager.ingest_webhook_messages(payload.messages)
+    
+    groups_updated = 0
+    if payload.groups_participants:
+        groups_updated = await background_manager.apply_participant_events(payload.groups_participants)
+    
+    return {
+        "received": len(payload.messages),
+        "accepted": accepted,
+        "participant_events": len(payload.groups_participants),
+        "groups_updated": groups_updated
+    }
+
+# ============ Pipeline Endpoints ============
+
+@app.get("/api/pipeline/stats")
+async def get_pipeline_stats():
+    """Obter profundidade das filas e tempos dos estágios do pipeline"""
+    return {
+        "pipeline": background_manager.pipeline.stats(),
+        "seen_index": background_manager.seen_index.stats(),
+        "duplicates": background_manager.fingerprint_index.stats(),
+        "fanout": background_manager.fanout_scheduler.stats(),
+        "poster_bots": background_manager.bot_registry.stats(),
+        "media": background_manager.media_store.stats(),
+        "write_behind": delivery_writer.stats(),
+        "send_queue": await background_manager.send_queue.stats(),
+        "members_refresh": background_manager.capacity_scheduler.stats()
+    }
+
 # ============ Control Endpoints ============
 
 @app.post("/api/control/start-monitoring")
-async def start_monitoring_manual(db: Session = Depends(get_db)):
+async def start_monitoring_manual(db: AsyncSession = Depends(get_async_db)):
     """Iniciar monitoramento manualmente"""
-    global monitoring_task
-    
-    if not settings.source_group_id:
-        raise HTTPException(status_code=400, detail="SOURCE_GROUP_ID não configurado")
+    if not await background_manager.get_source_groups(max_age=0):
+        raise HTTPException(status_code=400, detail="Nenhum grupo de origem ativo")
     
-    if background_manager.is_running:
-        return {"message": "Monitoramento já está ativo"}
+    if not settings.run_background_tasks:
+        raise HTTPException(status_code=409, detail="Tarefas em background rodam no worker (RUN_BACKGROUND_TASKS=false)")
     
     try:
-        monitoring_task = asyncio.create_task(
-            background_manager.start_monitoring(
-                source_group_id=settings.source_group_id,
-                check_interval=60
-            )
-        )
+        if not background_runner.start_monitoring():
+            return {"message": "Monitoramento já está ativo"}
         logger.info("Monitoramento iniciado manualmente")
         return {"message": "Monitoramento iniciado com sucesso"}
     except Exception as e:
@@ -479,12 +636,7 @@ async def start_monitoring_manual(db: Session = Depends(get_db)):
 @app.post("/api/control/stop-monitoring")
 async def stop_monitoring_manual():
     """Parar monitoramento manualmente"""
-    global monitoring_task
-    
-    background_manager.stop()
-    
-    if monitoring_task:
-        monitoring_task.cancel()
+    await background_runner.stop_monitoring()
     
     logger.info("Monitoramento parado manualmente")
     return {"message": "Monitoramento parado com sucesso"}
@@ -495,7 +647,7 @@ async def stop_monitoring_manual():
 async def test_send_message(
     chat_id: str,
     message: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Endpoint de teste para enviar mensagem (apenas para desenvolvimento)"""
     if settings.environment != "development":
@@ -511,14 +663,14 @@ async def test_send_message(
 @app.post("/api/test/update-group-members")
 async def test_update_group_members(
     group_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Endpoint de teste para atualizar contagem de membros"""
     if settings.environment != "development":
         raise HTTPException(status_code=403, detail="Endpoint não disponível em produção")
     
     try:
-        group = db.query(Group).filter(Group.id == group_id).first()
+        group = await db.get(Group, group_id)
         if not group:
             raise HTTPException(status_code=404, detail="Grupo não encontrado")
         
@@ -535,8 +687,9 @@ async def test_update_group_members(
             else:
                 group.status = "DISPONIVEL"
             
-            db.commit()
-            db.refresh(group)
+            await db.commit()
+            await db.refresh(group)
+            group_snapshot.invalidate()
             
             return {
                 "group_id": group_id,
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from models import MediaUpload
+from whapi_client import WhapiClient
+
+logger = logging.getLogger(__name__)
+
+# Tipos de mensagem da Whapi tratados como oferta com mídia (legenda = texto)
+MEDIA_TYPES = ("image", "video", "document")
+
+CHUNK_SIZE = 65536
+EVICTION_INTERVAL = 60.0
+# Arquivos usados há menos tempo que isso não saem por tamanho (upload em andamento)
+EVICTION_GRACE = 600.0
+
+
+def extract_media(message: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Extrair a mídia e a legenda de uma mensagem da Whapi
+
+    Returns:
+        Mídia (type, source_id, mime_type) ou None, e a legenda
+    """
+    media_type = message.get("type")
+    content = message.get(media_type) if media_type in MEDIA_TYPES else None
+    if not isinstance(content, dict) or not content.get("id"):
+        return None, ""
+
+    media = {"type": media_type, "source_id": content["id"], "mime_type": content.get("mime_type")}
+    return media, content.get("caption") or ""
+
+
+def serialize_media(media: Optional[Dict[str, Any]]) -> Optional[str]:
+    return json.dumps(media) if media else None
+
+
+def deserialize_media(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    return json.loads(value) if value else None
+
+
+class MediaStore:
+    """
+    Armazenamento local das mídias das ofertas, endereçado pelo conteúdo
+
+    Cada arquivo é baixado da Whapi em blocos (sem carregar na memória) e
+    gravado como MEDIA_CACHE_DIR/<sha256[:2]>/<sha256>. O upload para a
+    Whapi é feito uma vez por arquivo e canal (token do bot) e o ID é
+    reutilizado em todos os grupos de destino (tabela media_uploads). Arquivos
+    sem uso há MEDIA_CACHE_MAX_AGE segundos são removidos, e os menos usados
+    saem primeiro quando o total passa de MEDIA_CACHE_MAX_BYTES.
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        max_bytes: int = None,
+        max_age: float = None,
+        upload_ttl: float = None
+    ):
+        self.directory = Path(directory or settings.media_cache_dir)
+        self.max_bytes = max_bytes or settings.media_cache_max_bytes
+        self.max_age = max_age or settings.media_cache_max_age
+        self.upload_ttl = upload_ttl or settings.media_upload_ttl
+        # (sha256, canal) → (ID da mídia, momento do upload)
+        self._uploads: Dict[Tuple[str, str], Tuple[str, datetime]] = {}
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self._last_eviction = 0.0
+        self.downloads = 0
+        self.download_hits = 0
+        self.uploads = 0
+        self.upload_hits = 0
+        self.evicted = 0
+        self.stored_files = 0
+        self.stored_bytes = 0
+
+    def path_for(self, sha256: str) -> Path:
+        return self.directory / sha256[:2] / sha256
+
+    async def _coalesce(self, key: Any, factory):
+        """Compartilhar uma única operação entre chamadas simultâneas com a mesma chave"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: o cancelamento de um chamador não cancela a operação dos demais
+        return await asyncio.shield(task)
+
+    async def fetch(self, client: WhapiClient, media: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Baixar a mídia de uma mensagem para o armazenamento local
+
+        Args:
+            client: Cliente que recebeu a mensagem
+            media: Mídia extraída da mensagem (type, source_id, mime_type)
+
+        Returns:
+            Mídia com o sha256 do conteúdo
+        """
+        sha256 = await self._coalesce(("fetch", media["source_id"]), lambda: self._download(client, media["source_id"]))
+        return {**media, "sha256": sha256}
+
+    async def _download(self, client: WhapiClient, source_id: str) -> str:
+        tmp_dir = self.directory / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = tmp_dir / uuid.uuid4().hex
+        digest = hashlib.sha256()
+        size = 0
+
+        try:
+            with open(tmp_path, "wb") as file:
+                async for chunk in client.iter_media(source_id, CHUNK_SIZE):
+                    digest.update(chunk)
+                    # Escrita fora do event loop (disco lento não trava os demais envios)
+                    await asyncio.to_thread(file.write, chunk)
+                    size += len(chunk)
+
+            sha256 = digest.hexdigest()
+            path = self.path_for(sha256)
+            if path.exists():
+                # Mesmo conteúdo já armazenado (ex.: a mesma imagem em outra oferta)
+                tmp_path.unlink()
+                os.utime(path)
+                self.download_hits += 1
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        self.downloads += 1
+        logger.info(f"Mídia {source_id} armazenada ({size} bytes, sha256 {sha256[:12]})")
+        await self._maybe_evict()
+        return sha256
+
+    async def _read_chunks(self, path: Path) -> AsyncIterator[bytes]:
+        with open(path, "rb") as file:
+            while True:
+                chunk = await asyncio.to_thread(file.read, CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def media_id_for(self, client: WhapiClient, media: Dict[str, Any], source_client: WhapiClient = None) -> Optional[str]:
+        """
+        Obter o ID da mídia no canal de um bot, carregando o arquivo só na primeira vez
+
+        Args:
+            client: Cliente do bot que fará o envio
+            media: Mídia armazenada (com sha256)
+            source_client: Cliente para baixar de novo a mídia se o arquivo já foi removido
+
+        Returns:
+            ID da mídia para send_media, ou None se o upload falhar
+        """
+        key = (media["sha256"], client.channel_id)
+        cached = self._uploads.get(key)
+        if cached and datetime.utcnow() - cached[1] < timedelta(seconds=self.upload_ttl):
+            self.upload_hits += 1
+            return cached[0]
+
+        return await self._coalesce(("upload", *key), lambda: self._upload(client, media, source_client))
+
+    async def _upload(self, client: WhapiClient, media: Dict[str, Any], source_client: WhapiClient = None) -> Optional[str]:
+        sha256, channel_id = media["sha256"], client.channel_id
+        since = datetime.utcnow() - timedelta(seconds=self.upload_ttl)
+
+        # Upload feito por outro processo
+        async with AsyncSessionLocal() as db:
+            upload = (await db.scalars(
+                select(MediaUpload).where(
+                    MediaUpload.sha256 == sha256,
+                    MediaUpload.channel_id == channel_id,
+                    MediaUpload.uploaded_at >= since
+                )
+            )).first()
+        if upload:
+            self._uploads[(sha256, channel_id)] = (upload.media_id, upload.uploaded_at)
+            self.upload_hits += 1
+            return upload.media_id
+
+        path = self.path_for(sha256)
+        if not path.exists():
+            logger.warning(f"Mídia {sha256[:12]} não está mais no armazenamento local, baixando de novo")
+            refetched = await self.fetch(source_client or client, media)
+            path = self.path_for(refetched["sha256"])
+        os.utime(path)
+
+        media_id = await client.upload_media(lambda: self._read_chunks(path), media.get("mime_type"))
+        if not media_id:
+            return None
+
+        uploaded_at = datetime.utcnow()
+        self._uploads[(sha256, channel_id)] = (media_id, uploaded_at)
+        self.uploads += 1
+        logger.info(f"Mídia {sha256[:12]} carregada no canal {channel_id} ({media_id})")
+
+        async with AsyncSessionLocal() as db:
+            try:
+                values = {"media_id": media_id, "uploaded_at": uploaded_at}
+                await db.execute(insert_ignore(db, MediaUpload).values(sha256=sha256, channel_id=channel_id, **values))
+                await db.execute(
+                    update(MediaUpload).where(
+                        MediaUpload.sha256 == sha256,
+                        MediaUpload.channel_id == channel_id
+                    ).values(**values)
+                )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao salvar upload da mídia {sha256[:12]}: {str(e)}")
+                await db.rollback()
+
+        return media_id
+
+    async def _maybe_evict(self):
+        if time.monotonic() - self._last_eviction < EVICTION_INTERVAL:
+            return
+        self._last_eviction = time.monotonic()
+        await asyncio.to_thread(self.evict)
+
+    def evict(self) -> int:
+        """
+        Remover arquivos sem uso há MEDIA_CACHE_MAX_AGE segundos e, se o total
+        ainda passar de MEDIA_CACHE_MAX_BYTES, os menos usados
+
+        Returns:
+            Quantidade de arquivos removidos
+        """
+        if not self.directory.exists():
+            return 0
+
+        now = time.time()
+        files = []
+        for path in self.directory.glob("??/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and (total <= self.max_bytes or now - mtime < EVICTION_GRACE):
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        self.evicted += removed
+        self.stored_files = len(files) - removed
+        self.stored_bytes = total
+        if removed:
+            logger.info(f"{removed} mídia(s) removida(s) do armazenamento local ({total} bytes restantes)")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "stored_files": self.stored_files,
+            "stored_bytes": self.stored_bytes,
+            "max_bytes": self.max_bytes,
+            "downloads": self.downloads,
+            "download_hits": self.download_hits,
+            "uploads": self.uploads,
+            "upload_hits": self.upload_hits,
+            "evicted": self.evicted
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, Text, Float, ForeignKey, create_engine
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Boolean, Text, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -53,12 +53,72 @@ class ProcessedMessage(Base):
     source_group_id = Column(String, nullable=False)
     message_text = Column(Text, nullable=False)
     original_links = Column(Text, nullable=True)  # JSON com links encontrados
-    processed_at = Column(DateTime, default=datetime.utcnow)
+    canonical_urls = Column(Text, nullable=True)  # JSON com as URLs canônicas dos produtos
+    content_simhash = Column(BigInteger, nullable=True)  # SimHash do texto (64 bits, com sinal)
+    duplicate_of = Column(String, nullable=True)  # Oferta original, se suprimida como repostagem
+    enqueued_at = Column(DateTime, nullable=True)  # Quando os envios foram gravados na fila
+    media = Column(Text, nullable=True)  # JSON da mídia da oferta (tipo, ID na Whapi, sha256)
+    processed_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     def __repr__(self):
         return f"<ProcessedMessage {self.id}>"
 
 
+class SourceGroup(Base):
+    """Modelo para os grupos de origem monitorados (de onde as ofertas são lidas)"""
+    __tablename__ = "source_groups"
+    
+    id = Column(String, primary_key=True)  # ID do grupo no WhatsApp
+    name = Column(String, nullable=False)
+    ingest_mode = Column(String, nullable=True)  # polling ou webhook (padrão: INGEST_MODE)
+    poll_interval = Column(Integer, nullable=True)  # Segundos (padrão conforme o modo)
+    priority = Column(Integer, default=0)  # Maior prioridade passa antes no pipeline
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SourceGroup {self.name}>"
+
+
+class InboundMessage(Base):
+    """Modelo das mensagens recebidas via webhook à espera do worker (modo somente API)"""
+    __tablename__ = "inbound_messages"
+    
+    id = Column(String, primary_key=True)  # ID da mensagem na Whapi
+    source_group_id = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON da mensagem recebida
+    received_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<InboundMessage {self.id}>"
+
+
+class ParticipantEvent(Base):
+    """Modelo dos eventos de participantes já aplicados (reentregas do webhook são ignoradas)"""
+    __tablename__ = "participant_events"
+    
+    id = Column(String, primary_key=True)  # ID do evento na Whapi ou hash de grupo, ação, participantes e horário
+    group_id = Column(String, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<ParticipantEvent {self.id}>"
+
+
+class SourceCursor(Base):
+    """Modelo para a marca d'água do polling de cada grupo de origem"""
+    __tablename__ = "source_cursors"
+    
+    source_group_id = Column(String, primary_key=True)
+    last_message_timestamp = Column(Integer, nullable=False, default=0)  # Epoch em segundos
+    last_message_id = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SourceCursor {self.source_group_id} @ {self.last_message_timestamp}>"
+
+
 class PostedMessage(Base):
     """Modelo para rastrear mensagens postadas nos grupos de destino"""
     __tablename__ = "posted_messages"
@@ -79,6 +139,72 @@ class PostedMessage(Base):
         return f"<PostedMessage {self.id} - {self.status}>"
 
 
+class SendJob(Base):
+    """Modelo da fila durável de envios (uma linha por mensagem e grupo de destino)"""
+    __tablename__ = "send_jobs"
+    __table_args__ = (
+        UniqueConstraint("message_id", "group_id", name="uq_send_jobs_message_group"),
+        Index("ix_send_jobs_claim", "status", "available_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    message_id = Column(String, ForeignKey("processed_messages.id"), nullable=False)
+    group_id = Column(String, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    processed_text = Column(Text, nullable=False)
+    media = Column(Text, nullable=True)  # JSON da mídia (enviada com processed_text como legenda)
+    status = Column(String, default="PENDENTE")  # PENDENTE, EM_ANDAMENTO, ENVIADO, FALHA
+    attempts = Column(Integer, default=0)
+    available_at = Column(DateTime, default=datetime.utcnow)  # Próxima tentativa permitida
+    locked_by = Column(String, nullable=True)  # Worker que reservou o envio
+    locked_until = Column(DateTime, nullable=True)  # Fim da reserva (visibility timeout)
+    whatsapp_message_id = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SendJob {self.message_id} → {self.group_id} - {self.status}>"
+
+
+class MediaUpload(Base):
+    """Modelo do cache de uploads de mídia (um ID da Whapi por arquivo e canal)"""
+    __tablename__ = "media_uploads"
+    
+    sha256 = Column(String, primary_key=True)  # Conteúdo do arquivo no armazenamento local
+    channel_id = Column(String, primary_key=True)  # Canal (token) que fez o upload
+    media_id = Column(String, nullable=False)  # ID reutilizado em todos os envios
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<MediaUpload {self.sha256[:12]} - {self.channel_id}>"
+
+
+class SchedulerLease(Base):
+    """Modelo dos leases de liderança das tarefas periódicas singleton"""
+    __tablename__ = "scheduler_leases"
+    
+    name = Column(String, primary_key=True)  # Ex: monitoring, members_refresh
+    holder = Column(String, nullable=False)  # Processo líder (host:pid:sufixo)
+    expires_at = Column(DateTime, nullable=False)
+    renewed_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SchedulerLease {self.name} - {self.holder}>"
+
+
+class BotRateLimit(Base):
+    """Modelo do limite de taxa de cada bot, compartilhado entre processos"""
+    __tablename__ = "bot_rate_limits"
+    
+    bot_key = Column(String, primary_key=True)  # Número do bot ou "default"
+    # Momento (epoch, segundos) a partir do qual o bucket do bot fica cheio de novo;
+    # cada envio o avança em 60 / taxa por minuto
+    next_send_at = Column(Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f"<BotRateLimit {self.bot_key} - {self.next_send_at}>"
+
+
 class BotSession(Base):
     """Modelo para rastrear sessões de bots"""
     __tablename__ = "bot_sessions"
@@ -88,6 +214,9 @@ class BotSession(Base):
     bot_type = Column(String, nullable=False)  # READER ou POSTER
     is_connected = Column(Boolean, default=False)
     last_heartbeat = Column(DateTime, default=datetime.utcnow)
+    latency_ms = Column(Float, nullable=True)  # Latência do último heartbeat
+    last_error = Column(Text, nullable=True)
+    consecutive_failures = Column(Integer, default=0)  # Heartbeats seguidos sem conexão
     session_data = Column(Text, nullable=True)  # JSON com dados da sessão
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -110,3 +239,27 @@ class ActivityLog(Base):
     
     def __repr__(self):
         return f"<ActivityLog {self.action} - {self.status}>"
+
+
+class ResolvedLink(Base):
+    """Modelo para links encurtados já expandidos (cache persistente do resolvedor)"""
+    __tablename__ = "resolved_links"
+    
+    short_url = Column(String, primary_key=True)
+    final_url = Column(Text, nullable=False)
+    resolved_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<ResolvedLink {self.short_url}>"
+
+
+class CacheVersion(Base):
+    """Modelo para contadores de versão de caches em memória compartilhados entre processos"""
+    __tablename__ = "cache_versions"
+    
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CacheVersion {self.name} v{self.version}>"
@@ -0,0 +1,150 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+StageHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class StageMetrics:
+    """Contadores e tempos de execução de um estágio do pipeline"""
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def record(self, duration: float, success: bool = True):
+        """Registrar uma execução do estágio"""
+        if success:
+            self.processed += 1
+        else:
+            self.failed += 1
+        self.total_time += duration
+        self.last_time = duration
+        self.max_time = max(self.max_time, duration)
+
+    def snapshot(self) -> Dict[str, Any]:
+        executions = self.processed + self.failed
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_seconds": round(self.total_time / executions, 4) if executions else 0.0,
+            "max_seconds": round(self.max_time, 4),
+            "last_seconds": round(self.last_time, 4)
+        }
+
+
+class MessagePipeline:
+    """
+    Pipeline assíncrono de processamento de mensagens
+
+    Estágios: fetch → dedupe → rewrite → fanout, ligados por filas limitadas.
+    Quando uma fila enche, o estágio anterior aguarda (backpressure), mas a
+    ingestão de novas mensagens não espera o fan-out das anteriores terminar.
+    """
+
+    STAGES = ("fetch", "dedupe", "rewrite", "fanout")
+
+    def __init__(
+        self,
+        dedupe: StageHandler,
+        rewrite: StageHandler,
+        fanout: StageHandler,
+        queue_size: int = None,
+        fanout_workers: int = None
+    ):
+        """
+        Args:
+            dedupe: Estágio que descarta mensagens já processadas ou sem links
+            rewrite: Estágio que substitui os links de afiliado
+            fanout: Estágio que enfileira os envios para os grupos de destino
+            queue_size: Tamanho máximo de cada fila entre estágios
+            fanout_workers: Número de fan-outs executados em paralelo
+        """
+        self.queue_size = queue_size or settings.pipeline_queue_size
+        self.fanout_workers = fanout_workers or settings.pipeline_fanout_workers
+
+        # Fila de entrada ordenada pela prioridade do grupo de origem
+        self.dedupe_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self._sequence = itertools.count()
+        self.rewrite_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.fanout_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        self._handlers = {"dedupe": dedupe, "rewrite": rewrite, "fanout": fanout}
+        self.metrics: Dict[str, StageMetrics] = {stage: StageMetrics() for stage in self.STAGES}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        """Iniciar os workers de cada estágio (idempotente)"""
+        if self.is_running:
+            return
+
+        self._tasks = [
+            asyncio.create_task(self._run_stage("dedupe", self.dedupe_queue, self.rewrite_queue)),
+            asyncio.create_task(self._run_stage("rewrite", self.rewrite_queue, self.fanout_queue))
+        ]
+        for _ in range(self.fanout_workers):
+            self._tasks.append(asyncio.create_task(self._run_stage("fanout", self.fanout_queue, None)))
+
+        logger.info(f"Pipeline de mensagens iniciado ({self.fanout_workers} worker(s) de fan-out)")
+
+    def stop(self):
+        """Cancelar os workers do pipeline"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def submit(self, item: Dict[str, Any], priority: int = 0):
+        """
+        Entregar uma mensagem ao primeiro estágio
+
+        Aguarda enquanto a fila de dedupe estiver cheia (backpressure). Itens
+        de maior prioridade saem primeiro; com a mesma prioridade, por ordem
+        de chegada.
+        """
+        await self.dedupe_queue.put((-priority, next(self._sequence), item))
+
+    async def _run_stage(self, stage: str, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+        handler = self._handlers[stage]
+        while True:
+            item = await inbox.get()
+            if isinstance(inbox, asyncio.PriorityQueue):
+                item = item[-1]
+            started_at = time.monotonic()
+            try:
+                result = await handler(item)
+                self.metrics[stage].record(time.monotonic() - started_at)
+                if result is not None and outbox is not None:
+                    await outbox.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics[stage].record(time.monotonic() - started_at, success=False)
+                logger.error(f"Erro no estágio {stage} do pipeline: {str(e)}")
+            finally:
+                inbox.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidade das filas e tempos de cada estágio"""
+        return {
+            "running": self.is_running,
+            "queue_size": self.queue_size,
+            "queues": {
+                "dedupe": self.dedupe_queue.qsize(),
+                "rewrite": self.rewrite_queue.qsize(),
+                "fanout": self.fanout_queue.qsize()
+            },
+            "stages": {stage: metrics.snapshot() for stage, metrics in self.metrics.items()}
+        }
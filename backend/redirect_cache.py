@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+
+from config import settings
+from database import AsyncSessionLocal
+from models import Group, ActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+class GroupSnapshot:
+    """
+    Snapshot em memória dos grupos usados pelo /api/redirect
+
+    Recarregado do banco apenas quando invalidado (alterações de grupos neste
+    processo) ou após REDIRECT_SNAPSHOT_TTL segundos (alterações feitas por
+    outros processos). Há no máximo uma recarga em andamento: as requisições
+    simultâneas aguardam a mesma consulta e, com o TTL vencido, seguem com o
+    snapshot anterior enquanto ela roda.
+
+    Também estima a lotação ao vivo de cada grupo: última contagem conhecida
+    mais os cliques enviados a ele desde então. Isso permite trocar de grupo
+    antes de lotar, sem esperar a próxima consulta à Whapi.
+    """
+
+    STRATEGIES = ("ordered", "least_loaded", "weighted")
+
+    def __init__(self, ttl: float = None, strategy: str = None):
+        self.ttl = ttl if ttl is not None else settings.redirect_snapshot_ttl
+        self.strategy = strategy or settings.redirect_strategy
+        if self.strategy not in self.STRATEGIES:
+            logger.warning(f"REDIRECT_STRATEGY inválida: {self.strategy}. Usando 'weighted'")
+            self.strategy = "weighted"
+        self._groups: Optional[List[Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        # Recarga em andamento e geração do snapshot (invalidate() descarta recargas anteriores)
+        self._reload: Optional[asyncio.Task] = None
+        self._generation = 0
+        # Cliques por grupo desde a última contagem de membros conhecida
+        self._clicks_since_count: Dict[str, int] = {}
+        self._count_marks: Dict[str, Any] = {}
+
+    def invalidate(self):
+        """Descartar o snapshot (próximo acesso recarrega do banco)"""
+        self._groups = None
+        self._generation += 1
+        # Uma recarga já em andamento pode ter lido os dados antigos
+        self._reload = None
+
+    async def groups(self) -> List[Dict[str, Any]]:
+        """Grupos ativos ordenados por prioridade"""
+        if self._groups is not None and time.monotonic() - self._loaded_at > self.ttl:
+            # TTL vencido: uma única recarga em segundo plano, servindo o snapshot atual
+            self._start_reload()
+
+        while self._groups is None:
+            await asyncio.shield(self._start_reload())
+        return self._groups
+
+    def _start_reload(self) -> asyncio.Task:
+        if self._reload is None:
+            self._reload = asyncio.ensure_future(self._refresh(self._generation))
+            self._reload.add_done_callback(self._log_reload_error)
+        return self._reload
+
+    @staticmethod
+    def _log_reload_error(task: asyncio.Task):
+        # Recargas em segundo plano não têm quem aguarde o erro
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Erro ao recarregar snapshot dos grupos: {str(task.exception())}")
+
+    async def _refresh(self, generation: int):
+        try:
+            groups = await self._load()
+        finally:
+            if self._reload is asyncio.current_task():
+                self._reload = None
+
+        if generation == self._generation:
+            self._groups = groups
+            self._loaded_at = time.monotonic()
+            self._reset_clicks_on_new_counts()
+
+    async def _load(self) -> List[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            groups = (await db.scalars(
+                select(Group).where(Group.is_active == True).order_by(Group.order)
+            )).all()
+
+            return [
+                {
+                    "id": group.id,
+                    "name": group.name,
+                    "invite_link": group.invite_link,
+                    "status": group.status,
+                    "order": group.order,
+                    "current_members": group.current_members or 0,
+                    "max_capacity": group.max_capacity,
+                    "last_member_count_update": group.last_member_count_update
+                }
+                for group in groups
+            ]
+
+    def _reset_clicks_on_new_counts(self):
+        """Zerar os cliques dos grupos cuja contagem de membros mudou no banco"""
+        marks = {}
+        for group in self._groups:
+            mark = (group["current_members"], group["last_member_count_update"])
+            if self._count_marks.get(group["id"]) != mark:
+                self._clicks_since_count[group["id"]] = 0
+            marks[group["id"]] = mark
+        self._count_marks = marks
+        self._clicks_since_count = {
+            group_id: clicks for group_id, clicks in self._clicks_since_count.items() if group_id in marks
+        }
+
+    def record_click(self, group_id: str):
+        """Contabilizar um usuário enviado ao grupo na estimativa de lotação"""
+        self._clicks_since_count[group_id] = self._clicks_since_count.get(group_id, 0) + 1
+
+    def headroom(self, group: Dict[str, Any]) -> float:
+        """
+        Vagas estimadas de um grupo, descontada a reserva de segurança
+
+        Lotação estimada = última contagem + cliques desde então × taxa de conversão.
+        """
+        estimated = group["current_members"] + (
+            self._clicks_since_count.get(group["id"], 0) * settings.redirect_click_join_rate
+        )
+        return group["max_capacity"] - estimated - settings.redirect_headroom_reserve
+
+    async def current_target(self) -> Optional[Dict[str, Any]]:
+        """
+        Grupo para onde o próximo usuário deve ser redirecionado
+
+        Entre os grupos DISPONIVEL com vagas estimadas, escolhe conforme a
+        estratégia: "ordered" (primeiro pela ordem), "least_loaded" (mais vagas)
+        ou "weighted" (sorteio ponderado pelas vagas). Sem candidatos, volta ao
+        primeiro grupo DISPONIVEL e, por fim, ao primeiro grupo ativo.
+        """
+        groups = await self.groups()
+        available = [group for group in groups if group["status"] == "DISPONIVEL"]
+        candidates = [(group, self.headroom(group)) for group in available]
+        candidates = [(group, headroom) for group, headroom in candidates if headroom > 0]
+
+        if candidates:
+            if self.strategy == "least_loaded":
+                # max() mantém o primeiro pela ordem em caso de empate
+                return max(candidates, key=lambda candidate: candidate[1])[0]
+            if self.strategy == "weighted":
+                return random.choices(
+                    [group for group, _ in candidates],
+                    weights=[headroom for _, headroom in candidates]
+                )[0]
+            return candidates[0][0]
+
+        if available:
+            return available[0]
+        return groups[0] if groups else None
+
+
+class ClickCounter:
+    """
+    Contadores em memória dos cliques no link de redirecionamento
+
+    Os cliques são gravados no ActivityLog em lote (um registro por grupo a
+    cada flush), fora do caminho da requisição.
+    """
+
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._names: Dict[str, str] = {}
+
+    def record(self, group_id: str, group_name: str):
+        self._counts[group_id] = self._counts.get(group_id, 0) + 1
+        self._names[group_id] = group_name
+
+    def _restore(self, counts: Dict[str, int]):
+        """Devolver cliques não gravados para o próximo flush"""
+        for group_id, count in counts.items():
+            self._counts[group_id] = self._counts.get(group_id, 0) + count
+
+    async def flush(self) -> int:
+        """
+        Gravar os cliques acumulados no banco
+
+        Se o commit falhar ou for cancelado (desligamento), os cliques voltam
+        para o buffer.
+
+        Returns:
+            Quantidade de cliques gravados
+        """
+        if not self._counts:
+            return 0
+
+        counts, self._counts = self._counts, {}
+        try:
+            async with AsyncSessionLocal() as db:
+                for group_id, count in counts.items():
+                    db.add(ActivityLog(
+                        action="REDIRECT_CLICKED",
+                        description=f"{count} usuário(s) redirecionado(s) para grupo: {self._names.get(group_id, group_id)}",
+                        related_group_id=group_id,
+                        status="SUCCESS"
+                    ))
+                await db.commit()
+            return sum(counts.values())
+
+        except Exception as e:
+            logger.error(f"Erro ao gravar cliques de redirecionamento: {str(e)}")
+            self._restore(counts)
+            return 0
+
+        except BaseException:
+            self._restore(counts)
+            raise
+
+    async def run(self, flush_interval: float = None):
+        """Gravar os cliques periodicamente até ser cancelado"""
+        flush_interval = flush_interval or settings.redirect_click_flush_interval
+        while True:
+            await asyncio.sleep(flush_interval)
+            await self.flush()
+
+
+# Instâncias compartilhadas pela API e pelas tarefas em background
+group_snapshot = GroupSnapshot()
+click_counter = ClickCounter()
@@ -0,0 +1,128 @@
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada porque o circuit breaker do endpoint está aberto"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por endpoint
+
+    CLOSED: chamadas passam normalmente. Após `failure_threshold` falhas
+    consecutivas passa para OPEN e recusa chamadas por `reset_timeout` segundos.
+    Depois disso, HALF_OPEN libera uma chamada de teste: sucesso fecha o
+    circuito, falha o abre novamente. Uma chamada de teste sem resultado
+    (cancelada ou com erro inesperado) deve ser liberada com release_probe();
+    se não for, expira após `reset_timeout` segundos.
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+
+    def allow_request(self) -> bool:
+        """Verificar se uma chamada pode ser feita agora"""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # HALF_OPEN: apenas uma chamada de teste por vez
+        if self._probe_in_flight and time.monotonic() - self._probe_started_at < self.reset_timeout:
+            return False
+        self._probe_in_flight = True
+        self._probe_started_at = time.monotonic()
+        return True
+
+    def release_probe(self):
+        """Liberar a chamada de teste sem registrar resultado (ex.: cancelada)"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit breaker {self.name} fechado")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit breaker {self.name} aberto após {self.consecutive_failures} falha(s)")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        retry_in = 0.0
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": round(retry_in, 1)
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Delay exponencial com jitter completo
+
+    Args:
+        attempt: Número da tentativa (0 para a primeira repetição)
+        base: Delay base em segundos
+        cap: Delay máximo em segundos
+
+    Returns:
+        Delay aleatório entre 0 e min(cap, base * 2^attempt)
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Interpretar o header Retry-After (segundos ou data HTTP)
+
+    Returns:
+        Segundos a aguardar, ou None se ausente/inválido
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,93 @@
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from link_matcher import AffiliateMatcher
+from models import AffiliateLink, CacheVersion
+
+logger = logging.getLogger(__name__)
+
+# Nome do contador de versão das regras de afiliado
+AFFILIATE_RULES = "affiliate_links"
+
+
+async def get_cache_version(db: AsyncSession, name: str) -> int:
+    """Obter a versão atual de um cache compartilhado entre processos"""
+    version = await db.scalar(select(CacheVersion.version).where(CacheVersion.name == name))
+    return version or 0
+
+
+async def bump_cache_version(db: AsyncSession, name: str):
+    """
+    Incrementar a versão de um cache (na transação da sessão, sem commit)
+
+    Processos que guardam uma cópia do cache percebem a mudança ao comparar a versão.
+    Atômico: a linha é criada com INSERT ... ON CONFLICT DO NOTHING antes do
+    incremento, então incrementos simultâneos não violam a chave primária.
+    """
+    await db.execute(insert_ignore(db, CacheVersion).values(name=name, version=0))
+    await db.execute(
+        update(CacheVersion).where(CacheVersion.name == name).values(
+            version=CacheVersion.version + 1
+        ).execution_options(synchronize_session=False)
+    )
+
+
+class AffiliateRuleCache:
+    """
+    Cache em memória das regras de afiliado já compiladas (AffiliateMatcher)
+
+    Os endpoints de escrita incrementam a versão no banco (write-through). Cada
+    processo compara sua versão com a do banco no máximo a cada
+    AFFILIATE_CACHE_CHECK_INTERVAL segundos e só então recarrega as regras,
+    então processar uma mensagem normalmente não faz nenhuma consulta.
+    """
+
+    def __init__(self, check_interval: float = None):
+        self.check_interval = check_interval if check_interval is not None else settings.affiliate_cache_check_interval
+        self.version: Optional[int] = None
+        self._matcher: Optional[AffiliateMatcher] = None
+        self._checked_at = 0.0
+
+    async def matcher(self) -> AffiliateMatcher:
+        """Obter as regras compiladas, recarregando se a versão mudou"""
+        if self._matcher is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._matcher
+
+        async with AsyncSessionLocal() as db:
+            version = await get_cache_version(db, AFFILIATE_RULES)
+            if self._matcher is None or version != self.version:
+                affiliate_links = (await db.scalars(
+                    select(AffiliateLink).where(AffiliateLink.is_active == True)
+                )).all()
+                self._matcher = AffiliateMatcher(
+                    {link.domain_base: link.affiliate_link for link in affiliate_links}
+                )
+                self.version = version
+                logger.info(f"Regras de afiliado carregadas: {len(self._matcher)} (versão {version})")
+            self._checked_at = time.monotonic()
+
+        return self._matcher
+
+    async def mark_changed(self, db: AsyncSession):
+        """
+        Registrar uma alteração nas regras de afiliado
+
+        Incrementa a versão na transação de `db` (confirmada pelo commit do
+        chamador) e descarta a cópia local.
+        """
+        await bump_cache_version(db, AFFILIATE_RULES)
+        self.invalidate()
+
+    def invalidate(self):
+        """Descartar a cópia local (próximo acesso recarrega)"""
+        self._matcher = None
+
+
+# Instância compartilhada pela API e pelas tarefas em background
+affiliate_rule_cache = AffiliateRuleCache()
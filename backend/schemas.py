@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 # ============ Group Schemas ============
@@ -38,6 +38,38 @@ class GroupResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# ============ Source Group Schemas ============
+
+class SourceGroupCreate(BaseModel):
+    """Schema para cadastrar um grupo de origem"""
+    id: str
+    name: str
+    ingest_mode: Optional[str] = None
+    poll_interval: Optional[int] = None
+    priority: int = 0
+
+class SourceGroupUpdate(BaseModel):
+    """Schema para atualizar um grupo de origem"""
+    name: Optional[str] = None
+    ingest_mode: Optional[str] = None
+    poll_interval: Optional[int] = None
+    priority: Optional[int] = None
+    is_active: Optional[bool] = None
+
+class SourceGroupResponse(BaseModel):
+    """Schema para resposta de grupo de origem"""
+    id: str
+    name: str
+    ingest_mode: Optional[str]
+    poll_interval: Optional[int]
+    priority: int
+    is_active: bool
+    created_at: datetime
+    updated_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 # ============ Affiliate Link Schemas ============
 
 class AffiliateLinkCreate(BaseModel):
@@ -150,3 +182,12 @@ class RedirectResponse(BaseModel):
     group_id: str
     group_name: str
     message: str
+
+# ============ Webhook Schemas ============
+
+class WhapiWebhookPayload(BaseModel):
+    """Schema para eventos recebidos via webhook da Whapi"""
+    messages: List[Dict[str, Any]] = []
+    groups_participants: List[Dict[str, Any]] = []
+    event: Optional[Dict[str, Any]] = None
+    channel_id: Optional[str] = None
@@ -0,0 +1,120 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from models import ProcessedMessage
+
+logger = logging.getLogger(__name__)
+
+
+class SeenMessageIndex:
+    """
+    Índice em memória dos IDs de mensagens já vistas
+
+    LRU limitado por tamanho, aquecido no startup com os ProcessedMessage mais
+    recentes. IDs ausentes da memória são confirmados no banco com uma única
+    consulta `id IN (...)` por lote.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or settings.seen_index_size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def __contains__(self, message_id: str) -> bool:
+        if message_id in self._ids:
+            self._ids.move_to_end(message_id)
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, message_id: str):
+        self._ids[message_id] = None
+        self._ids.move_to_end(message_id)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    async def warm(self):
+        """Carregar os IDs das mensagens processadas mais recentemente"""
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.scalars(
+                    select(ProcessedMessage.id).order_by(
+                        ProcessedMessage.processed_at.desc()
+                    ).limit(self.max_size)
+                )).all()
+
+            # Inserir do mais antigo para o mais novo para manter a ordem LRU
+            for message_id in reversed(rows):
+                self.add(message_id)
+
+            if rows:
+                logger.info(f"Índice de mensagens vistas aquecido com {len(rows)} ID(s)")
+        except Exception as e:
+            logger.error(f"Erro ao carregar mensagens processadas: {str(e)}")
+
+    async def filter_unseen(self, message_ids: Iterable[str]) -> List[str]:
+        """
+        Filtrar os IDs que ainda não foram processados
+
+        Args:
+            message_ids: IDs candidatos (ex.: uma página do polling)
+
+        Returns:
+            IDs não encontrados nem na memória nem no banco, na ordem original
+        """
+        candidates = []
+        for message_id in dict.fromkeys(message_ids):
+            if message_id in self:
+                self.memory_hits += 1
+            else:
+                candidates.append(message_id)
+
+        if not candidates:
+            return []
+
+        async with AsyncSessionLocal() as db:
+            found = set((await db.scalars(
+                select(ProcessedMessage.id).where(ProcessedMessage.id.in_(candidates))
+            )).all())
+
+        for message_id in found:
+            self.add(message_id)
+        self.db_hits += len(found)
+        self.misses += len(candidates) - len(found)
+
+        return [message_id for message_id in candidates if message_id not in found]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._ids),
+            "max_size": self.max_size,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses
+        }
+
+
+async def insert_processed_message(db: AsyncSession, values: Dict[str, Any]) -> bool:
+    """
+    Registrar uma mensagem processada com INSERT ... ON CONFLICT DO NOTHING
+
+    Substitui o "consultar e depois inserir", que permitia que duas ingestões
+    simultâneas (polling e webhook) registrassem e postassem a mesma mensagem.
+
+    Returns:
+        True se a mensagem foi inserida, False se já existia
+    """
+    statement = insert_ignore(db, ProcessedMessage).values(**values).returning(ProcessedMessage.id)
+
+    inserted: Optional[str] = (await db.execute(statement)).scalar()
+    return inserted is not None
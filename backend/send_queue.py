@@ -0,0 +1,296 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, or_, select, update
+
+from config import settings
+from database import AsyncSessionLocal, insert_ignore
+from models import Group, ProcessedMessage, SendJob
+from media_store import deserialize_media, serialize_media
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueue:
+    """
+    Fila durável de envios no banco (tabela send_jobs)
+
+    Cada mensagem vira uma linha por grupo de destino, gravada na mesma
+    transação que marca a mensagem como enfileirada. Workers de qualquer
+    processo ou máquina reservam lotes com FOR UPDATE SKIP LOCKED; a reserva
+    expira após SEND_QUEUE_VISIBILITY_TIMEOUT segundos (renovada enquanto o
+    lote está em andamento), então envios de um worker que caiu voltam para a
+    fila. Cada envio é confirmado assim que termina; a entrega é "pelo menos
+    uma vez" só para um worker que cai entre o envio e a confirmação dele.
+    """
+
+    PENDING = "PENDENTE"
+    IN_PROGRESS = "EM_ANDAMENTO"
+    SENT = "ENVIADO"
+    FAILED = "FALHA"
+
+    def __init__(
+        self,
+        batch_size: int = None,
+        visibility_timeout: float = None,
+        max_attempts: int = None,
+        retry_base_delay: float = None
+    ):
+        self.batch_size = batch_size or settings.send_queue_batch_size
+        self.visibility_timeout = visibility_timeout or settings.send_queue_visibility_timeout
+        self.max_attempts = max_attempts or settings.send_queue_max_attempts
+        self.retry_base_delay = retry_base_delay or settings.send_queue_retry_base_delay
+
+    @staticmethod
+    def new_worker_id() -> str:
+        """Identificador único de um worker (máquina, processo e sufixo aleatório)"""
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    async def enqueue(self, message_id: str, text: str, group_ids: List[str], media: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Gravar os envios de uma mensagem para os grupos de destino
+
+        Idempotente: envios já existentes para (mensagem, grupo) são ignorados.
+
+        Args:
+            message_id: ID da mensagem processada
+            text: Texto processado (legenda, se houver mídia)
+            group_ids: Grupos de destino
+            media: Mídia armazenada da oferta, se houver
+
+        Returns:
+            Quantidade de envios gravados
+        """
+        async with AsyncSessionLocal() as db:
+            try:
+                inserted = 0
+                if group_ids:
+                    result = await db.execute(
+                        insert_ignore(db, SendJob).returning(SendJob.id),
+                        [
+                            {"message_id": message_id, "group_id": group_id, "processed_text": text, "media": serialize_media(media)}
+                            for group_id in group_ids
+                        ]
+                    )
+                    inserted = len(result.all())
+
+                await db.execute(
+                    update(ProcessedMessage).where(ProcessedMessage.id == message_id).values(
+                        enqueued_at=datetime.utcnow()
+                    )
+                )
+                await db.commit()
+                return inserted
+
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def claim(
+        self,
+        worker_id: str,
+        limit: int = None,
+        bot_number: Optional[str] = None,
+        exclude_bots: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Reservar um lote de envios disponíveis para este worker
+
+        Linhas reservadas por outros workers (em outra transação) são puladas
+        em vez de bloquear a consulta.
+
+        Args:
+            worker_id: Worker que reserva os envios
+            limit: Tamanho máximo do lote
+            bot_number: Reservar apenas envios de grupos deste bot
+            exclude_bots: Ignorar envios de grupos destes bots (partição padrão)
+
+        Returns:
+            Envios reservados (id, message_id, group_id, processed_text, media, attempts)
+        """
+        now = datetime.utcnow()
+        statement = select(SendJob).where(
+            or_(
+                SendJob.status == self.PENDING,
+                # Reserva expirada: o worker anterior caiu ou travou
+                (SendJob.status == self.IN_PROGRESS) & (SendJob.locked_until < now)
+            ),
+            SendJob.available_at <= now
+        )
+        if bot_number is not None or exclude_bots:
+            statement = statement.join(Group, Group.id == SendJob.group_id)
+            if bot_number is not None:
+                statement = statement.where(Group.bot_number == bot_number)
+            if exclude_bots:
+                statement = statement.where(Group.bot_number.not_in(exclude_bots))
+
+        async with AsyncSessionLocal() as db:
+            try:
+                jobs = (await db.scalars(
+                    statement.order_by(SendJob.id).limit(limit or self.batch_size).with_for_update(
+                        skip_locked=True, of=SendJob
+                    )
+                )).all()
+
+                locked_until = now + timedelta(seconds=self.visibility_timeout)
+                for job in jobs:
+                    if job.status == self.IN_PROGRESS:
+                        logger.warning(f"Reserva expirada do envio {job.id} ({job.locked_by}), reprocessando")
+                    job.status = self.IN_PROGRESS
+                    job.locked_by = worker_id
+                    job.locked_until = locked_until
+                    job.attempts = (job.attempts or 0) + 1
+
+                await db.commit()
+
+            except Exception:
+                await db.rollback()
+                raise
+
+        return [
+            {
+                "id": job.id,
+                "message_id": job.message_id,
+                "group_id": job.group_id,
+                "processed_text": job.processed_text,
+                "media": deserialize_media(job.media),
+                "attempts": job.attempts
+            }
+            for job in jobs
+        ]
+
+    async def renew(self, worker_id: str, job_ids: List[int]) -> int:
+        """
+        Renovar a reserva de envios ainda em andamento neste worker
+
+        Returns:
+            Quantidade de envios cuja reserva foi renovada
+        """
+        if not job_ids:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    update(SendJob).where(
+                        SendJob.id.in_(job_ids),
+                        SendJob.locked_by == worker_id,
+                        SendJob.status == self.IN_PROGRESS
+                    ).values(locked_until=datetime.utcnow() + timedelta(seconds=self.visibility_timeout))
+                )
+                await db.commit()
+                return result.rowcount
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def release(self, worker_id: str, job_ids: List[int]):
+        """
+        Devolver à fila envios reservados que não chegaram a ser feitos (ex.:
+        worker parado no meio do lote), sem contar a tentativa
+        """
+        if not job_ids:
+            return
+
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    update(SendJob).where(
+                        SendJob.id.in_(job_ids),
+                        SendJob.locked_by == worker_id,
+                        SendJob.status == self.IN_PROGRESS
+                    ).values(
+                        status=self.PENDING,
+                        attempts=SendJob.attempts - 1,
+                        locked_by=None,
+                        locked_until=None,
+                        updated_at=datetime.utcnow()
+                    )
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+    def final_status(self, outcome: Dict[str, Any]) -> Optional[str]:
+        """
+        Status final de um envio após esta tentativa (ENVIADO ou FALHA), ou
+        None se ele volta para a fila
+        """
+        if outcome["success"]:
+            return self.SENT
+        if outcome.get("retry_after") is None and outcome["attempts"] >= self.max_attempts:
+            return self.FAILED
+        return None
+
+    async def complete(self, worker_id: str, outcomes: List[Dict[str, Any]]):
+        """
+        Confirmar o resultado de envios com um único commit
+
+        Falhas voltam para a fila com backoff exponencial até
+        SEND_QUEUE_MAX_ATTEMPTS tentativas; depois ficam como FALHA. Envios
+        adiados (retry_after) voltam para a fila sem contar a tentativa.
+
+        Args:
+            worker_id: Worker que reservou os envios
+            outcomes: Resultados com id, attempts, success, whatsapp_message_id,
+                error e, nos adiados, retry_after (segundos)
+        """
+        if not outcomes:
+            return
+
+        now = datetime.utcnow()
+        updates = []
+        for outcome in outcomes:
+            status = self.final_status(outcome)
+            if status == self.SENT:
+                values = {"status": self.SENT, "whatsapp_message_id": outcome.get("whatsapp_message_id"), "last_error": None}
+            elif status == self.FAILED:
+                values = {"status": self.FAILED, "last_error": outcome.get("error")}
+            elif outcome.get("retry_after") is not None:
+                values = {
+                    "status": self.PENDING,
+                    "available_at": now + timedelta(seconds=outcome["retry_after"]),
+                    "attempts": outcome["attempts"] - 1,
+                    "last_error": outcome.get("error")
+                }
+            else:
+                delay = self.retry_base_delay * (2 ** (outcome["attempts"] - 1))
+                values = {
+                    "status": self.PENDING,
+                    "available_at": now + timedelta(seconds=delay),
+                    "last_error": outcome.get("error")
+                }
+            updates.append({"id": outcome["id"], "locked_by": None, "locked_until": None, "updated_at": now, **values})
+
+        async with AsyncSessionLocal() as db:
+            try:
+                # Só confirma envios ainda reservados por este worker
+                for values in updates:
+                    await db.execute(
+                        update(SendJob).where(
+                            SendJob.id == values["id"],
+                            SendJob.locked_by == worker_id
+                        ).values(**{key: value for key, value in values.items() if key != "id"})
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def stats(self) -> Dict[str, Any]:
+        """Quantidade de envios por status"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(SendJob.status, func.count()).group_by(SendJob.status)
+            )).all()
+        return {
+            "jobs": {status: count for status, count in rows},
+            "batch_size": self.batch_size,
+            "visibility_timeout": self.visibility_timeout,
+            "max_attempts": self.max_attempts
+        }
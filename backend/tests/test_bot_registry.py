@@ -0,0 +1,50 @@
+import asyncio
+
+import httpx
+
+from bot_registry import BotRegistry
+from fanout import FanoutScheduler
+from whapi_client import WhapiClient
+
+GROUP_ID = "120363000000000001@g.us"
+
+
+def registry_with(participants, backups=None) -> BotRegistry:
+    """Registro com dois bots (111 e 222) e o cliente padrão respondendo /groups/{id}"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"id": GROUP_ID, "participants": participants})
+
+    default_client = WhapiClient(api_key="token", api_url="http://whapi.test")
+    default_client._client = httpx.AsyncClient(base_url="http://whapi.test", transport=httpx.MockTransport(handler))
+    registry = BotRegistry(default_client, FanoutScheduler(), bots={"111": "token-111", "222": "token-222"})
+    registry.default_key = "default"
+    registry.backups = backups or {}
+    # Bot 111 desconectado
+    registry._health["111"] = {"connected": False, "consecutive_failures": registry.failure_threshold}
+    return registry
+
+
+def test_failover_picks_a_backup_that_is_a_group_member():
+    registry = registry_with([{"id": "111", "rank": "admin"}, {"id": "222@s.whatsapp.net", "rank": "member"}])
+
+    key, client = asyncio.run(registry.route("111", GROUP_ID))
+
+    assert key == "222"
+    assert client is registry.client_for("222")
+    assert registry.rerouted == 1
+
+
+def test_failover_defers_when_no_backup_is_a_group_member():
+    registry = registry_with([{"id": "111", "rank": "admin"}, {"id": "333", "rank": "member"}])
+
+    assert asyncio.run(registry.route("111", GROUP_ID)) is None
+    assert registry.deferred == 1
+    assert registry.retry_after() > 0
+
+
+def test_failover_uses_configured_backups():
+    registry = registry_with([], backups={"111": ["222"]})
+
+    key, _ = asyncio.run(registry.route("111", GROUP_ID))
+
+    assert key == "222"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import redirect_cache
+from redirect_cache import ClickCounter
+
+
+class FakeSession:
+    """Sessão cujo commit falha ou fica pendurado (banco lento no desligamento)"""
+
+    def __init__(self, commit):
+        self._commit = commit
+        self.added = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def add(self, row):
+        self.added.append(row)
+
+    async def commit(self):
+        await self._commit()
+
+
+def use_session(monkeypatch, commit):
+    monkeypatch.setattr(redirect_cache, "AsyncSessionLocal", lambda: FakeSession(commit))
+
+
+def test_failed_commit_keeps_the_clicks(monkeypatch):
+    async def failing_commit():
+        raise RuntimeError("banco fora do ar")
+
+    use_session(monkeypatch, failing_commit)
+    counter = ClickCounter()
+    counter.record("g1", "Grupo 1")
+    counter.record("g1", "Grupo 1")
+
+    assert asyncio.run(counter.flush()) == 0
+    assert counter._counts == {"g1": 2}
+
+
+def test_cancelled_flush_merges_the_clicks_back(monkeypatch):
+    async def hanging_commit():
+        await asyncio.Event().wait()
+
+    use_session(monkeypatch, hanging_commit)
+
+    async def run():
+        counter = ClickCounter()
+        counter.record("g1", "Grupo 1")
+        flush = asyncio.create_task(counter.flush())
+        await asyncio.sleep(0)
+        # Cliques que chegam durante o flush somam com os devolvidos
+        counter.record("g1", "Grupo 1")
+        counter.record("g2", "Grupo 2")
+
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        return counter._counts
+
+    assert asyncio.run(run()) == {"g1": 2, "g2": 1}
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import fanout
+from fanout import FanoutScheduler, SharedTokenBucket, TokenBucket
+from models import Base
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bucket_refills_at_the_configured_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(fanout.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_second=2, capacity=2)
+
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    # Nunca acumula além da capacidade
+    clock.now += 60
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_paused_bucket_discards_tokens_until_the_pause_ends(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(fanout.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_second=1, capacity=5)
+
+    bucket.pause(10)
+    assert not bucket.try_acquire()
+
+    clock.now += 9
+    assert not bucket.try_acquire()
+
+    # Retoma sem rajada: só o token reposto desde o fim da pausa
+    clock.now += 2
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_throttled_bot_does_not_hold_global_slots():
+    async def run():
+        scheduler = FanoutScheduler(
+            global_concurrency=1, per_bot_concurrency=1, rate_per_minute=6000, burst=1,
+            jitter_min=0, jitter_max=0, bot_rates={}, shared=False
+        )
+        scheduler.throttle(30, "lento")
+
+        async def send():
+            return "ok"
+
+        slow = asyncio.create_task(scheduler.run("lento", send))
+        await asyncio.sleep(0.05)
+        # O bot pausado aguarda tokens sem ocupar a única vaga global
+        assert await asyncio.wait_for(scheduler.run("rapido", send), timeout=1) == "ok"
+        assert not slow.done()
+        slow.cancel()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(setup())
+    monkeypatch.setattr(fanout, "AsyncSessionLocal", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def test_shared_bucket_splits_the_rate_between_processes(session_factory):
+    async def run():
+        # Dois processos com o mesmo bot: 1 envio por segundo, rajada de 2
+        api, worker = SharedTokenBucket("5511", 1, 2), SharedTokenBucket("5511", 1, 2)
+        now = 1000.0
+
+        assert await api._reserve(now) == 0
+        assert await worker._reserve(now) == 0
+        assert await api._reserve(now) == pytest.approx(1)
+        assert await worker._reserve(now) == pytest.approx(2)
+        # Outro bot tem o próprio limite
+        assert await SharedTokenBucket("5522", 1, 2)._reserve(now) == 0
+
+    asyncio.run(run())
+
+
+def test_shared_pause_applies_to_every_process(session_factory):
+    async def run():
+        api, worker = SharedTokenBucket("5511", 1, 2), SharedTokenBucket("5511", 1, 2)
+
+        api.pause(30)
+        await asyncio.gather(*api._pause_tasks)
+
+        assert await worker._reserve(fanout.time.time()) == pytest.approx(31, abs=0.5)
+
+    asyncio.run(run())
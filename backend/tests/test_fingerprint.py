@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import fingerprint
+from fingerprint import FingerprintIndex, canonical_url, hamming_distance, serialize_urls, simhash, to_signed
+from models import Base, ProcessedMessage
+
+TEMPLATE = "Oferta relâmpago! Corre que acaba hoje! Frete grátis para todo o Brasil"
+PRODUCT_A = "https://www.amazon.com.br/Fone-Bluetooth/dp/B0AAAAAAAA?tag=afiliado-20"
+PRODUCT_B = "https://www.amazon.com.br/Smartwatch/dp/B0BBBBBBBB?tag=afiliado-20"
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.amazon.com.br/Fone-Bluetooth/dp/B0TESTE123?tag=x&ref=y", "amazon.com.br/dp/B0TESTE123"),
+    ("https://amazon.com.br/gp/product/b0teste123/", "amazon.com.br/dp/B0TESTE123"),
+    ("https://www.amazon.com.br/gp/aw/d/B0TESTE123", "amazon.com.br/dp/B0TESTE123"),
+    ("https://www.amazon.com/dp/B0TESTE123", "amazon.com/dp/B0TESTE123"),
+    ("https://shopee.com.br/Fone-Bluetooth-i.123456.7890123?sp_atk=abc", "shopee.com.br/product/123456/7890123"),
+    ("https://shopee.com.br/product/123456/7890123", "shopee.com.br/product/123456/7890123"),
+    ("https://www.magazineluiza.com.br/produto/abc/?utm_source=x#topo", "magazineluiza.com.br/produto/abc"),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+def test_simhash_ignores_links_prices_and_accents():
+    original = simhash(f"{TEMPLATE} por R$ 99,90 {PRODUCT_A}")
+    repost = simhash(f"Oferta relampago! Corre que acaba hoje! Frete gratis para todo o Brasil por R$ 79,90 {PRODUCT_B}")
+
+    assert hamming_distance(original, repost) == 0
+    assert hamming_distance(original, simhash("Cupom de 20% em livros da loja, só hoje")) > 10
+    assert hamming_distance(0b1011, 0b0110) == 3
+
+
+def fingerprint_of(text: str, links) -> dict:
+    return FingerprintIndex.fingerprint(text, links)
+
+
+def test_memory_index_detects_reposts_of_the_same_product():
+    index = FingerprintIndex(window=3600, max_distance=3)
+    index.add("m1", fingerprint_of(TEMPLATE, [PRODUCT_A]))
+
+    # Mesmo produto com outro texto e rastreamento
+    assert index.find_duplicate(fingerprint_of("Baixou!", [PRODUCT_A.replace("afiliado-20", "outro-21")])) == "m1"
+    # Mesmo texto, mesma loja e sem produto identificado (ex.: link não expandido)
+    assert index.find_duplicate(fingerprint_of(TEMPLATE, ["https://www.amazon.com.br/promocoes"])) == "m1"
+    # Texto diferente na mesma loja
+    assert index.find_duplicate(fingerprint_of("Cupom de 20% em livros", ["https://www.amazon.com.br/promocoes"])) is None
+    # A própria mensagem não é duplicata de si mesma
+    assert index.find_duplicate(fingerprint_of(TEMPLATE, [PRODUCT_A]), message_id="m1") is None
+
+
+def test_memory_index_keeps_distinct_products_with_the_same_template():
+    index = FingerprintIndex(window=3600, max_distance=3)
+    index.add("m1", fingerprint_of(TEMPLATE, [PRODUCT_A]))
+
+    assert index.find_duplicate(fingerprint_of(TEMPLATE, [PRODUCT_B])) is None
+    # Produtos em comum: o texto semelhante volta a valer
+    assert index.find_duplicate(fingerprint_of(TEMPLATE, [PRODUCT_A, PRODUCT_B])) == "m1"
+
+
+def test_memory_index_forgets_offers_outside_the_window():
+    index = FingerprintIndex(window=60, max_distance=3)
+    index.add("m1", fingerprint_of(TEMPLATE, [PRODUCT_A]), seen_at=1000)
+
+    assert index.find_duplicate(fingerprint_of("Baixou!", [PRODUCT_A]), now=1030) == "m1"
+    assert index.find_duplicate(fingerprint_of("Baixou!", [PRODUCT_A]), now=1100) is None
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(setup())
+    monkeypatch.setattr(fingerprint, "AsyncSessionLocal", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+async def save(factory, message_id: str, text: str, links, minutes_ago: float):
+    message_print = FingerprintIndex.fingerprint(text, links)
+    async with factory() as db:
+        db.add(ProcessedMessage(
+            id=message_id,
+            source_group_id="src",
+            message_text=text,
+            canonical_urls=serialize_urls(message_print["urls"]),
+            content_simhash=to_signed(message_print["simhash"]),
+            processed_at=datetime.utcnow() - timedelta(minutes=minutes_ago)
+        ))
+        await db.commit()
+    return message_print
+
+
+def test_db_check_detects_reposts_and_keeps_distinct_products(session_factory):
+    async def run():
+        index = FingerprintIndex(window=3600, max_distance=3)
+        original = await save(session_factory, "m1", TEMPLATE, [PRODUCT_A], minutes_ago=30)
+
+        other_product = await save(session_factory, "m2", TEMPLATE, [PRODUCT_B], minutes_ago=20)
+        assert await index.find_duplicate_in_db("m2", other_product) is None
+
+        same_product = await save(session_factory, "m3", "Baixou!", [PRODUCT_A], minutes_ago=10)
+        assert await index.find_duplicate_in_db("m3", same_product) == "m1"
+
+        # A mensagem mais antiga não é suprimida pelas mais recentes
+        assert await index.find_duplicate_in_db("m1", original) is None
+
+    asyncio.run(run())
+
+
+def test_db_check_ignores_offers_outside_the_window(session_factory):
+    async def run():
+        index = FingerprintIndex(window=600, max_distance=3)
+        await save(session_factory, "m1", TEMPLATE, [PRODUCT_A], minutes_ago=30)
+        repost = await save(session_factory, "m2", TEMPLATE, [PRODUCT_A], minutes_ago=0)
+
+        assert await index.find_duplicate_in_db("m2", repost) is None
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import pytest
+
+from link_matcher import AffiliateMatcher, normalize_domain
+from whapi_client import LinkProcessor
+
+
+@pytest.mark.parametrize("domain, expected", [
+    ("shopee.com.br", "shopee.com.br"),
+    ("https://www.Shopee.com.br/abc?x=1", "shopee.com.br"),
+    ("http://shopee.com.br:8080/", "shopee.com.br"),
+    ("www.amazon.com.br.", "amazon.com.br"),
+    ("  MercadoLivre.com.br#topo ", "mercadolivre.com.br"),
+])
+def test_normalize_domain(domain, expected):
+    assert normalize_domain(domain) == expected
+
+
+def test_rule_matches_the_domain_and_its_subdomains():
+    matcher = AffiliateMatcher({"shopee.com.br": "https://aff.shopee"})
+
+    assert matcher.match("shopee.com.br") == "https://aff.shopee"
+    assert matcher.match("s.shopee.com.br") == "https://aff.shopee"
+    assert matcher.match("br.m.shopee.com.br") == "https://aff.shopee"
+
+
+def test_rule_rejects_look_alike_domains():
+    matcher = AffiliateMatcher({"shopee.com.br": "https://aff.shopee"})
+
+    assert matcher.match("notshopee.com.br") is None
+    assert matcher.match("shopee.com.br.evil.com") is None
+    assert matcher.match("com.br") is None
+
+
+def test_longest_suffix_wins():
+    matcher = AffiliateMatcher({
+        "amazon.com.br": "https://aff.amazon",
+        "music.amazon.com.br": "https://aff.music",
+        "com.br": "https://aff.generico"
+    })
+
+    assert matcher.match("music.amazon.com.br") == "https://aff.music"
+    assert matcher.match("www2.music.amazon.com.br") == "https://aff.music"
+    assert matcher.match("amazon.com.br") == "https://aff.amazon"
+    assert matcher.match("magazineluiza.com.br") == "https://aff.generico"
+
+
+def test_rule_keys_with_scheme_www_or_port_are_normalized():
+    matcher = AffiliateMatcher({
+        "https://www.shopee.com.br/": "https://aff.shopee",
+        "amazon.com.br:443": "https://aff.amazon",
+        "": "https://ignorado"
+    })
+
+    assert len(matcher) == 2
+    assert matcher.match("shopee.com.br") == "https://aff.shopee"
+    assert matcher.match("amazon.com.br") == "https://aff.amazon"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Veja: https://shopee.com.br/abc.", "Veja: AFF."),
+    ("Link (https://www.shopee.com.br/x?y=1), corre!", "Link (AFF), corre!"),
+    ("Corre? https://s.shopee.com.br/p?", "Corre? AFF?"),
+    ("https://SHOPEE.com.br/a!", "AFF!"),
+    ("https://shopee.com.br.", "AFF."),
+    ("https://shopee.com.br:8080/p?x=1&y=2 hoje", "AFF hoje"),
+    ("https://notshopee.com.br/a, https://shopee.com.br", "https://notshopee.com.br/a, AFF"),
+])
+def test_replace_links_captures_the_host_next_to_punctuation(text, expected):
+    assert LinkProcessor.replace_links(text, {"shopee.com.br": "AFF"}) == expected
+
+
+def test_replace_links_uses_the_final_domain_of_short_links():
+    text = "Oferta: https://amzn.to/3abc"
+    resolved = {"https://amzn.to/3abc": "https://www.amazon.com.br/dp/B0TESTE123"}
+
+    assert LinkProcessor.replace_links(text, {"amazon.com.br": "AFF"}, resolved) == "Oferta: AFF"
+    assert LinkProcessor.replace_links(text, {"amazon.com.br": "AFF"}) == text
+
+
+def test_extract_links_leaves_trailing_punctuation_out():
+    assert LinkProcessor.extract_links("Veja https://shopee.com.br/a. E https://amazon.com.br/b?") == [
+        "https://shopee.com.br/a",
+        "https://amazon.com.br/b"
+    ]
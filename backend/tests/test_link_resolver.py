@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import link_resolver
+from fake_shortener import ShortenerHandler
+from link_resolver import LRUTTLCache, ShortLinkResolver
+
+PRODUCT_URL = "https://www.amazon.com.br/dp/B0TESTE123"
+
+
+def resolver_with(handler, **kwargs) -> ShortLinkResolver:
+    options = {"shortener_domains": ["bit.ly", "amzn.to"], "persist": False, "timeout": 1.0, **kwargs}
+    resolver = ShortLinkResolver(**options)
+    resolver._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=False)
+    return resolver
+
+
+def redirect(location: str) -> httpx.Response:
+    return httpx.Response(301, headers={"Location": location})
+
+
+def test_follows_head_redirect_chain_until_leaving_shorteners():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.method, str(request.url)))
+        if request.url.host == "bit.ly":
+            return redirect("https://amzn.to/xyz")
+        if request.url.host == "amzn.to":
+            return redirect(PRODUCT_URL)
+        raise AssertionError("a loja não deve ser requisitada")
+
+    async def run():
+        resolver = resolver_with(handler)
+        assert await resolver.resolve("https://bit.ly/abc") == PRODUCT_URL
+        await resolver.close()
+
+    asyncio.run(run())
+    assert requests == [("HEAD", "https://bit.ly/abc"), ("HEAD", "https://amzn.to/xyz")]
+
+
+@pytest.mark.parametrize("status_code", [403, 404, 405, 501])
+def test_falls_back_to_get_when_head_is_rejected(status_code):
+    methods = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        methods.append(request.method)
+        if request.method == "HEAD":
+            return httpx.Response(status_code)
+        return redirect(PRODUCT_URL)
+
+    async def run():
+        resolver = resolver_with(handler)
+        assert await resolver.resolve("https://bit.ly/abc") == PRODUCT_URL
+        await resolver.close()
+
+    asyncio.run(run())
+    assert methods == ["HEAD", "GET"]
+
+
+def test_stops_at_max_redirects():
+    hops = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hops.append(str(request.url))
+        return redirect(f"https://bit.ly/{len(hops)}")
+
+    async def run():
+        resolver = resolver_with(handler, max_redirects=3)
+        assert await resolver.resolve("https://bit.ly/0") == "https://bit.ly/3"
+        await resolver.close()
+
+    asyncio.run(run())
+    assert len(hops) == 3
+
+
+def test_returns_none_on_timeout_without_caching():
+    calls = []
+
+    async def slow(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        await asyncio.sleep(5)
+        return redirect(PRODUCT_URL)
+
+    async def run():
+        resolver = resolver_with(slow, timeout=0.05)
+        assert await resolver.resolve("https://bit.ly/abc") is None
+        assert len(resolver.cache) == 0
+        await resolver.close()
+
+    asyncio.run(run())
+    assert calls == ["HEAD"]
+
+
+def test_cache_hit_skips_requests_until_ttl_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(link_resolver.time, "time", lambda: now[0])
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        return redirect(PRODUCT_URL)
+
+    async def run():
+        resolver = resolver_with(handler, cache_ttl=60)
+        assert await resolver.resolve("https://bit.ly/abc") == PRODUCT_URL
+        assert await resolver.resolve("https://bit.ly/abc") == PRODUCT_URL
+        assert len(calls) == 1
+
+        now[0] += 61
+        assert await resolver.resolve("https://bit.ly/abc") == PRODUCT_URL
+        assert len(calls) == 2
+        await resolver.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_resolves_share_one_request():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        await asyncio.sleep(0.01)
+        return redirect(PRODUCT_URL)
+
+    async def run():
+        resolver = resolver_with(handler)
+        results = await asyncio.gather(*[resolver.resolve("https://bit.ly/abc") for _ in range(10)])
+        assert results == [PRODUCT_URL] * 10
+        await resolver.close()
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUTTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_resolve_all_only_expands_short_links():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return redirect(PRODUCT_URL)
+
+    async def run():
+        resolver = resolver_with(handler)
+        resolved = await resolver.resolve_all(["https://bit.ly/abc", "https://shopee.com.br/x", "https://bit.ly/abc"])
+        assert resolved == {"https://bit.ly/abc": PRODUCT_URL}
+        await resolver.close()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def fake_shortener():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ShortenerHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_against_local_fake_shortener(fake_shortener):
+    async def run():
+        resolver = ShortLinkResolver(shortener_domains=["127.0.0.1"], persist=False, timeout=2.0)
+        await resolver.start()
+        try:
+            # /chain → /abc (relativo) → loja
+            assert await resolver.resolve(f"{fake_shortener}/chain") == PRODUCT_URL
+            # HEAD recusado com 405: expande via GET
+            assert await resolver.resolve(f"{fake_shortener}/nohead/shp") == "https://shopee.com.br/produto-teste-i.123.456"
+        finally:
+            await resolver.close()
+
+    asyncio.run(run())
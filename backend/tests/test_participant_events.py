@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import background_tasks
+from background_tasks import BackgroundTaskManager
+from models import Base, Group
+from whapi_client import WhapiClient
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            db.add(Group(
+                id="g1", name="Grupo 1", invite_link="https://chat.whatsapp.com/g1",
+                bot_number="5511999999999", max_capacity=100, current_members=99
+            ))
+            await db.commit()
+
+    asyncio.run(setup())
+    monkeypatch.setattr(background_tasks, "AsyncSessionLocal", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def event(action: str, timestamp: int, participants=("5511900000001@s.whatsapp.net",)) -> dict:
+    return {"group_id": "g1", "action": action, "participants": list(participants), "timestamp": timestamp}
+
+
+async def group(factory) -> Group:
+    async with factory() as db:
+        return await db.get(Group, "g1")
+
+
+def test_redelivered_participant_events_are_applied_once(session_factory):
+    async def run():
+        manager = BackgroundTaskManager(WhapiClient(api_key="token", api_url="http://whapi.test"))
+
+        assert await manager.apply_participant_events([event("add", 1000)]) == 1
+        assert ((await group(session_factory)).current_members, (await group(session_factory)).status) == (100, "CHEIO")
+
+        # Reentrega do mesmo webhook, e o mesmo evento repetido num lote
+        assert await manager.apply_participant_events([event("add", 1000)]) == 0
+        assert await manager.apply_participant_events([event("leave", 1001), event("leave", 1001)]) == 1
+        assert (await group(session_factory)).current_members == 99
+
+        # Eventos com ID da Whapi usam o ID
+        assert await manager.apply_participant_events([{**event("add", 1002), "id": "evt-1"}]) == 1
+        assert await manager.apply_participant_events([{**event("add", 1003), "id": "evt-1"}]) == 0
+        assert (await group(session_factory)).current_members == 100
+
+    asyncio.run(run())
+
+
+def test_event_key_ignores_participant_order():
+    key = BackgroundTaskManager.participant_event_key
+
+    assert key(event("add", 1000, ["b", "a"])) == key(event("add", 1000, ["a", "b"]))
+    assert key(event("add", 1000)) != key(event("remove", 1000))
+    assert key(event("add", 1000)) != key(event("add", 1001))
+    assert key({"group_id": "g1", "action": "add"}) is None
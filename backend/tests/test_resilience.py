@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError
+from whapi_client import WhapiClient
+
+
+def open_breaker(breaker: CircuitBreaker):
+    """Abrir o circuito com o reset_timeout já vencido (próxima chamada é a de teste)"""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+
+
+def client_with(handler) -> WhapiClient:
+    client = WhapiClient(api_key="token", api_url="http://whapi.test")
+    client._client = httpx.AsyncClient(base_url="http://whapi.test", transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_released_probe_allows_a_new_probe():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    assert breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_stale_probe_expires_after_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    assert breaker.allow_request()
+    breaker._probe_started_at -= breaker.reset_timeout + 1
+    assert breaker.allow_request()
+
+
+def test_cancelled_probe_does_not_stick_in_half_open():
+    started = asyncio.Event()
+
+    async def hang(request: httpx.Request) -> httpx.Response:
+        started.set()
+        await asyncio.sleep(60)
+        return httpx.Response(200)
+
+    async def run():
+        client = client_with(hang)
+        breaker = client._breaker("messages.send")
+        open_breaker(breaker)
+
+        probe = asyncio.create_task(
+            client._request("POST", "/messages/text", endpoint="messages.send", idempotent=False, json={})
+        )
+        await started.wait()
+        assert not breaker.allow_request()
+
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow_request()
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_unexpected_error_releases_probe():
+    def too_many_redirects(request: httpx.Request) -> httpx.Response:
+        raise httpx.TooManyRedirects("loop", request=request)
+
+    async def run():
+        client = client_with(too_many_redirects)
+        breaker = client._breaker("groups.get")
+        open_breaker(breaker)
+
+        with pytest.raises(httpx.TooManyRedirects):
+            await client._request("GET", "/groups/1", endpoint="groups.get", idempotent=True)
+
+        assert breaker.allow_request()
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_abandoned_media_download_releases_probe():
+    def media(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"x" * 1024)
+
+    async def run():
+        client = client_with(media)
+        breaker = client._breaker("media.get")
+        open_breaker(breaker)
+
+        chunks = client.iter_media("abc", chunk_size=16)
+        await chunks.__anext__()
+        await chunks.aclose()
+
+        assert breaker.allow_request()
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_media_client_error_closes_circuit():
+    def not_found(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404)
+
+    async def run():
+        client = client_with(not_found)
+        breaker = client._breaker("media.get")
+        open_breaker(breaker)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            async for _ in client.iter_media("abc"):
+                pass
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_open_circuit_rejects_requests():
+    async def run():
+        client = client_with(lambda request: httpx.Response(200))
+        breaker = client._breaker("groups.get")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        with pytest.raises(CircuitOpenError):
+            await client._request("GET", "/groups/1", endpoint="groups.get", idempotent=True)
+        await client.close()
+
+    asyncio.run(run())
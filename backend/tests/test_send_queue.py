@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import background_tasks
+import send_queue
+from background_tasks import BackgroundTaskManager
+from models import Base, Group, ProcessedMessage, SendJob
+from send_queue import SendQueue
+from whapi_client import WhapiClient
+
+GROUP_IDS = ["g1", "g2", "g3", "g4"]
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    event.listen(engine.sync_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            for group_id in GROUP_IDS:
+                db.add(Group(id=group_id, name=group_id, invite_link=f"https://chat.whatsapp.com/{group_id}", bot_number="5511999999999"))
+            db.add(ProcessedMessage(id="m1", source_group_id="src", message_text="oferta"))
+            await db.commit()
+
+    asyncio.run(setup())
+    monkeypatch.setattr(send_queue, "AsyncSessionLocal", factory)
+    monkeypatch.setattr(background_tasks, "AsyncSessionLocal", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def manager_with(queue: SendQueue, post) -> BackgroundTaskManager:
+    manager = BackgroundTaskManager(WhapiClient(api_key="token", api_url="http://whapi.test"))
+    manager.send_queue = queue
+    manager._post_to_group = post
+    return manager
+
+
+async def jobs_by_group(factory):
+    async with factory() as db:
+        return {job.group_id: job for job in (await db.scalars(select(SendJob))).all()}
+
+
+def test_cancelled_batch_keeps_sent_jobs_and_requeues_the_rest(session_factory):
+    async def run():
+        queue = SendQueue(batch_size=10, visibility_timeout=300, max_attempts=3, retry_base_delay=30)
+        await queue.enqueue("m1", "oferta", GROUP_IDS)
+        started = asyncio.Event()
+
+        async def post(target, text, message_id, media=None):
+            if target["id"] == "g4":
+                # Bot lento: o worker é parado antes deste envio
+                started.set()
+                await asyncio.Event().wait()
+            return {"success": True, "whatsapp_message_id": f"wa-{target['id']}", "error": None}
+
+        manager = manager_with(queue, post)
+        batch = asyncio.create_task(manager._send_jobs("w1", await queue.claim("w1")))
+        await started.wait()
+        await asyncio.sleep(0.1)
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+
+        jobs = await jobs_by_group(session_factory)
+        assert [jobs[group_id].status for group_id in ["g1", "g2", "g3"]] == [SendQueue.SENT] * 3
+        assert jobs["g4"].status == SendQueue.PENDING
+        assert jobs["g4"].attempts == 0
+
+        # Outro worker só recebe o envio que não foi feito
+        assert [job["group_id"] for job in await queue.claim("w2")] == ["g4"]
+
+    asyncio.run(run())
+
+
+def test_claims_are_renewed_while_the_batch_runs(session_factory):
+    async def run():
+        queue = SendQueue(batch_size=10, visibility_timeout=1, max_attempts=3, retry_base_delay=30)
+        await queue.enqueue("m1", "oferta", ["g1"])
+
+        async def post(target, text, message_id, media=None):
+            await asyncio.sleep(2.5)
+            return {"success": True, "whatsapp_message_id": "wa", "error": None}
+
+        manager = manager_with(queue, post)
+        batch = asyncio.create_task(manager._send_jobs("w1", await queue.claim("w1")))
+        await asyncio.sleep(1.5)
+        # A reserva original já teria expirado
+        assert await queue.claim("w2") == []
+        await batch
+
+        jobs = await jobs_by_group(session_factory)
+        assert jobs["g1"].status == SendQueue.SENT
+        assert jobs["g1"].locked_by is None
+
+    asyncio.run(run())
+
+
+class FakeWriter:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, model, **values):
+        self.rows.append((model.__tablename__, values))
+
+
+def test_delivery_is_recorded_once_per_final_state(session_factory, monkeypatch):
+    async def run():
+        writer = FakeWriter()
+        monkeypatch.setattr(background_tasks, "delivery_writer", writer)
+        queue = SendQueue(batch_size=10, visibility_timeout=300, max_attempts=2, retry_base_delay=0.001)
+        await queue.enqueue("m1", "oferta", ["g1", "g2"])
+
+        async def post(target, text, message_id, media=None):
+            if target["id"] == "g1":
+                return {"success": True, "whatsapp_message_id": "wa-g1", "error": None}
+            return {"success": False, "whatsapp_message_id": None, "error": "HTTP 500"}
+
+        manager = manager_with(queue, post)
+        for _ in range(2):
+            await asyncio.sleep(0.01)
+            await manager._send_jobs("w1", await queue.claim("w1"))
+
+        jobs = await jobs_by_group(session_factory)
+        assert (jobs["g1"].status, jobs["g2"].status) == (SendQueue.SENT, SendQueue.FAILED)
+        posted = [values for table, values in writer.rows if table == "posted_messages"]
+        assert sorted((row["group_id"], row["status"]) for row in posted) == [("g1", "ENVIADO"), ("g2", "FALHA")]
+        assert len([table for table, _ in writer.rows if table == "activity_logs"]) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import write_behind
+from models import ActivityLog, Base, Group, PostedMessage, ProcessedMessage
+from write_behind import WriteBehindWriter
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    event.listen(engine.sync_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            db.add(Group(id="g1", name="Grupo 1", invite_link="https://chat.whatsapp.com/g1", bot_number="5511999999999"))
+            db.add(ProcessedMessage(id="m1", source_group_id="src", message_text="oferta"))
+            await db.commit()
+
+    asyncio.run(setup())
+    monkeypatch.setattr(write_behind, "AsyncSessionLocal", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def posted(group_id: str = "g1"):
+    return {"group_id": group_id, "original_message_id": "m1", "processed_text": "oferta", "status": "ENVIADO"}
+
+
+async def count(factory, model) -> int:
+    async with factory() as db:
+        return await db.scalar(select(func.count()).select_from(model))
+
+
+def test_invalid_row_is_dropped_without_blocking_the_batch(session_factory):
+    async def run():
+        writer = WriteBehindWriter(batch_size=100, flush_interval=1)
+        for group_id in ["g1", "g1", "removido", "g1", "g1"]:
+            writer.add(PostedMessage, **posted(group_id))
+        writer.add(ActivityLog, action="MESSAGE_POSTED", description="ok", status="SUCCESS")
+
+        assert await writer.flush() == 5
+        assert writer.pending == 0
+        assert writer.dropped_invalid == 1
+        assert await count(session_factory, PostedMessage) == 4
+        assert await count(session_factory, ActivityLog) == 1
+
+    asyncio.run(run())
+
+
+def test_transient_error_keeps_rows_for_the_next_flush(session_factory, monkeypatch):
+    async def run():
+        writer = WriteBehindWriter(batch_size=100, flush_interval=1)
+        writer.add(PostedMessage, **posted())
+        writer.add(ActivityLog, action="MESSAGE_POSTED", description="ok", status="SUCCESS")
+
+        monkeypatch.setattr(write_behind, "AsyncSessionLocal", _failing_for(session_factory, "posted_messages"))
+
+        assert await writer.flush() == 1
+        assert writer.pending == 1
+        assert writer.failed_flushes == 1
+
+        monkeypatch.setattr(write_behind, "AsyncSessionLocal", session_factory)
+        assert await writer.flush() == 1
+        assert writer.pending == 0
+        assert await count(session_factory, PostedMessage) == 1
+
+    asyncio.run(run())
+
+
+def _failing_for(factory, table_name):
+    """Sessões que falham com erro de conexão ao inserir na tabela indicada"""
+
+    class FailingSession:
+        def __init__(self):
+            self._session = factory()
+
+        async def __aenter__(self):
+            await self._session.__aenter__()
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return await self._session.__aexit__(*exc_info)
+
+        async def execute(self, statement, *args, **kwargs):
+            if statement.table.name == table_name:
+                raise OperationalError(str(statement), {}, Exception("banco fora do ar"))
+            return await self._session.execute(statement, *args, **kwargs)
+
+        async def commit(self):
+            await self._session.commit()
+
+        async def rollback(self):
+            await self._session.rollback()
+
+    return FailingSession
+
+
+def test_buffer_is_capped_dropping_the_oldest_rows():
+    writer = WriteBehindWriter(batch_size=100, flush_interval=1, max_pending=3)
+    for index in range(5):
+        writer.add(ActivityLog, action="MESSAGE_POSTED", description=str(index), status="SUCCESS")
+
+    assert writer.pending == 3
+    assert writer.dropped_overflow == 2
+    assert [row["description"] for row in writer._pending[ActivityLog]] == ["2", "3", "4"]
+    assert writer.stats()["dropped_overflow"] == 2
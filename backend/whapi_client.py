@@ -1,10 +1,12 @@
 import httpx
 import asyncio
+import hashlib
 import re
-import json
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Tuple, Union
 from config import settings
+from link_matcher import AffiliateMatcher, normalize_domain
+from resilience import CircuitBreaker, CircuitOpenError, backoff_delay, parse_retry_after
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,6 +21,151 @@ class WhapiClient:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Cache TTL e requisições em andamento de /groups/{id}
+        self._group_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._group_inflight: Dict[str, asyncio.Future] = {}
+        # Chamado com os segundos de espera quando a Whapi responde 429 (ritmo de envio)
+        self.on_throttle: Optional[Callable[[float], None]] = None
+    
+    async def start(self):
+        """
+        Abrir o cliente HTTP compartilhado (pool de conexões com keep-alive)
+        
+        Deve ser chamado uma vez na inicialização da aplicação. Todas as
+        chamadas reutilizam as mesmas conexões TCP/TLS com a Whapi.
+        """
+        if self._client is not None and not self._client.is_closed:
+            return
+        
+        http2 = settings.whapi_http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("WHAPI_HTTP2 habilitado, mas o pacote 'h2' não está instalado. Usando HTTP/1.1")
+                http2 = False
+        
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers=self.headers,
+            timeout=settings.whapi_timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.whapi_max_connections,
+                max_keepalive_connections=settings.whapi_max_keepalive_connections,
+                keepalive_expiry=settings.whapi_keepalive_expiry
+            )
+        )
+        logger.info(f"Cliente Whapi iniciado (pool={settings.whapi_max_connections}, http2={http2})")
+    
+    async def close(self):
+        """Fechar o cliente HTTP compartilhado e liberar as conexões"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Cliente Whapi fechado")
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Obter o cliente compartilhado, abrindo-o se ainda não foi iniciado"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        return self._client
+    
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        """Obter (ou criar) o circuit breaker de um endpoint"""
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                endpoint,
+                failure_threshold=settings.whapi_breaker_failure_threshold,
+                reset_timeout=settings.whapi_breaker_reset_timeout
+            )
+            self._breakers[endpoint] = breaker
+        return breaker
+    
+    def breaker_states(self) -> Dict[str, Dict[str, Any]]:
+        """Estado dos circuit breakers por endpoint (exposto no /health)"""
+        return {endpoint: breaker.snapshot() for endpoint, breaker in self._breakers.items()}
+    
+    def _notify_throttle(self, seconds: float):
+        logger.warning(f"Whapi limitou as requisições (429). Aguardando {seconds:.1f}s")
+        if self.on_throttle:
+            self.on_throttle(seconds)
+    
+    async def _request(self, method: str, path: str, endpoint: str, idempotent: bool, **kwargs) -> httpx.Response:
+        """
+        Executar uma requisição com retry, backoff e circuit breaker
+        
+        Chamadas idempotentes são repetidas em erros de rede e respostas 5xx.
+        Chamadas não idempotentes (envio de mensagem) só são repetidas quando a
+        requisição certamente não foi processada: 429 ou falha ao conectar.
+        
+        Args:
+            method: Método HTTP
+            path: Caminho relativo à URL da API
+            endpoint: Nome do endpoint para o circuit breaker
+            idempotent: Se a chamada pode ser repetida com segurança
+        
+        Returns:
+            Resposta da API (a última, caso as tentativas se esgotem)
+        
+        Raises:
+            CircuitOpenError: Se o circuito do endpoint estiver aberto
+            httpx.TransportError: Se todas as tentativas falharem por erro de rede
+        """
+        client = await self._get_client()
+        breaker = self._breaker(endpoint)
+        max_attempts = settings.whapi_max_retries + 1
+        
+        for attempt in range(max_attempts):
+            is_last_attempt = attempt == max_attempts - 1
+            
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuito aberto para {endpoint}")
+            
+            try:
+                response = await client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                not_sent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if is_last_attempt or not (idempotent or not_sent):
+                    raise
+                delay = backoff_delay(attempt, settings.whapi_retry_base_delay, settings.whapi_retry_max_delay)
+                logger.warning(f"Erro de rede em {endpoint} ({str(e) or type(e).__name__}). Nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelamento ou erro fora da rede (ex.: DecodingError): não prender o HALF_OPEN
+                breaker.release_probe()
+                raise
+            
+            if response.status_code == 429:
+                # Limite de taxa não indica API indisponível: não conta como falha do circuito
+                breaker.record_success()
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                if delay is None:
+                    delay = backoff_delay(attempt, settings.whapi_retry_base_delay, settings.whapi_retry_max_delay)
+                self._notify_throttle(delay)
+                if is_last_attempt:
+                    return response
+                await asyncio.sleep(delay)
+                continue
+            
+            if response.status_code >= 500:
+                breaker.record_failure()
+                if idempotent and not is_last_attempt:
+                    delay = backoff_delay(attempt, settings.whapi_retry_base_delay, settings.whapi_retry_max_delay)
+                    logger.warning(f"Erro {response.status_code} em {endpoint}. Nova tentativa em {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                return response
+            
+            breaker.record_success()
+            return response
+        
+        return response
     
     async def send_message(self, chat_id: str, message: str, delay: float = 0) -> Dict[str, Any]:
         """
@@ -35,30 +182,149 @@ class WhapiClient:
         if delay > 0:
             await asyncio.sleep(delay)
         
-        async with httpx.AsyncClient() as client:
-            try:
-                payload = {
-                    "to": chat_id,
-                    "body": message
-                }
-                
-                response = await client.post(
-                    f"{self.api_url}/messages/text",
-                    json=payload,
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                
-                if response.status_code in [200, 201]:
-                    logger.info(f"Mensagem enviada para {chat_id}")
-                    return response.json()
-                else:
-                    logger.error(f"Erro ao enviar mensagem: {response.status_code} - {response.text}")
-                    return {"error": response.text, "status_code": response.status_code}
+        try:
+            payload = {
+                "to": chat_id,
+                "body": message
+            }
             
-            except Exception as e:
-                logger.error(f"Exceção ao enviar mensagem: {str(e)}")
-                return {"error": str(e)}
+            response = await self._request(
+                "POST", "/messages/text",
+                endpoint="messages.send",
+                idempotent=False,
+                json=payload
+            )
+            
+            if response.status_code in [200, 201]:
+                logger.info(f"Mensagem enviada para {chat_id}")
+                return response.json()
+            else:
+                logger.error(f"Erro ao enviar mensagem: {response.status_code} - {response.text}")
+                return {"error": response.text, "status_code": response.status_code}
+        
+        except Exception as e:
+            logger.error(f"Exceção ao enviar mensagem: {str(e)}")
+            return {"error": str(e)}
+    
+    async def send_media(self, chat_id: str, media_type: str, media_id: str, caption: str = "") -> Dict[str, Any]:
+        """
+        Enviar uma mídia já carregada na Whapi (imagem, vídeo ou documento)
+        
+        Args:
+            chat_id: ID do chat (grupo ou contato)
+            media_type: image, video ou document
+            media_id: ID retornado por upload_media
+            caption: Legenda da mídia
+        
+        Returns:
+            Resposta da API
+        """
+        try:
+            response = await self._request(
+                "POST", f"/messages/{media_type}",
+                endpoint="messages.send",
+                idempotent=False,
+                json={"to": chat_id, "media": media_id, "caption": caption}
+            )
+            
+            if response.status_code in [200, 201]:
+                logger.info(f"Mídia enviada para {chat_id}")
+                return response.json()
+            else:
+                logger.error(f"Erro ao enviar mídia: {response.status_code} - {response.text}")
+                return {"error": response.text, "status_code": response.status_code}
+        
+        except Exception as e:
+            logger.error(f"Exceção ao enviar mídia: {str(e)}")
+            return {"error": str(e)}
+    
+    @property
+    def channel_id(self) -> str:
+        """Identificador do canal (derivado do token) para o cache de uploads"""
+        return hashlib.sha256(self.api_key.encode()).hexdigest()[:16]
+    
+    async def iter_media(self, media_id: str, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+        """
+        Baixar uma mídia da Whapi em blocos, sem carregar o arquivo na memória
+        
+        Args:
+            media_id: ID da mídia na mensagem recebida
+            chunk_size: Tamanho dos blocos
+        
+        Raises:
+            CircuitOpenError: Se o circuito de media.get estiver aberto
+            httpx.HTTPStatusError: Se a Whapi não retornar a mídia
+        """
+        client = await self._get_client()
+        breaker = self._breaker("media.get")
+        if not breaker.allow_request():
+            raise CircuitOpenError("Circuito aberto para media.get")
+        
+        try:
+            async with client.stream("GET", f"/media/{media_id}") as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(chunk_size):
+                    yield chunk
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                # 4xx: a Whapi respondeu, o endpoint está disponível
+                breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            # Download abandonado pelo consumidor ou cancelado: liberar a chamada de teste
+            breaker.release_probe()
+    
+    async def upload_media(self, chunks: Callable[[], AsyncIterator[bytes]], mime_type: str) -> Optional[str]:
+        """
+        Carregar uma mídia na Whapi em streaming
+        
+        Sem retry automático: o corpo é um stream consumido na primeira tentativa.
+        
+        Args:
+            chunks: Função que cria o iterador com o conteúdo do arquivo
+            mime_type: Tipo MIME da mídia
+        
+        Returns:
+            ID da mídia para os envios, ou None se erro
+        """
+        client = await self._get_client()
+        breaker = self._breaker("media.upload")
+        if not breaker.allow_request():
+            raise CircuitOpenError("Circuito aberto para media.upload")
+        
+        try:
+            response = await client.post(
+                "/media",
+                content=chunks(),
+                headers={"Content-Type": mime_type or "application/octet-stream"}
+            )
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            logger.error(f"Erro de rede ao carregar mídia: {str(e) or type(e).__name__}")
+            return None
+        except BaseException:
+            breaker.release_probe()
+            raise
+        
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        
+        if response.status_code not in [200, 201]:
+            if response.status_code == 429:
+                self._notify_throttle(parse_retry_after(response.headers.get("Retry-After")) or settings.whapi_retry_base_delay)
+            logger.error(f"Erro ao carregar mídia: {response.status_code} - {response.text}")
+            return None
+        
+        data = response.json()
+        # A Whapi responde {"media": [{"id": ...}]}
+        uploaded = (data.get("media") or [data])[0]
+        return uploaded.get("id")
     
     async def get_group_members_count(self, group_id: str) -> Optional[int]:
         """
@@ -70,62 +336,106 @@ class WhapiClient:
         Returns:
             Número de membros ou None se erro
         """
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.api_url}/groups/{group_id}",
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    # A resposta pode variar, tente diferentes estruturas
-                    if "members_count" in data:
-                        return data["members_count"]
-                    elif "participants" in data:
-                        return len(data["participants"])
-                    else:
-                        logger.warning(f"Estrutura de resposta inesperada: {data}")
-                        return None
-                else:
-                    logger.error(f"Erro ao obter membros: {response.status_code}")
-                    return None
-            
-            except Exception as e:
-                logger.error(f"Exceção ao obter membros: {str(e)}")
-                return None
+        data = await self._fetch_group(group_id)
+        if data is None:
+            return None
+        
+        # A resposta pode variar, tente diferentes estruturas
+        if "members_count" in data:
+            return data["members_count"]
+        elif "participants" in data:
+            return len(data["participants"])
+        else:
+            logger.warning(f"Estrutura de resposta inesperada: {data}")
+            return None
     
-    async def get_messages(self, chat_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    async def get_messages(
+        self,
+        chat_id: str,
+        limit: int = 50,
+        offset: int = 0,
+        time_from: Optional[int] = None,
+        time_to: Optional[int] = None,
+        sort: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
         """
         Obter mensagens de um chat/grupo
         
         Args:
             chat_id: ID do chat
             limit: Número máximo de mensagens
+            offset: Quantidade de mensagens a pular (paginação)
+            time_from: Apenas mensagens a partir deste timestamp (epoch, segundos)
+            time_to: Apenas mensagens até este timestamp (epoch, segundos)
+            sort: Ordenação por data ("asc" ou "desc")
         
         Returns:
             Lista de mensagens
         """
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.api_url}/messages",
-                    params={"chat_id": chat_id, "limit": limit},
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get("messages", [])
-                else:
-                    logger.error(f"Erro ao obter mensagens: {response.status_code}")
-                    return []
+        params = {"chat_id": chat_id, "limit": limit}
+        if offset:
+            params["offset"] = offset
+        if time_from is not None:
+            params["time_from"] = time_from
+        if time_to is not None:
+            params["time_to"] = time_to
+        if sort:
+            params["sort"] = sort
+        
+        try:
+            response = await self._request(
+                "GET", "/messages",
+                endpoint="messages.list",
+                idempotent=True,
+                params=params
+            )
             
-            except Exception as e:
-                logger.error(f"Exceção ao obter mensagens: {str(e)}")
+            if response.status_code == 200:
+                data = response.json()
+                return data.get("messages", [])
+            else:
+                logger.error(f"Erro ao obter mensagens: {response.status_code}")
                 return []
+        
+        except Exception as e:
+            logger.error(f"Exceção ao obter mensagens: {str(e)}")
+            return []
+    
+    async def iter_messages(
+        self,
+        chat_id: str,
+        time_from: Optional[int] = None,
+        page_size: int = 100
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Percorrer, em ordem cronológica, todas as mensagens a partir de um timestamp
+        
+        Pagina com offset até receber uma página incompleta.
+        
+        Args:
+            chat_id: ID do chat
+            time_from: Timestamp inicial (epoch, segundos), inclusivo
+            page_size: Quantidade de mensagens por página
+        
+        Yields:
+            Mensagens da mais antiga para a mais recente
+        """
+        offset = 0
+        while True:
+            page = await self.get_messages(
+                chat_id,
+                limit=page_size,
+                offset=offset,
+                time_from=time_from,
+                sort="asc"
+            )
+            
+            for message in sorted(page, key=lambda m: m.get("timestamp") or 0):
+                yield message
+            
+            if len(page) < page_size:
+                break
+            offset += len(page)
     
     async def get_group_info(self, group_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -137,30 +447,106 @@ class WhapiClient:
         Returns:
             Informações do grupo ou None se erro
         """
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.api_url}/groups/{group_id}",
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Erro ao obter info do grupo: {response.status_code}")
-                    return None
+        return await self._fetch_group(group_id)
+    
+    async def _fetch_group(self, group_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obter /groups/{id} com cache TTL e coalescência de requisições
+        
+        Chamadas simultâneas para o mesmo grupo compartilham uma única requisição,
+        e a resposta é reaproveitada por get_group_info e get_group_members_count.
+        
+        Args:
+            group_id: ID do grupo
+        
+        Returns:
+            Dados do grupo ou None se erro
+        """
+        cached = self._group_cache.get(group_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        task = self._group_inflight.get(group_id)
+        if task is None:
+            task = asyncio.ensure_future(self._request_group(group_id))
+            self._group_inflight[group_id] = task
+            task.add_done_callback(lambda _: self._group_inflight.pop(group_id, None))
+        
+        # shield: o cancelamento de um chamador não cancela a requisição dos demais
+        return await asyncio.shield(task)
+    
+    async def _request_group(self, group_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = await self._request(
+                "GET", f"/groups/{group_id}",
+                endpoint="groups.get",
+                idempotent=True
+            )
             
-            except Exception as e:
-                logger.error(f"Exceção ao obter info do grupo: {str(e)}")
+            if response.status_code == 200:
+                data = response.json()
+                self._group_cache[group_id] = (time.monotonic() + settings.whapi_group_cache_ttl, data)
+                return data
+            else:
+                logger.error(f"Erro ao obter info do grupo: {response.status_code}")
                 return None
+        
+        except Exception as e:
+            logger.error(f"Exceção ao obter info do grupo: {str(e)}")
+            return None
+    
+    def invalidate_group_cache(self, group_id: str = None):
+        """Descartar a resposta em cache de um grupo (ou de todos)"""
+        if group_id is None:
+            self._group_cache.clear()
+        else:
+            self._group_cache.pop(group_id, None)
+    
+    async def check_health(self) -> Dict[str, Any]:
+        """
+        Verificar o estado do canal na Whapi (GET /health)
+        
+        Chamada única, sem retry: é usada como heartbeat do bot.
+        
+        Returns:
+            connected, status (texto retornado pela Whapi), latency_ms e error
+        """
+        started_at = time.monotonic()
+        try:
+            client = await self._get_client()
+            response = await client.get("/health")
+            latency_ms = (time.monotonic() - started_at) * 1000
+            
+            if response.status_code != 200:
+                return {"connected": False, "status": None, "latency_ms": latency_ms, "error": f"HTTP {response.status_code}"}
+            
+            status = (response.json().get("status") or {}).get("text")
+            # AUTH: número autenticado e pronto para enviar
+            connected = status == "AUTH"
+            return {
+                "connected": connected,
+                "status": status,
+                "latency_ms": latency_ms,
+                "error": None if connected else f"Canal no estado {status}"
+            }
+        
+        except Exception as e:
+            return {
+                "connected": False,
+                "status": None,
+                "latency_ms": (time.monotonic() - started_at) * 1000,
+                "error": str(e) or type(e).__name__
+            }
 
 
 class LinkProcessor:
     """Processador de links para substituição de afiliados"""
     
-    # Regex para encontrar URLs
-    URL_REGEX = r'https?://(?:www\.)?[\w\.-]+\.\w+[\w\./\-\?&=%]*'
+    # Regex pré-compilada para encontrar URLs, com o host capturado (sem "www.");
+    # pontuação no fim ("." ou "?" de fim de frase) fica fora do link
+    URL_PATTERN = re.compile(
+        r'https?://(?:www\.)?(?P<host>[\w-]+(?:\.[\w-]+)+)(?::\d+)?(?:[\w\./\-\?&=%]*[\w/\-&=%])?'
+    )
     
     @staticmethod
     def extract_links(text: str) -> List[str]:
@@ -173,7 +559,7 @@ class LinkProcessor:
         Returns:
             Lista de links encontrados
         """
-        return re.findall(LinkProcessor.URL_REGEX, text)
+        return [match.group(0) for match in LinkProcessor.URL_PATTERN.finditer(text)]
     
     @staticmethod
     def extract_domain(url: str) -> str:
@@ -192,33 +578,37 @@ class LinkProcessor:
         return ""
     
     @staticmethod
-    def replace_links(text: str, affiliate_map: Dict[str, str]) -> str:
+    def replace_links(
+        text: str,
+        affiliate_map: Union[Dict[str, str], AffiliateMatcher],
+        resolved_links: Dict[str, str] = None
+    ) -> str:
         """
         Substituir links originais por links de afiliado
         
+        Uma única passagem pelo texto; cada link é resolvido no índice de
+        sufixos de domínio (a regra de sufixo mais longo vence).
+        
         Args:
             text: Texto original
-            affiliate_map: Mapa de domínios para links de afiliado
+            affiliate_map: Mapa de domínios para links de afiliado, ou um AffiliateMatcher já compilado
+            resolved_links: URLs finais dos links encurtados (a regra é buscada pelo domínio final)
         
         Returns:
             Texto com links substituídos
         """
+        matcher = affiliate_map if isinstance(affiliate_map, AffiliateMatcher) else AffiliateMatcher(affiliate_map)
+        if not len(matcher):
+            return text
+        resolved_links = resolved_links or {}
+        
         def replace_match(match):
             original_link = match.group(0)
-            domain = LinkProcessor.extract_domain(original_link)
-            
-            # Procurar por correspondência exata ou parcial
-            if domain in affiliate_map:
-                return affiliate_map[domain]
-            
-            # Tentar correspondência parcial (ex: shopee.com.br em shopee.com)
-            for key, value in affiliate_map.items():
-                if key in domain or domain in key:
-                    return value
-            
-            return original_link
+            final_link = resolved_links.get(original_link)
+            host = normalize_domain(final_link) if final_link else match.group("host").lower()
+            return matcher.match(host) or original_link
         
-        return re.sub(LinkProcessor.URL_REGEX, replace_match, text)
+        return LinkProcessor.URL_PATTERN.sub(replace_match, text)
     
     @staticmethod
     def extract_links_with_context(text: str) -> Dict[str, str]:
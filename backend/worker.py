@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import signal
+from typing import List, Optional
+
+from config import settings
+from database import init_db
+from whapi_client import WhapiClient
+from background_tasks import BackgroundTaskManager
+from leader import LeaderElector
+from write_behind import delivery_writer
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRunner:
+    """
+    Tarefas em background do BackgroundTaskManager
+
+    Usado pelo processo da API (RUN_BACKGROUND_TASKS=true) e pelo worker
+    dedicado (`python -m worker`). Polling e atualização de membros rodam só
+    no processo líder; os workers da fila de envios rodam em todos.
+    """
+
+    def __init__(self, background_manager: BackgroundTaskManager, leader_elector: LeaderElector = None):
+        self.background_manager = background_manager
+        self.leader_elector = leader_elector or LeaderElector()
+        self.monitoring_task: Optional[asyncio.Task] = None
+        self.members_update_task: Optional[asyncio.Task] = None
+        self.send_worker_tasks: List[asyncio.Task] = []
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def monitoring_active(self) -> bool:
+        return self.monitoring_task is not None and not self.monitoring_task.done()
+
+    async def _run_monitoring(self):
+        """Tarefa do líder: recuperar mensagens não enfileiradas e monitorar os grupos de origem"""
+        await self.background_manager.recover_unqueued_messages()
+        await self.background_manager.start_monitoring()
+
+    def start_monitoring(self) -> bool:
+        """
+        Disputar a liderança do monitoramento dos grupos de origem
+
+        Returns:
+            False se o monitoramento já estava ativo neste processo
+        """
+        if self.monitoring_active:
+            return False
+
+        self.monitoring_task = asyncio.create_task(
+            self.leader_elector.run("monitoring", self._run_monitoring)
+        )
+        return True
+
+    async def stop_monitoring(self):
+        """Parar o monitoramento e liberar a liderança"""
+        self.background_manager.stop()
+        if self.monitoring_task:
+            self.monitoring_task.cancel()
+            await asyncio.gather(self.monitoring_task, return_exceptions=True)
+
+    def start(self):
+        """Iniciar monitoramento, workers de envio e atualização de membros"""
+        if not settings.whapi_api_key:
+            logger.warning("Tarefas em background não iniciadas. Verifique configurações.")
+            return
+
+        # Monitoramento dos grupos de origem: apenas no processo líder
+        self.start_monitoring()
+        logger.info("Monitoramento dos grupos de origem aguardando liderança")
+
+        # Heartbeat dos bots: cada processo que envia mantém a própria visão da saúde
+        self.heartbeat_task = asyncio.create_task(self.background_manager.bot_registry.run_heartbeats())
+        
+        # Workers da fila durável de envios (em todos os processos, retomam
+        # envios pendentes de antes do restart), SEND_QUEUE_WORKERS por bot
+        shards = self.background_manager.bot_registry.shards()
+        self.send_worker_tasks = [
+            asyncio.create_task(self.background_manager.run_send_worker(bot_number=bot_number))
+            for bot_number in shards
+            for _ in range(settings.send_queue_workers)
+        ]
+        logger.info(f"{len(self.send_worker_tasks)} worker(s) de envio iniciado(s) para {len(shards)} bot(s)")
+
+        # Atualização de contagem de membros: apenas no processo líder
+        self.members_update_task = asyncio.create_task(
+            self.leader_elector.run("members_refresh", self.background_manager.update_group_members_count)
+        )
+        logger.info("Atualização adaptativa de membros aguardando liderança")
+
+    async def stop(self):
+        """Cancelar todas as tarefas e liberar as lideranças"""
+        self.background_manager.stop()
+
+        tasks = [self.monitoring_task, self.members_update_task, self.heartbeat_task, *self.send_worker_tasks]
+        tasks = [task for task in tasks if task is not None]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.send_worker_tasks = []
+        logger.info("Tarefas em background canceladas")
+
+
+async def run_worker():
+    """Processo dedicado às tarefas em background (sem servidor HTTP)"""
+    logger.info("Iniciando worker...")
+
+    if not settings.whapi_api_key:
+        logger.error("ERRO: WHAPI_API_KEY não configurada!")
+    if not settings.source_group_id:
+        logger.warning("AVISO: SOURCE_GROUP_ID não configurado. Apenas os grupos de /api/source-groups serão monitorados.")
+
+    init_db()
+
+    whapi_client = WhapiClient()
+    background_manager = BackgroundTaskManager(whapi_client)
+    runner = BackgroundRunner(background_manager)
+
+    await whapi_client.start()
+    await background_manager.bot_registry.start()
+    await background_manager.link_resolver.start()
+    # Aquecer os índices de mensagens vistas e de ofertas já transmitidas
+    await background_manager.seen_index.warm()
+    await background_manager.fingerprint_index.warm()
+
+    # Gravar em lote os registros de entrega e de atividade do fan-out
+    delivery_flush_task = asyncio.create_task(delivery_writer.run())
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    runner.start()
+    logger.info("Worker iniciado")
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Desligando worker...")
+        await runner.stop()
+
+        delivery_flush_task.cancel()
+        await delivery_writer.flush()
+
+        await whapi_client.close()
+        await background_manager.bot_registry.close()
+        await background_manager.link_resolver.close()
+        logger.info("Worker desligado com sucesso")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run_worker())
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple, Type
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from config import settings
+from database import AsyncSessionLocal
+from models import Base, PostedMessage, ActivityLog
+
+logger = logging.getLogger(__name__)
+
+# Colunas de data preenchidas no momento do evento (não no momento do flush)
+TIMESTAMP_COLUMNS = {PostedMessage: "posted_at", ActivityLog: "created_at"}
+
+
+class WriteBehindWriter:
+    """
+    Gravação em lote (write-behind) dos registros de entrega e de atividade
+
+    Os registros ficam em memória e são gravados com um INSERT em lote por
+    tabela quando o buffer atinge WRITE_BEHIND_BATCH_SIZE ou a cada
+    WRITE_BEHIND_FLUSH_INTERVAL segundos, o que vier primeiro. Assim o status
+    de cada envio fica consultável no banco com atraso limitado, sem um commit
+    por grupo de destino. No shutdown, flush() grava tudo o que restou.
+
+    Cada tabela é gravada na própria transação. Em erros transitórios (banco
+    fora do ar) os registros voltam ao buffer; registros inválidos (ex.: grupo
+    removido, violando a FK) são isolados dividindo o lote ao meio e
+    descartados, para não bloquear os demais. O buffer é limitado a
+    WRITE_BEHIND_MAX_PENDING registros: além disso, os mais antigos são
+    descartados e contados em stats().
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, max_pending: int = None):
+        self.batch_size = batch_size or settings.write_behind_batch_size
+        self.flush_interval = flush_interval or settings.write_behind_flush_interval
+        self.max_pending = max_pending or settings.write_behind_max_pending
+        self._pending: Dict[Type[Base], List[Dict[str, Any]]] = {}
+        self._size_reached = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._retry_pending = False
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_invalid = 0
+        self.dropped_overflow = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._pending.values())
+
+    def add(self, model: Type[Base], **values):
+        """
+        Enfileirar um registro para gravação
+
+        Args:
+            model: Modelo da tabela (PostedMessage ou ActivityLog)
+            **values: Colunas do registro
+        """
+        timestamp_column = TIMESTAMP_COLUMNS.get(model)
+        if timestamp_column:
+            values.setdefault(timestamp_column, datetime.utcnow())
+
+        self._pending.setdefault(model, []).append(values)
+        self._trim()
+        if self.pending >= self.batch_size:
+            self._size_reached.set()
+
+    def _trim(self):
+        """Descartar os registros mais antigos além de WRITE_BEHIND_MAX_PENDING"""
+        excess = self.pending - self.max_pending
+        if excess <= 0:
+            return
+
+        if not self.dropped_overflow:
+            logger.warning(f"Buffer de gravação em lote cheio ({self.max_pending}): descartando os registros mais antigos")
+        for rows in self._pending.values():
+            dropped = min(excess, len(rows))
+            del rows[:dropped]
+            self.dropped_overflow += dropped
+            excess -= dropped
+            if not excess:
+                break
+
+    async def flush(self) -> int:
+        """
+        Gravar todos os registros pendentes
+
+        Returns:
+            Quantidade de registros gravados
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            self._size_reached.clear()
+            started_at = time.monotonic()
+            count = 0
+            self._retry_pending = False
+
+            for model, rows in pending.items():
+                written, retry = await self._write(model, rows)
+                count += written
+                if retry:
+                    # Devolver os registros para o próximo flush
+                    self._retry_pending = True
+                    self._pending[model] = retry + self._pending.get(model, [])
+            self._trim()
+
+            if self._retry_pending:
+                self.failed_flushes += 1
+            self.written += count
+            self.flushes += 1
+            self.last_flush_seconds = time.monotonic() - started_at
+            logger.debug(f"{count} registro(s) gravado(s) em lote em {self.last_flush_seconds:.3f}s")
+            return count
+
+    async def _write(self, model: Type[Base], rows: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Gravar os registros de uma tabela com um INSERT em lote
+
+        Returns:
+            Quantidade gravada e registros a tentar de novo (erro transitório)
+        """
+        table = model.__tablename__
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(model), rows)
+                await db.commit()
+                return len(rows), []
+
+            except (IntegrityError, DataError) as e:
+                await db.rollback()
+                if len(rows) == 1:
+                    self.dropped_invalid += 1
+                    logger.error(f"Registro inválido de {table} descartado: {str(e.orig)}")
+                    return 0, []
+                invalid = e
+
+            except Exception as e:
+                logger.error(f"Erro ao gravar {len(rows)} registro(s) de {table} em lote: {str(e)}")
+                await db.rollback()
+                return 0, rows
+
+        # Registro inválido no lote: dividir ao meio até isolá-lo
+        logger.warning(f"Lote de {len(rows)} registro(s) de {table} rejeitado ({type(invalid).__name__}), dividindo")
+        middle = len(rows) // 2
+        written, retry = await self._write(model, rows[:middle])
+        if retry:
+            return written, retry + rows[middle:]
+        second_written, retry = await self._write(model, rows[middle:])
+        return written + second_written, retry
+
+    async def run(self):
+        """Gravar periodicamente (ou ao atingir o tamanho do lote) até ser cancelado"""
+        while True:
+            try:
+                await asyncio.wait_for(self._size_reached.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # shield: cancelar a tarefa não interrompe um lote já retirado do buffer
+            await asyncio.shield(self.flush())
+
+            if self._retry_pending:
+                # Falha transitória na gravação: aguardar o intervalo antes de tentar de novo
+                await asyncio.sleep(self.flush_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "max_pending": self.max_pending,
+            "dropped_invalid": self.dropped_invalid,
+            "dropped_overflow": self.dropped_overflow,
+            "last_flush_seconds": round(self.last_flush_seconds, 4)
+        }
+
+
+# Instância compartilhada pelo fan-out e pelo shutdown da aplicação
+delivery_writer = WriteBehindWriter()